@@ -0,0 +1,229 @@
+"""Asynchronous, batched writer for the AuditLog table.
+
+``log_audit`` only enqueues a row; a background thread inserts queued rows in
+batches when ``batch_size`` rows are waiting or ``flush_interval`` seconds
+have passed. If the database is unreachable, rows are appended to a local
+JSONL spill file and replayed after the next successful write. The queue is
+bounded: when it is full, callers wait briefly and then spill to disk rather
+than grow memory without limit.
+
+Errors on the writer thread (an unwritable spill file, a corrupt line in
+it) are counted and logged, never raised, so the thread keeps running.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from database import get_connection
+
+_writer = None
+_writer_lock = threading.Lock()
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    """Background thread that batch-inserts audit rows."""
+
+    def __init__(self, connect=get_connection, batch_size=50, flush_interval=1.0,
+                 max_queue=10000, put_timeout=0.05, spill_path=None):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'batches': 0, 'spilled': 0,
+                       'replayed': 0, 'failures': 0, 'last_error': None}
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    # Producer side
+    def log(self, username, action, details=""):
+        """Queue an audit row; never blocks for longer than ``put_timeout``."""
+        row = (username, action, details, datetime.now())
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+            self._count('queued')
+        except queue.Full:
+            # Backpressure: the DB is not keeping up, keep the row on disk instead
+            self._spill([row])
+
+    def flush(self, timeout=10.0):
+        """Block until every queued row has been written or spilled."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self._queue.unfinished_tasks == 0
+
+    def close(self, timeout=10.0):
+        """Flush outstanding rows and stop the worker thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data['pending'] = self._queue.qsize()
+        return data
+
+    # Worker side
+    def _run(self):
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._queue.task_done()
+                stopping = True
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if batch and (stopping or due or len(batch) >= self.batch_size):
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # Nothing restarts this thread, so it must outlive any error
+                    self._count('failures', last_error=f"{type(e).__name__}: {e}")
+                    logger.exception("Audit writer failed to write %d rows", len(batch))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                batch = []
+                deadline = None
+
+    def _insert(self, rows):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True
+            except AttributeError:
+                pass
+            cursor.executemany("""
+                INSERT INTO AuditLog (username, action, details, timestamp)
+                VALUES (?, ?, ?, ?)
+            """, rows)
+            conn.commit()
+
+    def _write(self, rows):
+        try:
+            self._insert(rows)
+        except Exception as e:
+            self._count('failures', last_error=f"{type(e).__name__}: {e}")
+            self._spill(rows)
+            return
+        self._count('written', len(rows))
+        self._count('batches')
+        self._replay_spill()
+
+    def _spill(self, rows):
+        if not self.spill_path:
+            self._count('failures', last_error="audit rows dropped: no spill file configured")
+            return
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for username, action, details, timestamp in rows:
+                        f.write(json.dumps([username, action, details, timestamp.isoformat()]) + "\n")
+        except OSError as e:
+            self._count('failures', last_error=f"audit rows dropped: {type(e).__name__}: {e}")
+            logger.error("Dropped %d audit rows: cannot write %s: %s", len(rows), self.spill_path, e)
+            return
+        self._count('spilled', len(rows))
+
+    def _replay_spill(self):
+        """Move rows spilled while the DB was down back into AuditLog.
+
+        A replay file that cannot be read is left in place and retried after
+        the next successful write; lines that do not parse are set aside in a
+        ``.bad`` file next to it.
+        """
+        if not self.spill_path:
+            return
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            # A replay file left by an earlier failure goes first, so it is never overwritten
+            if not os.path.exists(replay_path):
+                try:
+                    os.replace(self.spill_path, replay_path)
+                except OSError:
+                    return
+        rows, bad_lines = [], []
+        try:
+            with open(replay_path, encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        username, action, details, timestamp = json.loads(line)
+                        rows.append((username, action, details, datetime.fromisoformat(timestamp)))
+                    except (TypeError, ValueError):
+                        bad_lines.append(line)
+            if bad_lines:
+                with open(self.spill_path + ".bad", 'a', encoding='utf-8') as f:
+                    f.writelines(bad_lines)
+        except OSError as e:
+            self._count('failures', last_error=f"{type(e).__name__}: {e}")
+            logger.error("Cannot replay audit spill file %s: %s", replay_path, e)
+            return
+        if bad_lines:
+            self._count('failures', last_error=f"{len(bad_lines)} unreadable audit spill lines set aside")
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            try:
+                self._insert(chunk)
+            except Exception as e:
+                self._count('failures', last_error=f"{type(e).__name__}: {e}")
+                self._spill(rows[start:])
+                break
+            self._count('replayed', len(chunk))
+        try:
+            os.remove(replay_path)
+        except OSError as e:
+            logger.error("Cannot remove replayed audit spill file %s: %s", replay_path, e)
+
+    def _count(self, name, amount=1, last_error=None):
+        with self._stats_lock:
+            self._stats[name] += amount
+            if last_error:
+                self._stats['last_error'] = last_error
+
+
+def get_audit_writer() -> AuditWriter:
+    """Return the process-wide audit writer, started on first use and flushed at exit."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(
+                    batch_size=int(os.getenv('AUDIT_BATCH_SIZE', '50')),
+                    flush_interval=float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0')),
+                    max_queue=int(os.getenv('AUDIT_MAX_QUEUE', '10000')),
+                    spill_path=os.getenv('AUDIT_SPILL_PATH', os.path.join('.cache', 'audit_spill.jsonl')),
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def log_audit(username, action, details=""):
+    get_audit_writer().log(username, action, details)
@@ -0,0 +1,121 @@
+"""Filtered, keyset-paginated reads and streaming exports of the AuditLog table.
+
+Pages are ordered newest first on ``(timestamp, id)``. Each page after the
+first starts below the last row of the previous one, so every page is an
+index seek on IX_AuditLog_timestamp, or on IX_AuditLog_username_timestamp
+when filtering by user, however far back it is.
+
+Exports read the same query in ``fetchmany`` chunks and write each chunk
+straight to the output file as CSV rows or a Parquet row group, so the whole
+log is never held in memory.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+
+import startup
+from database import get_connection
+
+AUDIT_PAGE_SIZE = 50
+EXPORT_CHUNK = 5000
+EXPORT_FORMATS = {"CSV": "csv", "Parquet": "parquet"}
+COLUMNS = ("id", "timestamp", "username", "action", "details")
+
+
+def make_filters(username=None, action=None, since=None, until=None):
+    """Hashable filter tuple; ``since``/``until`` are dates and both days are included."""
+    return (username or None, (action or "").strip() or None, since, until)
+
+
+def _filter_clause(filters):
+    username, action, since, until = filters
+    conditions, params = [], []
+    if username:
+        conditions.append("username = ?")
+        params.append(username)
+    if action:
+        conditions.append("action LIKE ?")
+        params.append(f"{action}%")
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(datetime.combine(since, time.min))
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(datetime.combine(until + timedelta(days=1), time.min))
+    return conditions, params
+
+
+def fetch_page(cursor, filters, after=None, page_size=AUDIT_PAGE_SIZE):
+    """One page of ``COLUMNS`` rows, newest first.
+
+    ``after`` is the ``(timestamp, id)`` of the last row of the previous page.
+    """
+    conditions, params = _filter_clause(filters)
+    if after:
+        # pyodbc binds datetimes as DATETIME2; cast back so the last row compares equal
+        conditions.append("(timestamp < CAST(? AS DATETIME) OR (timestamp = CAST(? AS DATETIME) AND id < ?))")
+        params.extend([after[0], after[0], after[1]])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"""
+        SELECT TOP (?) {', '.join(COLUMNS)}
+        FROM AuditLog
+        {where}
+        ORDER BY timestamp DESC, id DESC
+    """, tuple([page_size] + params))
+    return cursor.fetchall()
+
+
+def iter_rows(filters, connect=get_connection, chunk_size=EXPORT_CHUNK):
+    """Yield lists of up to ``chunk_size`` matching rows, newest first."""
+    conditions, params = _filter_clause(filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(COLUMNS)}
+            FROM AuditLog
+            {where}
+            ORDER BY timestamp DESC, id DESC
+        """, tuple(params))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def write_csv(chunks, f):
+    """Write row chunks to the binary file ``f`` as UTF-8 CSV; returns the row count."""
+    text = io.TextIOWrapper(f, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(COLUMNS)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    text.detach()
+    return count
+
+
+def write_parquet(chunks, f):
+    """Write row chunks to the binary file ``f`` as Parquet, one row group per chunk."""
+    pa = startup.lazy_import("pyarrow")
+    pq = startup.lazy_import("pyarrow.parquet")
+    schema = pa.schema([('id', pa.int64()), ('timestamp', pa.timestamp('ms')),
+                        ('username', pa.string()), ('action', pa.string()),
+                        ('details', pa.string())])
+    count = 0
+    with pq.ParquetWriter(f, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema))
+            count += len(rows)
+    return count
+
+
+def export(filters, file_format, f, connect=get_connection, chunk_size=EXPORT_CHUNK):
+    """Stream every row matching ``filters`` into ``f``; returns the row count."""
+    write = write_parquet if file_format == "parquet" else write_csv
+    return write(iter_rows(filters, connect, chunk_size), f)
@@ -0,0 +1,205 @@
+"""Password hashing and the cached user directory used for logins.
+
+Passwords are stored as salted PBKDF2-SHA256 hashes in the form
+``pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>``; the iteration count is
+tunable with AUTH_HASH_ITERATIONS. Unsalted SHA-256 hashes from earlier
+versions still verify and are replaced with a PBKDF2 hash on the next
+successful login, as are hashes made with fewer iterations than configured.
+
+``UserDirectory`` keeps the Users table in memory for a short TTL, so logins
+and the admin user list do not query SQL Server on every rerun; ``add_user``
+invalidates it. Usernames are matched case-insensitively, as SQL Server
+compares them, and a login always yields the stored spelling.
+
+Hashing runs on a small thread pool purely as a concurrency cap: the session
+logging in still waits for its own hash, but no more than ``workers`` hashes
+run at once however many sessions log in together. ``hashlib.pbkdf2_hmac``
+releases the GIL, so other sessions are not held up meanwhile.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import get_connection
+
+ALGORITHM = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 600_000
+SALT_BYTES = 16
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def legacy_hash(password):
+    """Unsalted SHA-256, the format stored before salted hashes were introduced."""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS, salt=None):
+    salt = salt if salt is not None else secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """Check ``password`` against a stored hash in either format, in constant time."""
+    if not stored:
+        return False
+    if not stored.startswith(ALGORITHM + "$"):
+        return hmac.compare_digest(legacy_hash(password), stored)
+    try:
+        _, iterations, salt, expected = stored.split("$")
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def _user_key(username):
+    # SQL Server's default collation ignores case and trailing spaces
+    return username.rstrip().casefold()
+
+
+def needs_rehash(stored, iterations=DEFAULT_ITERATIONS):
+    """True for legacy hashes and PBKDF2 hashes weaker than ``iterations``."""
+    if not stored.startswith(ALGORITHM + "$"):
+        return True
+    try:
+        return int(stored.split("$")[1]) < iterations
+    except (IndexError, ValueError):
+        return True
+
+
+class UserDirectory:
+    """Users table cached for ``ttl`` seconds, with password checks capped by a thread pool."""
+
+    def __init__(self, connect=get_connection, ttl=60.0, iterations=DEFAULT_ITERATIONS, workers=2):
+        self._connect = connect
+        self.ttl = ttl
+        self.iterations = iterations
+        self._users = {}          # _user_key(username) -> (username, password_hash, is_admin, created_date)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        # Unknown usernames are checked against this, so they take as long as real ones
+        self._dummy_hash = hash_password(secrets.token_hex(8), iterations)
+        self._stats = {'logins': 0, 'failed': 0, 'cache_hits': 0, 'cache_misses': 0,
+                       'loads': 0, 'rehashed': 0, 'verify_total': 0.0, 'verify_max': 0.0}
+
+    def verify(self, username, password):
+        """Return the stored ``(username, is_admin)`` if the credentials are valid, else None.
+
+        Blocks the caller for the hash; the pool only limits how many run at once.
+        """
+        user = self._lookup(username)
+        stored = user[1] if user else self._dummy_hash
+        started = time.perf_counter()
+        valid = self._executor.submit(verify_password, password, stored).result()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats['verify_total'] += elapsed
+            self._stats['verify_max'] = max(self._stats['verify_max'], elapsed)
+            self._stats['logins' if user and valid else 'failed'] += 1
+        if not (user and valid):
+            return None
+        if needs_rehash(stored, self.iterations):
+            self._rehash(user[0], password)
+        return user[0], user[2]
+
+    def add_user(self, username, password, is_admin=False):
+        password_hash = self._executor.submit(hash_password, password, self.iterations).result()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO Users (username, password_hash, is_admin)
+                VALUES (?, ?, ?)
+            """, (username, password_hash, is_admin))
+            conn.commit()
+        self.invalidate()
+
+    def users(self):
+        """``(username, created_date, is_admin)`` for every user, newest first."""
+        self._refresh_if_stale()
+        with self._lock:
+            users = [(username, created_date, is_admin)
+                     for username, _, is_admin, created_date in self._users.values()]
+        return sorted(users, key=lambda user: user[1], reverse=True)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['cached_users'] = len(self._users)
+        checks = data['logins'] + data['failed']
+        data['avg_verify_ms'] = data.pop('verify_total') / checks * 1000 if checks else 0.0
+        data['max_verify_ms'] = data.pop('verify_max') * 1000
+        return data
+
+    def _lookup(self, username):
+        self._refresh_if_stale()
+        key = _user_key(username)
+        with self._lock:
+            user = self._users.get(key)
+            self._stats['cache_hits' if user else 'cache_misses'] += 1
+        if user:
+            return user
+        # Possibly added by another process since the last load
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT username, password_hash, is_admin, created_date FROM Users "
+                           "WHERE username = ?", (username,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        user = (row[0], row[1], row[2], row[3])
+        with self._lock:
+            self._users[_user_key(row[0])] = user
+        return user
+
+    def _rehash(self, username, password):
+        password_hash = self._executor.submit(hash_password, password, self.iterations).result()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE Users SET password_hash = ? WHERE username = ?",
+                           (password_hash, username))
+            conn.commit()
+        with self._lock:
+            user = self._users.get(_user_key(username))
+            if user:
+                self._users[_user_key(username)] = (user[0], password_hash) + user[2:]
+            self._stats['rehashed'] += 1
+
+    def _refresh_if_stale(self):
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+        if fresh:
+            return
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT username, password_hash, is_admin, created_date FROM Users")
+            users = {_user_key(row[0]): (row[0], row[1], row[2], row[3]) for row in cursor.fetchall()}
+        with self._lock:
+            self._users = users
+            self._loaded_at = time.monotonic()
+            self._stats['loads'] += 1
+
+
+def get_user_directory() -> UserDirectory:
+    """Return the process-wide user directory configured from the AUTH_* settings."""
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                _directory = UserDirectory(
+                    ttl=float(os.getenv('AUTH_CACHE_TTL', '60')),
+                    iterations=int(os.getenv('AUTH_HASH_ITERATIONS', str(DEFAULT_ITERATIONS))),
+                    workers=int(os.getenv('AUTH_HASH_WORKERS', '2')),
+                )
+    return _directory
@@ -0,0 +1,243 @@
+"""Headless batch ingestion of invoice files into SQL Server.
+
+Walks directories (or reads a manifest of paths), extracts every invoice
+concurrently through Gemini with rate limiting and retry/backoff, and writes
+the results to the database in multi-invoice transactions. Files that were
+already inserted are skipped before any rasterization or API call.
+
+Usage:
+    python batch_ingest.py invoices/ --workers 4 --rpm 60
+    python batch_ingest.py --manifest backlog.txt --report results.jsonl
+    python batch_ingest.py invoices/ --fake-model --dry-run
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import extraction
+from database import get_connection, insert_audit_log, insert_invoices, upsert_invoices
+from extraction_cache import get_extraction_cache
+from fingerprints import get_fingerprint_index, page_hash
+from model_client import ModelClient, RateLimiter, create_backend
+from upload_cache import upload_digest
+
+SUPPORTED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png'}
+
+
+def discover_files(paths, manifest=None):
+    """Return supported invoice files under ``paths`` and listed in ``manifest``."""
+    files = []
+    if manifest:
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    files.append(line)
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    # De-duplicate while keeping order
+    return list(dict.fromkeys(files))
+
+
+def extract_file(path, model, prompt="", cache=None, retries=3, chunk_pages=extraction.CHUNK_PAGES,
+                 chunk_workers=extraction.CHUNK_WORKERS, fingerprint_index=None):
+    """Run the extraction pipeline for one file and return a result record.
+
+    With a ``fingerprint_index``, files already inserted as an invoice are
+    reported as duplicates without being rasterized or sent to the model.
+    """
+    started = time.monotonic()
+    result = {'path': path, 'status': 'failed', 'invoice_id': None, 'pages': 0,
+              'from_cache': False, 'error': None}
+    try:
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+        content_hash = upload_digest(file_bytes)
+        if fingerprint_index is not None:
+            match = fingerprint_index.find_exact([content_hash]).get(content_hash)
+            if match:
+                result.update(status='duplicate', invoice_id=match['invoice_id'])
+                result['seconds'] = round(time.monotonic() - started, 3)
+                return result
+
+        pages = extraction.load_pages(path, file_bytes)
+        del file_bytes
+        result['pages'] = len(pages)
+        if not pages:
+            raise ValueError("no pages found")
+        result['documents'] = [(os.path.basename(path), content_hash, [page_hash(page) for page in pages])]
+        image_parts, _ = extraction.prepare_image_data_list(pages)
+        del pages
+
+        # Long documents are split into page windows, each retried on its own; unparseable
+        # responses are re-requested inside extract_invoice and never cached
+        response_text, from_cache = extraction.extract_invoice(
+            model, prompt, image_parts, cache=cache, chunk_pages=chunk_pages,
+            workers=chunk_workers, retries=retries, parse_retries=retries,
+        )
+        data = extraction.clean_json_response(response_text)
+        result.update(status='extracted', invoice_id=data.get('invoice_id'),
+                      from_cache=from_cache, data=data)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def write_batch(results, username, replace=False, fingerprint_index=None):
+    """Insert a batch of extracted invoices in one transaction.
+
+    If the batch fails (e.g. one duplicate invoice_id), fall back to one
+    transaction per invoice so a single bad row does not sink the others.
+    With ``replace``, invoices whose invoice_id already exists are updated
+    instead of failing. Source file fingerprints are stored alongside.
+    """
+    write = upsert_invoices if replace else insert_invoices
+
+    def record_fingerprints(cursor, batch):
+        if fingerprint_index is not None:
+            for result in batch:
+                fingerprint_index.record(cursor, result['data']['invoice_id'], result['documents'], username)
+
+    def index_fingerprints(batch):
+        if fingerprint_index is not None:
+            for result in batch:
+                fingerprint_index.add(result['data']['invoice_id'], result['documents'])
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            write(cursor, [result['data'] for result in results], username)
+            record_fingerprints(cursor, results)
+            conn.commit()
+            index_fingerprints(results)
+            for result in results:
+                result['status'] = 'inserted'
+            return
+        except Exception:
+            conn.rollback()
+
+        for result in results:
+            try:
+                write(cursor, [result['data']], username)
+                record_fingerprints(cursor, [result])
+                conn.commit()
+                index_fingerprints([result])
+                result['status'] = 'inserted'
+            except Exception as e:
+                conn.rollback()
+                result['status'] = 'failed'
+                result['error'] = f"{type(e).__name__}: {e}"
+
+
+def run(files, model, workers=4, batch_size=50, prompt="", username="batch",
+        retries=3, cache=None, dry_run=False, report=None, chunk_pages=extraction.CHUNK_PAGES,
+        chunk_workers=extraction.CHUNK_WORKERS, fingerprint_index=None, replace=False):
+    """Extract ``files`` concurrently and write them to the DB in batches."""
+    summary = {'files': len(files), 'inserted': 0, 'extracted': 0, 'duplicate': 0, 'failed': 0,
+               'cached': 0}
+    pending = []
+
+    def finish(batch):
+        if not dry_run and batch:
+            write_batch(batch, username, replace, fingerprint_index)
+        for result in batch:
+            record(result)
+
+    def record(result):
+        summary[result['status']] += 1
+        summary['cached'] += int(result['from_cache'])
+        if report:
+            report.write(json.dumps(result, default=str) + "\n")
+            report.flush()
+        print(f"[{result['status']:>9}] {result['path']} {result.get('invoice_id') or result.get('error') or ''}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extract_file, path, model, prompt, cache, retries,
+                                   chunk_pages, chunk_workers, fingerprint_index) for path in files]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] != 'extracted':
+                record(result)
+                continue
+            pending.append(result)
+            if len(pending) >= batch_size:
+                finish(pending)
+                pending = []
+        finish(pending)
+
+    if not dry_run:
+        with get_connection() as conn:
+            insert_audit_log(conn.cursor(), username, "Batch invoice ingestion",
+                             f"Files: {summary['files']}, inserted: {summary['inserted']}, "
+                             f"duplicates: {summary['duplicate']}, failed: {summary['failed']}")
+            conn.commit()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-ingest invoice files into SQL Server.")
+    parser.add_argument('paths', nargs='*', help="Files or directories to ingest")
+    parser.add_argument('--manifest', help="Text file listing one invoice path per line")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent extractions")
+    parser.add_argument('--rpm', type=float, default=60, help="Maximum Gemini requests per minute")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="Retries per failed Gemini call, and re-requests of a response (or page "
+                             "window) that could not be parsed")
+    parser.add_argument('--chunk-pages', type=int, default=extraction.CHUNK_PAGES,
+                        help="Split documents longer than this into page windows (0 disables)")
+    parser.add_argument('--chunk-workers', type=int, default=extraction.CHUNK_WORKERS,
+                        help="Concurrent page windows per document")
+    parser.add_argument('--batch-size', type=int, default=50, help="Invoices per DB transaction")
+    parser.add_argument('--prompt', default="", help="Extra extraction instructions")
+    parser.add_argument('--username', default="batch", help="Recorded as created_by")
+    parser.add_argument('--report', help="Write one JSON result per file to this path")
+    parser.add_argument('--no-cache', action='store_true', help="Bypass the extraction cache")
+    parser.add_argument('--dry-run', action='store_true', help="Extract only, do not write to the DB")
+    parser.add_argument('--replace', action='store_true',
+                        help="Update invoices whose invoice_id already exists instead of failing them")
+    parser.add_argument('--no-duplicate-check', action='store_true',
+                        help="Extract files even if they were already inserted")
+    parser.add_argument('--fake-model', action='store_true', help="Use an offline fake model (no API calls)")
+    args = parser.parse_args(argv)
+
+    files = discover_files(args.paths, args.manifest)
+    if not files:
+        parser.error("no invoice files found")
+
+    if not args.fake_model:
+        from dotenv import load_dotenv
+        load_dotenv()
+    # API errors are retried by the client; extraction retries unparseable responses
+    model = ModelClient(create_backend(fake=args.fake_model), RateLimiter(args.rpm),
+                        retries=args.retries)
+    cache = None if args.no_cache else get_extraction_cache()
+    # Dry runs may have no database to check against
+    fingerprint_index = None if args.dry_run or args.no_duplicate_check else get_fingerprint_index()
+
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+    try:
+        summary = run(files, model, workers=args.workers, batch_size=args.batch_size,
+                      prompt=args.prompt, username=args.username, retries=args.retries,
+                      cache=cache, dry_run=args.dry_run, report=report,
+                      chunk_pages=args.chunk_pages, chunk_workers=args.chunk_workers,
+                      fingerprint_index=fingerprint_index, replace=args.replace)
+    finally:
+        if report:
+            report.close()
+
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Compare per-row and bulk (executemany) invoice inserts.
+
+Runs against an in-memory SQLite database by default, adding a simulated
+network round trip (--rtt-ms) to every statement since SQLite has none. Pass
+--sql-server to measure against the configured SQL Server instead; each run
+happens inside a transaction that is rolled back, so no rows are left behind.
+
+Usage:
+    python benchmarks/bench_bulk_insert.py --invoices 50 --items 200
+    python benchmarks/bench_bulk_insert.py --sql-server
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_sql_server_connection, insert_invoices  # noqa: E402
+from sqlite_schema import SQLITE_SCHEMA, connect  # noqa: E402
+
+
+def make_invoices(count, items_per_invoice):
+    run_id = uuid.uuid4().hex[:8]
+    return [
+        {
+            'invoice_id': f"BENCH-{run_id}-{n}",
+            'customer': f"Customer {n % 20}",
+            'invoice_date': "2024-06-15",
+            'total': round(items_per_invoice * 9.99, 2),
+            'items': [
+                {'description': f"Item {i}", 'quantity': 1 + i % 5, 'price': 9.99}
+                for i in range(items_per_invoice)
+            ],
+        }
+        for n in range(count)
+    ]
+
+
+def insert_per_row(cursor, invoices, created_by):
+    """The original insert path: one execute per master row and per item."""
+    for data in invoices:
+        cursor.execute("""
+            INSERT INTO InvoiceMaster (invoice_id, customer, invoice_date, total, created_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, (data['invoice_id'], data['customer'], data['invoice_date'], data['total'], created_by))
+        for item in data['items']:
+            cursor.execute("""
+                INSERT INTO InvoiceItems (invoice_id, description, quantity, price)
+                VALUES (?, ?, ?, ?)
+            """, (data['invoice_id'], item['description'], item['quantity'], item['price']))
+
+
+class RoundTripCursor:
+    """Cursor proxy that sleeps once per statement to mimic a network round trip."""
+
+    def __init__(self, cursor, rtt):
+        self._cursor = cursor
+        self._rtt = rtt
+
+    def execute(self, *args):
+        time.sleep(self._rtt)
+        return self._cursor.execute(*args)
+
+    def executemany(self, *args):
+        time.sleep(self._rtt)
+        return self._cursor.executemany(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def time_insert(conn, insert, invoices, rtt=0.0):
+    cursor = conn.cursor()
+    if rtt:
+        cursor = RoundTripCursor(cursor, rtt)
+    started = time.perf_counter()
+    insert(cursor, invoices, "bench")
+    elapsed = time.perf_counter() - started
+    conn.rollback()
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=20)
+    parser.add_argument('--items', type=int, default=200, help="Line items per invoice")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--rtt-ms', type=float, default=0.5,
+                        help="Simulated round trip per statement for SQLite (ignored with --sql-server)")
+    parser.add_argument('--sql-server', action='store_true', help="Use the configured SQL Server")
+    args = parser.parse_args(argv)
+
+    rtt = 0.0
+    if args.sql_server:
+        conn = get_sql_server_connection()
+    else:
+        rtt = args.rtt_ms / 1000
+        conn = connect(':memory:')
+        conn.executescript(SQLITE_SCHEMA)
+
+    rows = args.invoices * (args.items + 1)
+    print(f"{args.invoices} invoices x {args.items} items ({rows} rows), best of {args.repeat}")
+    results = {}
+    for name, insert in (("per-row", insert_per_row), ("bulk", insert_invoices)):
+        best = min(time_insert(conn, insert, make_invoices(args.invoices, args.items), rtt)
+                   for _ in range(args.repeat))
+        results[name] = best
+        print(f"  {name:>8}: {best * 1000:9.1f} ms  {rows / best:12,.0f} rows/s")
+    print(f"  speed-up: {results['per-row'] / results['bulk']:.1f}x")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Login latency under concurrent sessions: per-login query vs the cached user directory.
+
+Each simulated session logs in repeatedly from its own thread. The
+"uncached" path is the original one: a Users query per login and the hash
+checked on the session's thread. The "directory" path is auth.UserDirectory:
+users served from memory and hashes checked on its bounded thread pool.
+Runs against a temporary SQLite database, adding a simulated network round
+trip (--rtt-ms) to every statement.
+
+Usage:
+    python benchmarks/bench_login.py --sessions 1 8 32 --iterations 600000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import UserDirectory, hash_password, verify_password  # noqa: E402
+from sqlite_schema import SQLITE_SCHEMA  # noqa: E402
+
+
+class RoundTripCursor:
+    """Cursor proxy that sleeps once per statement to mimic a network round trip."""
+
+    def __init__(self, cursor, rtt):
+        self._cursor = cursor
+        self._rtt = rtt
+
+    def execute(self, *args):
+        time.sleep(self._rtt)
+        return self._cursor.execute(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class RoundTripConnection:
+    def __init__(self, conn, rtt):
+        self._conn = conn
+        self._rtt = rtt
+
+    def cursor(self):
+        return RoundTripCursor(self._conn.cursor(), self._rtt)
+
+    def commit(self):
+        self._conn.commit()
+
+
+def make_connect(path, rtt):
+    @contextmanager
+    def connect():
+        conn = sqlite3.connect(path)
+        try:
+            yield RoundTripConnection(conn, rtt)
+        finally:
+            conn.close()
+    return connect
+
+
+def create_users(path, count, iterations):
+    conn = sqlite3.connect(path)
+    conn.executescript(SQLITE_SCHEMA)
+    stored = hash_password("secret", iterations)
+    conn.executemany("INSERT INTO Users (username, password_hash) VALUES (?, ?)",
+                     [(f"user{n}", stored) for n in range(count)])
+    conn.commit()
+    conn.close()
+
+
+def uncached_login(connect):
+    def login(username, password):
+        with connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT password_hash, is_admin FROM Users WHERE username = ?", (username,))
+            row = cursor.fetchone()
+        return (username, row[1]) if row and verify_password(password, row[0]) else None
+    return login
+
+
+def run_sessions(login, sessions, logins_per_session, users):
+    latencies = []
+    lock = threading.Lock()
+
+    def session(idx):
+        own = []
+        for n in range(logins_per_session):
+            started = time.perf_counter()
+            assert login(f"user{(idx + n) % users}", "secret")
+            own.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=session, args=(idx,)) for idx in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--logins', type=int, default=5, help="Logins per session")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=600_000, help="PBKDF2 iterations")
+    parser.add_argument('--hash-workers', type=int, default=2, help="UserDirectory thread pool size")
+    parser.add_argument('--rtt-ms', type=float, default=2.0, help="Simulated round trip per statement")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        create_users(path, args.users, args.iterations)
+        connect = make_connect(path, args.rtt_ms / 1000)
+        directory = UserDirectory(connect, ttl=60, iterations=args.iterations, workers=args.hash_workers)
+
+        print(f"{args.users} users, PBKDF2 x {args.iterations:,}, {args.rtt_ms} ms RTT, "
+              f"{args.logins} logins per session")
+        print(f"  {'sessions':>8} {'path':>10} {'p50 ms':>9} {'p95 ms':>9} {'logins/s':>9}")
+        for sessions in args.sessions:
+            for name, login in (("uncached", uncached_login(connect)), ("directory", directory.verify)):
+                latencies, elapsed = run_sessions(login, sessions, args.logins, args.users)
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                print(f"  {sessions:>8} {name:>10} {statistics.median(latencies) * 1000:9.1f} "
+                      f"{p95 * 1000:9.1f} {len(latencies) / elapsed:9.1f}")
+        print(f"  directory: {directory.stats()}")
+
+
+if __name__ == "__main__":
+    main()
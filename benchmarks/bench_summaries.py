@@ -0,0 +1,132 @@
+"""Compare reporting queries over the invoice tables with the same queries over the summaries.
+
+Fills an in-memory SQLite database through database.insert_invoices, which
+maintains CustomerSales and DailySales incrementally, checks that the
+summaries match aggregates computed from the invoice tables, then times each
+question both ways. Pass --sql-server to time the queries against the
+configured SQL Server instead (read-only; no rows are inserted).
+
+Usage:
+    python benchmarks/bench_summaries.py --invoices 20000 --items 10
+    python benchmarks/bench_summaries.py --sql-server
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_sql_server_connection, insert_invoices  # noqa: E402
+from sqlite_schema import SQLITE_SCHEMA, connect  # noqa: E402
+
+MONTH = ("2024-03-01", "2024-04-01")
+
+# question -> (query over the invoice tables, query over the summaries, params)
+QUERIES = {
+    "invoice count": (
+        "SELECT COUNT(*) FROM InvoiceMaster",
+        "SELECT SUM(invoice_count) FROM CustomerSales",
+        ()),
+    "total sales by customer": (
+        "SELECT COALESCE(customer, ''), SUM(total) FROM InvoiceMaster "
+        "GROUP BY COALESCE(customer, '') ORDER BY 1",
+        "SELECT customer, total_sales FROM CustomerSales ORDER BY 1",
+        ()),
+    "items by customer": (
+        "SELECT COALESCE(im.customer, ''), COUNT(it.id) FROM InvoiceMaster im "
+        "JOIN InvoiceItems it ON it.invoice_id = im.invoice_id "
+        "GROUP BY COALESCE(im.customer, '') ORDER BY 1",
+        "SELECT customer, item_count FROM CustomerSales WHERE item_count > 0 ORDER BY 1",
+        ()),
+    "invoices in a month": (
+        "SELECT COUNT(*) FROM InvoiceMaster WHERE invoice_date >= ? AND invoice_date < ?",
+        "SELECT SUM(invoice_count) FROM DailySales WHERE invoice_date >= ? AND invoice_date < ?",
+        MONTH),
+    "sales by day": (
+        "SELECT invoice_date, SUM(total) FROM InvoiceMaster WHERE invoice_date IS NOT NULL "
+        "GROUP BY invoice_date ORDER BY 1",
+        "SELECT invoice_date, total_sales FROM DailySales ORDER BY 1",
+        ()),
+}
+
+
+def make_invoices(count, items_per_invoice, customers):
+    start = date(2023, 1, 1)
+    invoices = []
+    for n in range(count):
+        items = [
+            {'description': f"Item {i}", 'quantity': random.randint(1, 5), 'price': 9.99}
+            for i in range(random.randint(0, items_per_invoice * 2))
+        ]
+        invoices.append({
+            'invoice_id': f"BENCH-{n}",
+            'customer': f"Customer {n % customers}",
+            'invoice_date': (start + timedelta(days=n % 730)).isoformat(),
+            'total': round(sum(item['quantity'] * item['price'] for item in items), 2),
+            'items': items,
+        })
+    return invoices
+
+
+def fill(conn, invoices, batch_size=500):
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    for start in range(0, len(invoices), batch_size):
+        insert_invoices(cursor, invoices[start:start + batch_size], "bench")
+        conn.commit()
+    return time.perf_counter() - started
+
+
+def normalized(rows):
+    return [tuple(round(value, 2) if isinstance(value, float) else value for value in row)
+            for row in rows]
+
+
+def best_time(cursor, sql, params, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=20000)
+    parser.add_argument('--items', type=int, default=10, help="Average line items per invoice")
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sql-server', action='store_true', help="Time queries on the configured SQL Server")
+    args = parser.parse_args(argv)
+
+    if args.sql_server:
+        conn = get_sql_server_connection()
+        print(f"SQL Server, best of {args.repeat}")
+    else:
+        random.seed(1)
+        conn = connect(':memory:')
+        conn.executescript(SQLITE_SCHEMA)
+        invoices = make_invoices(args.invoices, args.items, args.customers)
+        elapsed = fill(conn, invoices)
+        print(f"{args.invoices} invoices, ~{args.items} items each, {args.customers} customers "
+              f"(inserted with summaries in {elapsed:.1f} s), best of {args.repeat}")
+
+    cursor = conn.cursor()
+    print(f"  {'question':<24} {'tables ms':>10} {'summary ms':>11} {'speed-up':>9}  match")
+    for question, (base_sql, summary_sql, params) in QUERIES.items():
+        base, base_rows = best_time(cursor, base_sql, params, args.repeat)
+        summary, summary_rows = best_time(cursor, summary_sql, params, args.repeat)
+        match = normalized(base_rows) == normalized(summary_rows)
+        print(f"  {question:<24} {base * 1000:10.2f} {summary * 1000:11.2f} {base / summary:8.1f}x  "
+              f"{'yes' if match else 'NO'}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
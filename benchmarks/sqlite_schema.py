@@ -0,0 +1,82 @@
+"""SQLite version of the app schema, shared by the benchmarks.
+
+Keep it in step with migrations.py: the insert helpers in database.py write
+to every table they maintain (InvoiceItems, CustomerSales, DailySales), so a
+benchmark whose schema lacks one of them fails. Open the database with
+``connect`` so the SQL Server table hints those helpers use are dropped.
+"""
+import re
+import sqlite3
+
+# e.g. "FROM CustomerSales WITH (UPDLOCK, HOLDLOCK)"; SQLite locks the whole database instead
+_TABLE_HINT = re.compile(r"\s+WITH\s*\((?:\s*(?:UPDLOCK|HOLDLOCK|ROWLOCK|NOLOCK)\s*,?)+\)", re.I)
+
+
+class HintlessCursor(sqlite3.Cursor):
+    """Cursor that strips SQL Server table hints before running a statement."""
+
+    def execute(self, sql, parameters=()):
+        return super().execute(_TABLE_HINT.sub("", sql), parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return super().executemany(_TABLE_HINT.sub("", sql), seq_of_parameters)
+
+
+class HintlessConnection(sqlite3.Connection):
+    def cursor(self, factory=HintlessCursor):
+        return super().cursor(factory)
+
+
+def connect(database=':memory:'):
+    """SQLite connection whose cursors accept the app's SQL Server table hints."""
+    return sqlite3.connect(database, factory=HintlessConnection)
+
+SQLITE_SCHEMA = """
+    CREATE TABLE Users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL COLLATE NOCASE,  -- case-insensitive, like SQL Server
+        password_hash TEXT NOT NULL,
+        created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        is_admin INTEGER DEFAULT 0
+    );
+    CREATE TABLE InvoiceMaster (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id TEXT UNIQUE NOT NULL,
+        customer TEXT,
+        invoice_date TEXT,
+        total REAL,
+        created_by TEXT,
+        created_date TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE InvoiceItems (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id TEXT NOT NULL,
+        description TEXT,
+        quantity INTEGER,
+        price REAL
+    );
+    CREATE INDEX IX_InvoiceItems_invoice_id ON InvoiceItems (invoice_id, id);
+    CREATE TABLE CustomerSales (
+        customer TEXT NOT NULL PRIMARY KEY,
+        invoice_count INTEGER NOT NULL,
+        total_sales REAL NOT NULL,
+        item_count INTEGER NOT NULL,
+        item_quantity INTEGER NOT NULL
+    );
+    CREATE TABLE DailySales (
+        invoice_date TEXT NOT NULL PRIMARY KEY,
+        invoice_count INTEGER NOT NULL,
+        total_sales REAL NOT NULL,
+        item_count INTEGER NOT NULL,
+        item_quantity INTEGER NOT NULL
+    );
+    CREATE TABLE DocumentFingerprints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content_hash TEXT NOT NULL UNIQUE,
+        file_name TEXT,
+        invoice_id TEXT NOT NULL,
+        page_hashes TEXT,
+        created_by TEXT,
+        created_date TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
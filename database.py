@@ -0,0 +1,157 @@
+"""SQL Server connectivity shared by the Streamlit app and offline tools."""
+import os
+import threading
+
+import summaries
+from db_pool import ConnectionPool
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Connect to SQL Server
+def get_sql_server_connection():
+    import pyodbc
+    conn = pyodbc.connect(
+        "Driver={ODBC Driver 17 for SQL Server};"
+        "Server=DESKTOP-LM2ET8D\\SQLEXPRESS;"   # Change to your SQL Server name
+        "Database=DEMODB1;"             # Change to your database
+        "Trusted_Connection=yes;"         # Or use UID and PWD
+    )
+    return conn
+
+
+def configure_pool(connect=None, **options):
+    """Replace the process-wide pool, e.g. with a sqlite3 factory for offline runs."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(connect or get_sql_server_connection, **options)
+        return _pool
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it from DB_POOL_* settings on first use.
+
+    Streamlit re-runs only the main script, so this module-level pool is
+    shared by every session served by the same process.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_sql_server_connection,
+                    size=int(os.getenv('DB_POOL_SIZE', '5')),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                    max_idle=float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+                    health_check_interval=float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30')),
+                )
+    return _pool
+
+
+def get_connection(timeout=None):
+    """Check out a pooled connection: ``with get_connection() as conn: ...``"""
+    return get_pool().connection(timeout)
+
+
+def enable_fast_executemany(cursor):
+    """Send executemany parameters as one array (pyodbc); no-op on other drivers."""
+    try:
+        cursor.fast_executemany = True
+    except AttributeError:
+        pass
+    return cursor
+
+
+def insert_invoices(cursor, invoices, created_by):
+    """Bulk-insert extracted invoices (master rows plus items); the caller commits.
+
+    Master rows and line items are each sent as a single parameter array, so
+    an invoice with hundreds of lines costs two round trips instead of one per
+    line. Run it inside one transaction: if any row fails the caller rolls
+    back and neither table is left half-written. The reporting summaries are
+    updated in the same transaction.
+    """
+    master_rows = [
+        (data['invoice_id'], data['customer'], data['invoice_date'], data['total'], created_by)
+        for data in invoices
+    ]
+    item_rows = [
+        (data['invoice_id'], item['description'], item['quantity'], item['price'])
+        for data in invoices
+        for item in data['items']
+    ]
+
+    enable_fast_executemany(cursor)
+    cursor.executemany("""
+        INSERT INTO InvoiceMaster (invoice_id, customer, invoice_date, total, created_by)
+        VALUES (?, ?, ?, ?, ?)
+    """, master_rows)
+    if item_rows:
+        cursor.executemany("""
+            INSERT INTO InvoiceItems (invoice_id, description, quantity, price)
+            VALUES (?, ?, ?, ?)
+        """, item_rows)
+    summaries.apply(cursor, summaries.invoice_totals(invoices))
+
+
+def insert_invoice(cursor, data, created_by):
+    """Insert one extracted invoice; the caller commits."""
+    insert_invoices(cursor, [data], created_by)
+
+
+def existing_invoice_ids(cursor, invoice_ids):
+    """The subset of ``invoice_ids`` already present in InvoiceMaster."""
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    if not invoice_ids:
+        return set()
+    placeholders = ", ".join("?" for _ in invoice_ids)
+    cursor.execute(f"SELECT invoice_id FROM InvoiceMaster WHERE invoice_id IN ({placeholders})",
+                   tuple(invoice_ids))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def upsert_invoices(cursor, invoices, created_by):
+    """Insert new invoices and replace existing ones with the same invoice_id; the caller commits.
+
+    A replaced invoice gets the new header values and its line items are
+    swapped for the new ones; its old totals are taken out of the summaries.
+    New invoices still go through the bulk insert.
+    """
+    existing = existing_invoice_ids(cursor, [data['invoice_id'] for data in invoices])
+    replaced = [data for data in invoices if data['invoice_id'] in existing]
+    if replaced:
+        previous = summaries.stored_totals(cursor, [data['invoice_id'] for data in replaced])
+        enable_fast_executemany(cursor)
+        cursor.executemany("""
+            UPDATE InvoiceMaster
+            SET customer = ?, invoice_date = ?, total = ?, created_by = ?
+            WHERE invoice_id = ?
+        """, [(data['customer'], data['invoice_date'], data['total'], created_by, data['invoice_id'])
+              for data in replaced])
+        cursor.executemany("DELETE FROM InvoiceItems WHERE invoice_id = ?",
+                           [(data['invoice_id'],) for data in replaced])
+        item_rows = [
+            (data['invoice_id'], item['description'], item['quantity'], item['price'])
+            for data in replaced
+            for item in data['items']
+        ]
+        if item_rows:
+            cursor.executemany("""
+                INSERT INTO InvoiceItems (invoice_id, description, quantity, price)
+                VALUES (?, ?, ?, ?)
+            """, item_rows)
+        summaries.apply(cursor, summaries.invoice_totals(replaced), previous)
+    new = [data for data in invoices if data['invoice_id'] not in existing]
+    if new:
+        insert_invoices(cursor, new, created_by)
+    return len(replaced)
+
+
+def insert_audit_log(cursor, username, action, details=""):
+    cursor.execute("""
+        INSERT INTO AuditLog (username, action, details)
+        VALUES (?, ?, ?)
+    """, (username, action, details))
@@ -0,0 +1,233 @@
+"""Thread-safe pool of reusable DB-API connections.
+
+The pool only needs a zero-argument ``connect`` callable, so it works the same
+against pyodbc/SQL Server in the app and against sqlite3 or a fake driver
+when exercised offline.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the checkout timeout."""
+
+
+class PoolClosed(Exception):
+    """Raised when checking out from a pool that has been closed."""
+
+
+class PoolMetrics:
+    """Counters describing how the pool is being used."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0          # successful acquisitions
+        self.misses = 0             # acquisitions that had to open a new connection
+        self.waits = 0              # acquisitions that blocked because the pool was exhausted
+        self.wait_time_total = 0.0  # seconds spent blocked across all waits
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+        self.evicted_idle = 0
+        self.health_check_failures = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.waits += 1
+            self.wait_time_total += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def snapshot(self):
+        """Return a plain dict copy of the counters (safe to render in the UI)."""
+        with self._lock:
+            data = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+        data['avg_wait_ms'] = (data['wait_time_total'] / data['waits'] * 1000) if data['waits'] else 0.0
+        data['hit_ratio'] = (1 - data['misses'] / data['checkouts']) if data['checkouts'] else 0.0
+        return data
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections with health checks and idle eviction.
+
+    ``size`` caps the number of open connections. Connections idle for longer
+    than ``max_idle`` seconds are closed; connections idle for longer than
+    ``health_check_interval`` seconds are pinged with ``health_check_query``
+    before being handed out again.
+    """
+
+    def __init__(self, connect, size=5, timeout=30.0, max_idle=300.0,
+                 health_check_query="SELECT 1", health_check_interval=30.0):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_query = health_check_query
+        self.health_check_interval = health_check_interval
+        self.metrics = PoolMetrics()
+        self._idle = deque()  # (connection, last_returned_monotonic)
+        self._open = 0        # connections handed out + idle
+        self._closed = False
+        self._cond = threading.Condition()
+
+    # Checkout / return
+    def acquire(self, timeout=None):
+        """Check out a connection, opening a new one if the pool is not full."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        wait_started = None
+
+        while True:
+            conn, last_used, expired = None, None, []
+            with self._cond:
+                if self._closed:
+                    raise PoolClosed("Connection pool is closed")
+                expired = self._pop_expired_locked(time.monotonic())
+                if self._idle:
+                    conn, last_used = self._idle.pop()  # LIFO keeps the warmest connection busy
+                elif self._open < self.size:
+                    self._open += 1
+                else:
+                    now = time.monotonic()
+                    if wait_started is None:
+                        wait_started = now
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        # Timed-out checkouts waited too; leaving them out would understate contention
+                        self.metrics.record_wait(now - wait_started)
+                        self.metrics.incr('timeouts')
+                        raise PoolTimeout(f"No connection available after {timeout:.1f}s")
+                    self._cond.wait(remaining)
+                    continue
+            self._close_all(expired)
+
+            if wait_started is not None:
+                self.metrics.record_wait(time.monotonic() - wait_started)
+                wait_started = None
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+                self.metrics.incr('created')
+                self.metrics.incr('misses')
+            elif time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+                self.metrics.incr('health_check_failures')
+                self._discard(conn)
+                continue
+
+            self.metrics.incr('checkouts')
+            return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction."""
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                self._open -= 1
+                self._close_all([conn])
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and always returns it."""
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    # Maintenance
+    def evict_idle(self):
+        """Close connections that have been idle longer than ``max_idle``."""
+        with self._cond:
+            expired = self._pop_expired_locked(time.monotonic())
+        self._close_all(expired)
+        return len(expired)
+
+    def close(self):
+        """Close idle connections and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._open -= len(idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_all(idle)
+
+    def stats(self):
+        """Metrics snapshot plus the current pool occupancy."""
+        data = self.metrics.snapshot()
+        with self._cond:
+            data['size'] = self.size
+            data['open'] = self._open
+            data['idle'] = len(self._idle)
+            data['in_use'] = self._open - len(self._idle)
+        return data
+
+    # Internal helpers
+    def _pop_expired_locked(self, now):
+        if self.max_idle is None:
+            return []
+        expired = []
+        # Oldest connections sit at the left of the deque
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            expired.append(self._idle.popleft()[0])
+        if expired:
+            self._open -= len(expired)
+            self.metrics.incr('evicted_idle', len(expired))
+            self._cond.notify(len(expired))
+        return expired
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.health_check_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._forget()
+        self._close_all([conn])
+
+    def _forget(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def _close_all(self, conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self.metrics.incr('closed')
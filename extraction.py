@@ -0,0 +1,467 @@
+"""Invoice extraction steps shared by the Streamlit page and the batch CLI.
+
+Nothing here touches Streamlit: failures are raised and it is up to the
+caller to surface them.
+"""
+import io
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from PIL import Image
+
+import startup
+from extraction_cache import make_cache_key
+from image_prep import prepare_page
+from invoice_json import parse_invoice
+from json_stream import IncrementalInvoiceParser
+from model_client import MODEL_NAME
+
+# Documents longer than this many pages are extracted in page windows
+CHUNK_PAGES = int(os.getenv('EXTRACTION_CHUNK_PAGES', '8'))
+CHUNK_WORKERS = int(os.getenv('EXTRACTION_CHUNK_WORKERS', '3'))
+CHUNK_RETRIES = int(os.getenv('EXTRACTION_CHUNK_RETRIES', '2'))
+# Re-requests of a single-request (or streamed) extraction whose response does not parse
+PARSE_RETRIES = int(os.getenv('EXTRACTION_PARSE_RETRIES', '2'))
+# Items repeated this close to a window boundary are treated as one item
+MERGE_OVERLAP_ITEMS = 3
+# Seconds between cancellation checks while a stream sends nothing
+STREAM_POLL_SECONDS = 0.5
+
+# System prompt for multi-page processing
+SYSTEM_PROMPT = """
+    You are a professional invoice extractor designed to handle multi-page invoices.
+    Read ALL the uploaded images carefully and consolidate the information from ALL pages into
+    **ONE** comprehensive invoice structure in **strict JSON format**.
+
+    Important instructions:
+    1. Combine information from all pages into a single invoice
+    2. Aggregate all line items from all pages
+    3. Use the total amount from the final page or summary page
+    4. Return **ONLY** the extracted structured information in **strict JSON format**, no extra text or explanation
+
+    Your response must look like this (with sample values):
+
+    {
+      "invoice_id": "INV-001",
+      "customer": "John Doe",
+      "invoice_date": "2024-06-15",
+      "total": 250.75,
+      "items": [
+        {
+          "description": "Product A",
+          "quantity": 2,
+          "price": 100.00
+        },
+        {
+          "description": "Service Fee",
+          "quantity": 1,
+          "price": 50.75
+        }
+      ]
+    }
+
+    Notes:
+    - Return only valid, strict JSON
+    - Use double quotes for all keys and string values
+    - No trailing commas
+    - No extra formatting or Markdown
+    - All values must be filled or null (avoid empty strings)
+    - Consolidate ALL items from ALL pages
+    """
+
+# Appended to the system prompt when a document is extracted in windows
+CHUNK_PROMPT = """
+    These images are pages {first} to {last} of a {total}-page invoice.
+    Extract only what is printed on these pages: list only the line items shown here,
+    and use null for any header field (invoice_id, customer, invoice_date, total)
+    that does not appear on these pages.
+    """
+
+HEADER_FIELDS = ("invoice_id", "customer", "invoice_date")
+
+_stream_stats = {'streams': 0, 'completed': 0, 'cancelled': 0, 'first_item_total': 0.0,
+                 'first_item_count': 0, 'latency_total': 0.0, 'last_first_item': None,
+                 'last_latency': None}
+_stream_stats_lock = threading.Lock()
+
+
+class ExtractionCancelled(Exception):
+    """Raised when a streaming extraction is stopped before it completes."""
+
+
+class ChunkExtractionError(RuntimeError):
+    """Raised when some page windows still fail after their retries."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        detail = "; ".join(f"pages {first}-{last}: {error}" for (first, last), error in failures)
+        super().__init__(f"{len(failures)} page window(s) failed: {detail}")
+
+
+def load_pages(file_name, data: bytes) -> List[Image.Image]:
+    """Rasterize a PDF or decode an image file's bytes into a list of PIL images."""
+    if os.path.splitext(file_name)[1].lower() == '.pdf':
+        # pdf_render pulls in PyMuPDF, so it is only imported for PDFs
+        pdf_render = startup.lazy_import("pdf_render")
+        return list(pdf_render.iter_pdf_pages(data))
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return [img.copy()]
+
+
+# Function to prepare multiple images for Gemini
+def prepare_image_data_list(images: List[Image.Image]):
+    """Return the Gemini image parts for ``images`` and per-page size stats."""
+    image_parts = []
+    payload_stats = []
+    for img in images:
+        # Crop, downscale and compress each page before upload
+        image_part, stats = prepare_page(img)
+        image_parts.append(image_part)
+        payload_stats.append(stats)
+    return image_parts, payload_stats
+
+
+def _parses(response_text, partial=False):
+    try:
+        clean_json_response(response_text, partial=partial)
+        return True
+    except ValueError:
+        return False
+
+
+# Function to get Gemini response for multiple images
+def get_gemini_response_multi(model, prompt_input, image_data_list, system_prompt=SYSTEM_PROMPT,
+                              cache=None, model_name=MODEL_NAME, partial=False):
+    """Return ``(response_text, from_cache)`` for one invoice.
+
+    ``model`` is anything with a ``generate_content(content)`` method whose
+    result has a ``.text`` attribute, so a fake client can stand in offline.
+    Only responses that parse (as a page window when ``partial``) are cached
+    or served from the cache, so a retry after a bad response calls the
+    model again instead of getting the same text back.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(image_data_list, system_prompt, prompt_input, model_name)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None and _parses(cached_response, partial):
+            return cached_response, True
+
+    # Create the content list with all images
+    content = [prompt_input, system_prompt] + image_data_list
+    response = model.generate_content(content)
+    if cache is not None and _parses(response.text, partial):
+        try:
+            cache.put(cache_key, response.text, model_name)
+        except OSError:
+            pass  # caching is best effort
+    return response.text, False
+
+
+def stream_gemini_response(model, prompt_input, image_data_list, system_prompt=SYSTEM_PROMPT,
+                           cache=None, model_name=MODEL_NAME, on_item=None, cancel=None, on_wait=None,
+                           parse_retries=PARSE_RETRIES, on_retry=None):
+    """Streaming variant of ``get_gemini_response_multi``; returns ``(response_text, from_cache)``.
+
+    ``on_item(item, header)`` is called for each line item as soon as it has
+    been received, with the header fields seen so far. Setting the
+    ``cancel`` event stops reading the stream and raises ExtractionCancelled,
+    within ``STREAM_POLL_SECONDS`` even if the stream has stalled.
+    ``on_wait(seconds)`` is called on the caller's thread at the same
+    interval while no chunk arrives, so the caller can react (or be
+    interrupted) too. Cancelled responses are not cached, and neither are
+    responses that do not parse. A response that does not parse is streamed
+    again up to ``parse_retries`` times, calling ``on_retry(attempt)`` first
+    so the caller can discard the items it was shown; if it still does not
+    parse, the last response is returned. Time to first item and total
+    latency are recorded in ``streaming_stats()``.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(image_data_list, system_prompt, prompt_input, model_name)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None and _parses(cached_response):
+            if on_item:
+                parser = IncrementalInvoiceParser()
+                for item in parser.feed(cached_response):
+                    on_item(item, parser.header())
+            return cached_response, True
+
+    content = [prompt_input, system_prompt] + image_data_list
+    for attempt in range(parse_retries + 1):
+        if attempt and on_retry:
+            on_retry(attempt)
+        response_text = _stream_once(model, content, on_item, cancel, on_wait)
+        if _parses(response_text):
+            if cache is not None:
+                try:
+                    cache.put(cache_key, response_text, model_name)
+                except OSError:
+                    pass  # caching is best effort
+            break
+    return response_text, False
+
+
+def _stream_once(model, content, on_item, cancel, on_wait):
+    started = time.perf_counter()
+    parser = IncrementalInvoiceParser()
+    first_item = None
+    _count_stream('streams')
+    response = model.generate_content(content, stream=True)
+    for chunk in _read_stream(response, cancel, on_wait):
+        for item in parser.feed(chunk.text):
+            if first_item is None:
+                first_item = time.perf_counter() - started
+            if on_item:
+                on_item(item, parser.header())
+
+    latency = time.perf_counter() - started
+    with _stream_stats_lock:
+        _stream_stats['completed'] += 1
+        _stream_stats['latency_total'] += latency
+        _stream_stats['last_latency'] = latency
+        if first_item is not None:
+            _stream_stats['first_item_total'] += first_item
+            _stream_stats['first_item_count'] += 1
+            _stream_stats['last_first_item'] = first_item
+    return parser.text
+
+
+def _close(response):
+    close = getattr(response, 'close', None)
+    if close:
+        close()
+
+
+def _read_stream(response, cancel=None, on_wait=None, poll=STREAM_POLL_SECONDS):
+    """Yield the chunks of ``response``, checking ``cancel`` every ``poll`` seconds.
+
+    Without ``cancel`` or ``on_wait`` the stream is read directly. Otherwise a
+    reader thread owns the stream and hands chunks over through a queue, so a
+    stalled stream cannot keep the caller from noticing a cancellation.
+    """
+    if cancel is None and on_wait is None:
+        try:
+            yield from response
+        finally:
+            _close(response)
+        return
+
+    chunks = queue.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def read():
+        try:
+            for chunk in response:
+                chunks.put((chunk, None))
+                if stop.is_set():
+                    break
+            chunks.put((end, None))
+        except Exception as e:
+            chunks.put((None, e))
+        finally:
+            _close(response)
+
+    threading.Thread(target=read, name="stream-reader", daemon=True).start()
+    waited_since = time.monotonic()
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                _count_stream('cancelled')
+                raise ExtractionCancelled("extraction stopped before the response was complete")
+            try:
+                chunk, error = chunks.get(timeout=poll)
+            except queue.Empty:
+                if on_wait:
+                    on_wait(time.monotonic() - waited_since)
+                continue
+            if error is not None:
+                raise error
+            if chunk is end:
+                return
+            waited_since = time.monotonic()
+            yield chunk
+    finally:
+        # Also reached when the caller is interrupted; the reader stops after its next chunk
+        stop.set()
+
+
+def record_cancelled():
+    """Count a stream the caller abandoned without going through ``cancel``, e.g. on a UI rerun."""
+    _count_stream('cancelled')
+
+
+def _count_stream(name):
+    with _stream_stats_lock:
+        _stream_stats[name] += 1
+
+
+def streaming_stats():
+    """Streaming extraction counters; latencies are in milliseconds."""
+    with _stream_stats_lock:
+        data = dict(_stream_stats)
+
+    def ms(seconds):
+        return None if seconds is None else seconds * 1000
+    first_items = data.pop('first_item_count')
+    first_item_total = data.pop('first_item_total')
+    latency_total = data.pop('latency_total')
+    return {
+        'streams': data['streams'],
+        'completed': data['completed'],
+        'cancelled': data['cancelled'],
+        'avg_first_item_ms': ms(first_item_total / first_items) if first_items else None,
+        'avg_latency_ms': ms(latency_total / data['completed']) if data['completed'] else None,
+        'last_first_item_ms': ms(data['last_first_item']),
+        'last_latency_ms': ms(data['last_latency']),
+    }
+
+
+def call_with_retry(fn, retries=3, base_delay=1.0, max_delay=30.0):
+    """Call ``fn``, retrying failures with exponential backoff and full jitter.
+
+    Errors marked ``retryable = False`` (model calls the client has already
+    retried, an open circuit breaker) are raised straight away.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not getattr(e, 'retryable', True):
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _item_key(item):
+    description = " ".join(str(item.get('description') or "").lower().split())
+    return description, _number(item.get('quantity')), _number(item.get('price'))
+
+
+def _boundary_overlap(previous, following, max_items=MERGE_OVERLAP_ITEMS):
+    """Number of leading ``following`` items that repeat the tail of ``previous``.
+
+    A table row split across a page break is often read by both windows; only
+    exact repeats at the boundary are dropped, so genuinely repeated line items
+    elsewhere in the invoice are kept.
+    """
+    for count in range(min(max_items, len(previous), len(following)), 0, -1):
+        if [_item_key(i) for i in previous[-count:]] == [_item_key(i) for i in following[:count]]:
+            return count
+    return 0
+
+
+def merge_chunk_results(chunks):
+    """Combine per-window invoices (in page order) into one invoice.
+
+    Header fields come from the first window that has them, the total from the
+    last window that has one (the final or summary page), and line items are
+    concatenated with boundary duplicates removed.
+    """
+    merged = {field: None for field in HEADER_FIELDS}
+    for data in chunks:
+        for field in HEADER_FIELDS:
+            if merged[field] is None and data.get(field) not in (None, ""):
+                merged[field] = data[field]
+    merged['total'] = next((data['total'] for data in reversed(chunks)
+                            if data.get('total') not in (None, "")), None)
+
+    items = []
+    for data in chunks:
+        chunk_items = [item for item in data.get('items') or [] if isinstance(item, dict)]
+        items.extend(chunk_items[_boundary_overlap(items, chunk_items):])
+    merged['items'] = items
+    return merged
+
+
+def extract_chunked(model, prompt_input, image_data_list, system_prompt=SYSTEM_PROMPT, cache=None,
+                    model_name=MODEL_NAME, chunk_pages=CHUNK_PAGES, workers=CHUNK_WORKERS,
+                    retries=CHUNK_RETRIES):
+    """Extract ``image_data_list`` in windows of ``chunk_pages`` pages and merge them.
+
+    Windows are requested concurrently and each is retried on its own, so one
+    failure does not restart the whole document. Returns ``(data, from_cache)``
+    where ``from_cache`` is true only if every window came from the cache.
+    """
+    total = len(image_data_list)
+    windows = [(start, min(start + chunk_pages, total)) for start in range(0, total, chunk_pages)]
+
+    def extract_window(window):
+        start, end = window
+        window_prompt = system_prompt + CHUNK_PROMPT.format(first=start + 1, last=end, total=total)
+
+        def attempt():
+            text, from_cache = get_gemini_response_multi(model, prompt_input, image_data_list[start:end],
+                                                         window_prompt, cache=cache, model_name=model_name,
+                                                         partial=True)
+            return clean_json_response(text, partial=True), from_cache
+        return call_with_retry(attempt, retries=retries)
+
+    results, failures = [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as executor:
+        futures = [executor.submit(extract_window, window) for window in windows]
+        for (start, end), future in zip(windows, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures.append(((start + 1, end), f"{type(e).__name__}: {e}"))
+    if failures:
+        raise ChunkExtractionError(failures)
+
+    data = merge_chunk_results([data for data, _ in results])
+    return data, all(from_cache for _, from_cache in results)
+
+
+def extract_invoice(model, prompt_input, image_data_list, system_prompt=SYSTEM_PROMPT, cache=None,
+                    model_name=MODEL_NAME, chunk_pages=CHUNK_PAGES, workers=CHUNK_WORKERS,
+                    retries=CHUNK_RETRIES, parse_retries=PARSE_RETRIES):
+    """Return ``(response_text, from_cache)``, chunking documents longer than ``chunk_pages``.
+
+    A ``chunk_pages`` of 0 always sends every page in a single request.
+    Page windows are retried up to ``retries`` times. A single-request
+    response that does not parse is requested again up to ``parse_retries``
+    times; if it still does not parse, the last response is returned so the
+    caller can report or correct it.
+    """
+    if chunk_pages and len(image_data_list) > chunk_pages:
+        data, from_cache = extract_chunked(model, prompt_input, image_data_list, system_prompt, cache,
+                                           model_name, chunk_pages, workers, retries)
+        return json.dumps(data, indent=2), from_cache
+
+    last = {}
+
+    def attempt():
+        text, from_cache = get_gemini_response_multi(model, prompt_input, image_data_list, system_prompt,
+                                                     cache=cache, model_name=model_name)
+        last['response'] = text, from_cache
+        clean_json_response(text)
+        return text, from_cache
+    try:
+        return call_with_retry(attempt, retries=parse_retries)
+    except ValueError:
+        if 'response' not in last:
+            raise
+        return last['response']
+
+
+def clean_json_response(response, partial=False):
+    """Parse and validate the invoice JSON in a model response.
+
+    Raises ValueError (InvoiceParseError or InvoiceValidationError) on failure;
+    see ``invoice_json.parse_invoice``.
+    """
+    return parse_invoice(response, partial=partial)
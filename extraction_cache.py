@@ -0,0 +1,156 @@
+"""Content-addressed on-disk cache of raw Gemini extraction responses.
+
+Entries are keyed on the exact page payloads sent to the model plus the
+prompts and model name, so a repeat upload of the same documents with the
+same instructions never reaches the API again.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def make_cache_key(page_payloads, system_prompt, user_prompt, model_name):
+    """Hash page bytes, prompts and model name into a stable hex key."""
+    digest = hashlib.sha256()
+
+    def feed(chunk: bytes):
+        # Length-prefix every part so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(len(chunk).to_bytes(8, 'big'))
+        digest.update(chunk)
+
+    feed((model_name or "").encode())
+    feed((system_prompt or "").encode())
+    feed((user_prompt or "").encode())
+    for part in page_payloads:
+        data = part['data'] if isinstance(part, dict) else part
+        feed(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Disk-backed response cache with TTL expiry and size-bounded LRU eviction."""
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached response text for ``key`` or None."""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if self.ttl and time.time() - entry.get('created', 0) > self.ttl:
+            self._remove(path)
+            with self._lock:
+                self.expirations += 1
+                self.misses += 1
+            return None
+
+        # Bump the access time so eviction treats this entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry['response']
+
+    def put(self, key, response, model_name=None):
+        """Store a response atomically, then evict old entries if over budget."""
+        entry = {'created': time.time(), 'model': model_name, 'response': response}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries and least-recently-used ones beyond ``max_bytes``."""
+        entries = []
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.name.endswith('.json'):
+                    continue
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()  # oldest access first
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes and not (self.ttl and now - mtime > self.ttl):
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.name.endswith('.json'):
+                    self._remove(item.path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Return the process-wide cache configured from EXTRACTION_CACHE_* settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(
+                    os.getenv('EXTRACTION_CACHE_DIR', os.path.join('.cache', 'extractions')),
+                    max_bytes=int(float(os.getenv('EXTRACTION_CACHE_MAX_MB', '100')) * 1024 * 1024),
+                    ttl=float(os.getenv('EXTRACTION_CACHE_TTL_HOURS', '168')) * 3600,
+                )
+    return _cache
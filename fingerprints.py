@@ -0,0 +1,186 @@
+"""Duplicate detection for uploaded invoice documents.
+
+Every inserted invoice records a fingerprint per source file in the
+DocumentFingerprints table: the SHA-256 of the file bytes and a 64-bit
+difference hash (dHash) of each rendered page. A re-upload of the same file
+is recognised from its bytes alone, before it is rasterized or sent to the
+model. A rescan or re-export of the same invoice has different bytes but
+nearly identical page hashes, so it is flagged as a likely duplicate once
+its pages have been rendered.
+
+Page hashes are compared by Hamming distance, which SQL Server cannot
+index, so they are kept in a process-wide in-memory index loaded from the
+table and refreshed every ``refresh_interval`` seconds.
+"""
+import os
+import threading
+import time
+
+from database import get_connection
+
+HASH_SIZE = 8
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class DuplicateDocumentError(ValueError):
+    """The document was already extracted and inserted as an invoice."""
+
+    def __init__(self, matches):
+        self.matches = matches
+        described = ", ".join(f"{m['file_name']} → invoice {m['invoice_id']}" for m in matches)
+        super().__init__(f"already inserted: {described}")
+
+
+def page_hash(img) -> int:
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail."""
+    small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE))
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b) -> int:
+    return bin(a ^ b).count('1')
+
+
+def format_page_hashes(hashes):
+    return ",".join(f"{value:016x}" for value in hashes)
+
+
+def parse_page_hashes(text):
+    return [int(value, 16) for value in (text or "").split(",") if value]
+
+
+class FingerprintIndex:
+    """Looks up exact and near-duplicate documents among inserted invoices."""
+
+    def __init__(self, connect=get_connection, max_distance=6, min_matching_pages=0.5,
+                 refresh_interval=300):
+        self._connect = connect
+        self.max_distance = max_distance
+        self.min_matching_pages = min_matching_pages
+        self.refresh_interval = refresh_interval
+        self._pages = []          # (page_hash, invoice_id)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._stats = {'exact_lookups': 0, 'exact_hits': 0, 'similar_lookups': 0,
+                       'similar_hits': 0}
+
+    def find_exact(self, content_hashes):
+        """Map each already-fingerprinted content hash to its fingerprint row."""
+        content_hashes = list(dict.fromkeys(content_hashes))
+        if not content_hashes:
+            return {}
+        placeholders = ", ".join("?" for _ in content_hashes)
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT content_hash, file_name, invoice_id, created_by, created_date
+                FROM DocumentFingerprints
+                WHERE content_hash IN ({placeholders})
+            """, tuple(content_hashes))
+            rows = cursor.fetchall()
+        matches = {
+            row[0]: {'content_hash': row[0], 'file_name': row[1], 'invoice_id': row[2],
+                     'created_by': row[3], 'created_date': row[4]}
+            for row in rows
+        }
+        self._count('exact_lookups')
+        if matches:
+            self._count('exact_hits')
+        return matches
+
+    def find_similar(self, page_hashes):
+        """Invoices whose pages nearly match ``page_hashes``, best match first.
+
+        Returns ``[(invoice_id, matching_pages)]`` for invoices where at least
+        ``min_matching_pages`` of the given pages are within ``max_distance``
+        bits of one of their pages.
+        """
+        if not page_hashes:
+            return []
+        self._refresh_if_stale()
+        with self._lock:
+            pages = list(self._pages)
+        matched = {}
+        for value in page_hashes:
+            hits = {invoice_id for stored, invoice_id in pages
+                    if hamming(value, stored) <= self.max_distance}
+            for invoice_id in hits:
+                matched[invoice_id] = matched.get(invoice_id, 0) + 1
+        needed = max(1, round(len(page_hashes) * self.min_matching_pages))
+        similar = sorted(((invoice_id, count) for invoice_id, count in matched.items() if count >= needed),
+                         key=lambda match: (-match[1], match[0]))
+        self._count('similar_lookups')
+        if similar:
+            self._count('similar_hits')
+        return similar
+
+    def record(self, cursor, invoice_id, documents, created_by):
+        """Store fingerprints for ``documents`` (``(file_name, content_hash, page_hashes)``).
+
+        Runs in the caller's transaction, next to the invoice insert. A file
+        fingerprinted before is re-pointed at ``invoice_id``. Call ``add``
+        after commit to update the in-memory page index.
+        """
+        for file_name, content_hash, page_hashes in documents:
+            cursor.execute("""
+                UPDATE DocumentFingerprints
+                SET invoice_id = ?, file_name = ?, page_hashes = ?, created_by = ?
+                WHERE content_hash = ?
+            """, (invoice_id, file_name, format_page_hashes(page_hashes), created_by, content_hash))
+            if cursor.rowcount == 0:
+                cursor.execute("""
+                    INSERT INTO DocumentFingerprints (content_hash, file_name, invoice_id, page_hashes, created_by)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (content_hash, file_name, invoice_id, format_page_hashes(page_hashes), created_by))
+
+    def add(self, invoice_id, documents):
+        with self._lock:
+            for _, _, page_hashes in documents:
+                self._pages.extend((value, invoice_id) for value in page_hashes)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['indexed_pages'] = len(self._pages)
+        return data
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _refresh_if_stale(self):
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval
+        if fresh:
+            return
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT invoice_id, page_hashes FROM DocumentFingerprints")
+            pages = [(value, invoice_id) for invoice_id, text in cursor.fetchall()
+                     for value in parse_page_hashes(text)]
+        with self._lock:
+            self._pages = pages
+            self._loaded_at = time.monotonic()
+
+
+def get_fingerprint_index() -> FingerprintIndex:
+    """Return the process-wide fingerprint index configured from DUPLICATE_* settings."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FingerprintIndex(
+                    max_distance=int(os.getenv('DUPLICATE_MAX_DISTANCE', '6')),
+                    min_matching_pages=float(os.getenv('DUPLICATE_MIN_MATCHING_PAGES', '0.5')),
+                    refresh_interval=float(os.getenv('DUPLICATE_INDEX_REFRESH', '300')),
+                )
+    return _index
@@ -0,0 +1,130 @@
+"""Shrink and re-encode page images before they are sent to Gemini.
+
+Full-resolution lossless PNGs of 300 DPI scans run to several MB per page,
+while the model reads invoices just as well from a ~2000px JPEG. Each page is
+cropped to its content, downscaled to a target long edge, converted to
+grayscale when it carries no colour, and encoded lossily.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps
+
+TARGET_LONG_EDGE = int(os.getenv('IMAGE_TARGET_LONG_EDGE', '2000'))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG').upper()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+AUTOCROP = os.getenv('IMAGE_AUTOCROP', 'true').lower() in ('1', 'true', 'yes')
+# Also encode each page the old way (full-size lossless PNG) to report the saving
+MEASURE_PNG = os.getenv('IMAGE_MEASURE_PNG', 'true').lower() in ('1', 'true', 'yes')
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+# A pixel brighter than this counts as blank margin
+BLANK_THRESHOLD = 245
+CROP_PADDING = 16
+# Share of visibly saturated pixels above which a page is treated as colour
+COLOUR_PIXEL_RATIO = 0.01
+COLOUR_SATURATION = 40
+
+
+def autocrop_margins(img: Image.Image, threshold=BLANK_THRESHOLD, padding=CROP_PADDING) -> Image.Image:
+    """Trim near-white borders, keeping ``padding`` pixels around the content."""
+    gray = img.convert('L')
+    content = gray.point(lambda p: 255 if p < threshold else 0)
+    bbox = content.getbbox()
+    if not bbox:
+        return img  # blank page, nothing to crop to
+    left, top, right, bottom = bbox
+    box = (
+        max(left - padding, 0),
+        max(top - padding, 0),
+        min(right + padding, img.width),
+        min(bottom + padding, img.height),
+    )
+    if box == (0, 0, img.width, img.height):
+        return img
+    return img.crop(box)
+
+
+def is_monochrome(img: Image.Image) -> bool:
+    """True when (almost) no pixel carries visible colour."""
+    if img.mode in ('1', 'L', 'LA', 'I', 'F'):
+        return True
+    sample = img.convert('RGB')
+    sample.thumbnail((256, 256))
+    saturation = sample.convert('HSV').getchannel('S').histogram()
+    coloured = sum(saturation[COLOUR_SATURATION:])
+    return coloured / (sample.width * sample.height) < COLOUR_PIXEL_RATIO
+
+
+def downscale(img: Image.Image, target_long_edge=TARGET_LONG_EDGE) -> Image.Image:
+    """Resize so the long edge is at most ``target_long_edge`` pixels."""
+    if not target_long_edge or max(img.size) <= target_long_edge:
+        return img
+    scale = target_long_edge / max(img.size)
+    new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(new_size, Image.LANCZOS)
+
+
+def raw_size(img: Image.Image) -> int:
+    """Uncompressed size of the decoded image in bytes."""
+    return img.width * img.height * len(img.getbands())
+
+
+def png_size(img: Image.Image) -> int:
+    """Size of ``img`` as the full-resolution PNG the app used to upload."""
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return len(buffer.getvalue())
+
+
+def prepare_page(img: Image.Image, target_long_edge=None, image_format=None, quality=None,
+                 grayscale='auto', autocrop=None, measure_png=None):
+    """Return a Gemini image part for ``img`` plus before/after size stats.
+
+    ``png_bytes`` is the size of ``img`` encoded as the lossless PNG that used
+    to be uploaded (None unless ``measure_png``, as the extra encode costs a
+    fraction of a second per page); ``bytes_after`` is the encoded payload
+    actually sent. ``decoded_bytes`` is the uncompressed size of ``img``.
+
+    ``grayscale`` may be True, False or 'auto' (convert when the page has no colour).
+    """
+    target_long_edge = TARGET_LONG_EDGE if target_long_edge is None else target_long_edge
+    image_format = (image_format or IMAGE_FORMAT).upper()
+    quality = quality or IMAGE_QUALITY
+    autocrop = AUTOCROP if autocrop is None else autocrop
+    measure_png = MEASURE_PNG if measure_png is None else measure_png
+
+    original_size = img.size
+    decoded_bytes = raw_size(img)
+    png_bytes = png_size(img) if measure_png else None
+
+    page = ImageOps.exif_transpose(img)
+    if page.mode not in ('RGB', 'L'):
+        page = page.convert('RGB')
+    if autocrop:
+        page = autocrop_margins(page)
+    page = downscale(page, target_long_edge)
+    if grayscale is True or (grayscale == 'auto' and is_monochrome(page)):
+        page = page.convert('L')
+
+    buffer = io.BytesIO()
+    if image_format == 'PNG':
+        page.save(buffer, format='PNG', optimize=True)
+    elif image_format == 'WEBP':
+        page.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        image_format = 'JPEG'
+        page.save(buffer, format='JPEG', quality=quality, optimize=True)
+    data = buffer.getvalue()
+
+    stats = {
+        'original_size': original_size,
+        'sent_size': page.size,
+        'mode': page.mode,
+        'format': image_format,
+        'decoded_bytes': decoded_bytes,
+        'png_bytes': png_bytes,
+        'bytes_after': len(data),
+    }
+    return {'mime_type': MIME_TYPES[image_format], 'data': data}, stats
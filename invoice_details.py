@@ -0,0 +1,110 @@
+"""Batched loading and caching of invoice line items for Invoice History.
+
+A history page already carries every InvoiceMaster column, so only the
+line items are loaded here. They are fetched for all invoices on the page
+in one ``IN (...)`` query, which is an index seek per invoice on
+IX_InvoiceItems_invoice_id, and kept in a process-wide LRU cache shared by
+every session. Inserts and replacements in this process invalidate the
+affected invoices; the TTL covers writes from other processes, such as the
+batch CLI.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database import get_connection
+
+# Stays well under SQL Server's limit of 2100 parameters per statement
+IN_CHUNK = 500
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def fetch_items(cursor, invoice_ids):
+    """Map each of ``invoice_ids`` to its ``(description, quantity, price)`` rows, in insert order."""
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    items = {invoice_id: [] for invoice_id in invoice_ids}
+    for start in range(0, len(invoice_ids), IN_CHUNK):
+        chunk = invoice_ids[start:start + IN_CHUNK]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor.execute(f"""
+            SELECT invoice_id, description, quantity, price
+            FROM InvoiceItems
+            WHERE invoice_id IN ({placeholders})
+            ORDER BY invoice_id, id
+        """, tuple(chunk))
+        for row in cursor.fetchall():
+            items[row[0]].append((row[1], row[2], row[3]))
+    return items
+
+
+class InvoiceDetailCache:
+    """LRU cache of line items per invoice, expiring after ``ttl`` seconds."""
+
+    def __init__(self, connect=get_connection, max_entries=1000, ttl=300.0):
+        self._connect = connect
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # invoice_id -> (stored_at, items)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'queries': 0, 'invalidations': 0}
+
+    def get_items(self, invoice_ids):
+        """Items for every invoice in ``invoice_ids``; all misses are loaded in one query."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for invoice_id in dict.fromkeys(invoice_ids):
+                entry = self._entries.get(invoice_id)
+                if entry is not None and now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(invoice_id)
+                    found[invoice_id] = entry[1]
+                else:
+                    missing.append(invoice_id)
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(missing)
+        if missing:
+            with self._connect() as conn:
+                loaded = fetch_items(conn.cursor(), missing)
+            with self._lock:
+                self._stats['queries'] += 1
+                for invoice_id, items in loaded.items():
+                    self._entries[invoice_id] = (now, items)
+                    self._entries.move_to_end(invoice_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def invalidate(self, invoice_ids=None):
+        """Drop the given invoices, or everything when ``invoice_ids`` is None."""
+        with self._lock:
+            if invoice_ids is None:
+                self._entries.clear()
+            else:
+                for invoice_id in invoice_ids:
+                    self._entries.pop(invoice_id, None)
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['entries'] = len(self._entries)
+        lookups = data['hits'] + data['misses']
+        data['hit_ratio'] = data['hits'] / lookups if lookups else 0.0
+        return data
+
+
+def get_detail_cache() -> InvoiceDetailCache:
+    """Return the process-wide detail cache configured from the INVOICE_DETAIL_* settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = InvoiceDetailCache(
+                    max_entries=int(os.getenv('INVOICE_DETAIL_CACHE_SIZE', '1000')),
+                    ttl=float(os.getenv('INVOICE_DETAIL_CACHE_TTL', '300')),
+                )
+    return _cache
@@ -0,0 +1,310 @@
+"""Parsing, repair and validation of the invoice JSON returned by the model.
+
+The model is asked for strict JSON but now and then wraps it in a code fence,
+adds prose around it, leaves a trailing comma or uses single quotes. Rather
+than failing the extraction (and paying for another model call), the first
+balanced JSON object is cut out of the response, common defects are
+repaired, and the result is validated against the invoice schema with values
+coerced to the types the database expects.
+
+Parsed results are memoized by response hash, because Streamlit re-parses
+the same (possibly edited) JSON on every rerun.
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+CODE_FENCE = re.compile(r'```(?:json|JSON)?\s*(.*?)```', re.DOTALL)
+PYTHON_LITERALS = {'None': 'null', 'True': 'true', 'False': 'false'}
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d.%m.%Y",
+                "%d %B %Y", "%d %b %Y", "%B %d, %Y", "%b %d, %Y", "%Y-%m-%dT%H:%M:%S")
+# NN/NN/YYYY and NN-NN-YYYY can be day-first or month-first
+NUMERIC_DATE = re.compile(r'^(\d{1,2})([/-])(\d{1,2})\2(\d{4})$')
+# 'dmy' or 'mdy' reads every such date one way; unset, a date that is valid
+# both ways (05/03/2024) is rejected rather than guessed
+DATE_ORDER = os.getenv('INVOICE_DATE_ORDER', '').lower()
+HEADER_FIELDS = ("invoice_id", "customer", "invoice_date", "total")
+MEMO_SIZE = 256
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+_stats = {'parses': 0, 'memo_hits': 0, 'repaired': 0, 'failures': 0}
+
+
+class InvoiceParseError(ValueError):
+    """The response does not contain a usable JSON object."""
+
+
+class InvoiceValidationError(ValueError):
+    """The JSON parsed but does not match the invoice schema."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+def strip_code_fences(text):
+    match = CODE_FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def find_json_object(text):
+    """Return the first balanced ``{...}`` in ``text``, ignoring braces inside strings.
+
+    Both quote styles are treated as strings so single-quoted output (repaired
+    later) is scanned correctly. Raises InvoiceParseError if none is found.
+    """
+    start = text.find('{')
+    while start != -1:
+        depth = 0
+        quote = None
+        escape = False
+        for pos in range(start, len(text)):
+            char = text[pos]
+            if quote:
+                if escape:
+                    escape = False
+                elif char == '\\':
+                    escape = True
+                elif char == quote:
+                    quote = None
+            elif char in '"\'':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    return text[start:pos + 1]
+        # Unbalanced from here (e.g. a stray brace in prose); try the next one
+        start = text.find('{', start + 1)
+    raise InvoiceParseError("no complete JSON object found in response")
+
+
+def repair_json(text):
+    """Fix trailing commas, single-quoted strings and Python literals outside strings."""
+    out = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        char = text[pos]
+        if char in '"\'':
+            # Copy a string, re-quoting single-quoted ones with double quotes
+            end = pos + 1
+            chars = []
+            while end < length and text[end] != char:
+                if text[end] == '\\' and end + 1 < length:
+                    escaped = text[end + 1]
+                    chars.append(escaped if escaped == "'" and char == "'" else text[end:end + 2])
+                    end += 2
+                    continue
+                chars.append('\\"' if text[end] == '"' and char == "'" else text[end])
+                end += 1
+            out.append('"' + "".join(chars) + '"')
+            pos = end + 1
+        elif char == ',':
+            # Drop the comma if only whitespace separates it from a closing bracket
+            following = pos + 1
+            while following < length and text[following].isspace():
+                following += 1
+            if following >= length or text[following] not in '}]':
+                out.append(char)
+            pos += 1
+        elif char.isalpha():
+            end = pos
+            while end < length and text[end].isalnum():
+                end += 1
+            word = text[pos:end]
+            out.append(PYTHON_LITERALS.get(word, word))
+            pos = end
+        else:
+            out.append(char)
+            pos += 1
+    return "".join(out)
+
+
+def loads_tolerant(text):
+    """``json.loads`` that falls back to ``repair_json``; returns ``(value, repaired)``."""
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+    try:
+        return json.loads(repair_json(text)), True
+    except ValueError as e:
+        raise InvoiceParseError(f"invalid JSON: {e}") from e
+
+
+def _to_number(value, field, errors):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        errors.append(f"{field}: expected a number, got {value!r}")
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r'[^\d.\-]', '', str(value).replace(',', ''))
+    try:
+        return float(cleaned)
+    except ValueError:
+        errors.append(f"{field}: expected a number, got {value!r}")
+        return None
+
+
+def _to_quantity(value, field, errors):
+    number = _to_number(value, field, errors)
+    if number is None:
+        return None
+    if number != int(number):
+        errors.append(f"{field}: expected a whole quantity, got {value!r}")
+        return None
+    return int(number)
+
+
+def _numeric_date(match, errors):
+    first, _, second, year = match.groups()
+    readings = {}
+    for order, (day, month) in (('dmy', (first, second)), ('mdy', (second, first))):
+        try:
+            readings[order] = date(int(year), int(month), int(day)).isoformat()
+        except ValueError:
+            continue
+    if DATE_ORDER in ('dmy', 'mdy'):
+        readings = {DATE_ORDER: readings[DATE_ORDER]} if DATE_ORDER in readings else {}
+    values = set(readings.values())
+    if len(values) == 1:
+        return values.pop()
+    if values:
+        errors.append(f"invoice_date: {match.group(0)!r} is ambiguous (day/month or month/day); "
+                      "set INVOICE_DATE_ORDER to 'dmy' or 'mdy'")
+    else:
+        errors.append(f"invoice_date: unrecognised date {match.group(0)!r}")
+    return None
+
+
+def _to_date(value, errors):
+    if value is None or value == "":
+        return None
+    text = str(value).strip()
+    match = NUMERIC_DATE.match(text)
+    if match:
+        return _numeric_date(match, errors)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    errors.append(f"invoice_date: unrecognised date {value!r}")
+    return None
+
+
+def validate_invoice(data, partial=False):
+    """Return a normalized copy of ``data`` or raise InvoiceValidationError.
+
+    ``invoice_id`` is required unless ``partial`` (a page window of a longer
+    document, which may not show the header). Dates become ``YYYY-MM-DD``,
+    totals and prices floats and quantities ints; missing header fields are
+    set to None.
+    """
+    if not isinstance(data, dict):
+        raise InvoiceValidationError([f"expected a JSON object, got {type(data).__name__}"])
+    errors = []
+    invoice = {field: data.get(field) for field in HEADER_FIELDS}
+
+    invoice_id = invoice['invoice_id']
+    if isinstance(invoice_id, (int, float)) and not isinstance(invoice_id, bool):
+        invoice_id = str(invoice_id)
+    if isinstance(invoice_id, str):
+        invoice_id = invoice_id.strip() or None
+    elif invoice_id is not None:
+        errors.append(f"invoice_id: expected a string, got {invoice_id!r}")
+        invoice_id = None
+    if invoice_id is None and not partial:
+        errors.append("invoice_id: missing")
+    invoice['invoice_id'] = invoice_id
+
+    if invoice['customer'] is not None:
+        invoice['customer'] = str(invoice['customer']).strip() or None
+    invoice['invoice_date'] = _to_date(invoice['invoice_date'], errors)
+    invoice['total'] = _to_number(invoice['total'], "total", errors)
+
+    items = data.get('items')
+    if items is None:
+        items = []
+    if not isinstance(items, list):
+        errors.append(f"items: expected a list, got {type(items).__name__}")
+        items = []
+    invoice['items'] = []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append(f"items[{idx}]: expected an object")
+            continue
+        description = item.get('description')
+        invoice['items'].append({
+            'description': None if description is None else str(description).strip(),
+            'quantity': _to_quantity(item.get('quantity'), f"items[{idx}].quantity", errors),
+            'price': _to_number(item.get('price'), f"items[{idx}].price", errors),
+        })
+
+    if errors:
+        raise InvoiceValidationError(errors)
+    return invoice
+
+
+def _parse(text, partial):
+    body = find_json_object(strip_code_fences(text or ""))
+    data, repaired = loads_tolerant(body)
+    return validate_invoice(data, partial), repaired
+
+
+def parse_invoice(text, partial=False):
+    """Parse and validate a model response, memoized by response hash.
+
+    Returns a fresh copy each time so callers may modify it. Failures are
+    memoized too; each call raises a new exception built from the memoized one.
+    """
+    key = hashlib.sha256(f"{int(partial)}:{text}".encode('utf-8', 'surrogatepass')).hexdigest()
+    with _memo_lock:
+        _stats['parses'] += 1
+        if key in _memo:
+            _memo.move_to_end(key)
+            _stats['memo_hits'] += 1
+            result = _memo[key]
+        else:
+            result = None
+    if result is None:
+        try:
+            invoice, repaired = _parse(text, partial)
+            result = (invoice, None)
+            if repaired:
+                _count('repaired')
+        except ValueError as e:
+            result = (None, e.with_traceback(None))
+            _count('failures')
+        with _memo_lock:
+            _memo[key] = result
+            while len(_memo) > MEMO_SIZE:
+                _memo.popitem(last=False)
+
+    invoice, error = result
+    if error is not None:
+        # Re-raising the stored instance would grow its traceback on every call
+        if isinstance(error, InvoiceValidationError):
+            raise InvoiceValidationError(list(error.errors))
+        raise type(error)(*error.args)
+    return copy.deepcopy(invoice)
+
+
+def _count(name):
+    with _memo_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _memo_lock:
+        return dict(_stats, memoized=len(_memo))
@@ -0,0 +1,278 @@
+"""Background extraction jobs, so the Streamlit script thread never waits on Gemini.
+
+Queued uploads are written to a job directory together with a JSON job
+record (queued → running → done / failed). A small pool of worker threads
+rasterizes, encodes and extracts each job; the page polls the records for
+status and results, so reruns, page switches and new uploads do not cancel
+work in progress. Records live on disk, and jobs that were queued or running
+when the process stopped are picked up again on the next start.
+
+Saving to the database stays with the user, after reviewing the result.
+"""
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import extraction
+from audit import log_audit
+from extraction_cache import get_extraction_cache
+from fingerprints import DuplicateDocumentError, get_fingerprint_index, page_hash
+from model_client import get_model_client
+from upload_cache import upload_digest
+
+STATUSES = ("queued", "running", "done", "failed")
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class JobStore:
+    """One directory per job: ``job.json`` plus the uploaded files under ``inputs/``."""
+
+    def __init__(self, directory, retention=72 * 3600):
+        self.directory = directory
+        self.retention = retention
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def create(self, username, files, prompt="", allow_duplicates=()):
+        """Persist ``files`` (a list of ``(name, bytes)``) as a new queued job.
+
+        ``allow_duplicates`` lists content hashes the user chose to process
+        even though they were already inserted.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        inputs = os.path.join(self._job_dir(job_id), 'inputs')
+        os.makedirs(inputs)
+        names = []
+        for idx, (name, data) in enumerate(files):
+            # Index prefix keeps upload order and tolerates duplicate names
+            stored = f"{idx:03d}_{os.path.basename(name)}"
+            with open(os.path.join(inputs, stored), 'wb') as f:
+                f.write(data)
+            names.append(stored)
+        job = {
+            'id': job_id, 'username': username, 'status': 'queued', 'prompt': prompt,
+            'files': [name for name, _ in files], 'inputs': names, 'pages': None,
+            'created': time.time(), 'started': None, 'finished': None,
+            'raw_json': None, 'invoice_id': None, 'parse_error': None,
+            'from_cache': False, 'documents': [], 'error': None,
+            'allow_duplicates': sorted(allow_duplicates), 'duplicates': [],
+        }
+        self._write(job)
+        return job
+
+    def get(self, job_id):
+        try:
+            with open(os.path.join(self._job_dir(job_id), 'job.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            self._write(job)
+            return job
+
+    def load_inputs(self, job):
+        inputs = os.path.join(self._job_dir(job['id']), 'inputs')
+        files = []
+        for stored in job['inputs']:
+            with open(os.path.join(inputs, stored), 'rb') as f:
+                files.append((stored.split('_', 1)[1], f.read()))
+        return files
+
+    def discard_inputs(self, job_id):
+        shutil.rmtree(os.path.join(self._job_dir(job_id), 'inputs'), ignore_errors=True)
+
+    def list(self, username=None, limit=50):
+        """Most recent jobs first, optionally only those of ``username``."""
+        jobs = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.is_dir():
+                    job = self.get(item.name)
+                    if job and (username is None or job['username'] == username):
+                        jobs.append(job)
+        jobs.sort(key=lambda job: job['created'], reverse=True)
+        return jobs[:limit]
+
+    def purge(self):
+        """Delete finished jobs older than ``retention`` seconds."""
+        removed = 0
+        cutoff = time.time() - self.retention
+        for job in self.list(limit=None):
+            if job['status'] in ("done", "failed") and (job['finished'] or 0) < cutoff:
+                shutil.rmtree(self._job_dir(job['id']), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def _write(self, job):
+        job_dir = self._job_dir(job['id'])
+        fd, tmp_path = tempfile.mkstemp(dir=job_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(job, f)
+            os.replace(tmp_path, os.path.join(job_dir, 'job.json'))
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def run_extraction_job(job, files):
+    """Extract one job's files; returns the fields to store on the finished job.
+
+    Files already inserted as an invoice fail the job before any rendering,
+    unless their hash is in the job's ``allow_duplicates``.
+    """
+    content_hashes = [upload_digest(data) for _, data in files]
+    allowed = set(job.get('allow_duplicates') or ())
+    matches = {content_hash: match
+               for content_hash, match in get_fingerprint_index().find_exact(content_hashes).items()
+               if content_hash not in allowed}
+    if matches:
+        raise DuplicateDocumentError([dict(matches[content_hash], file_name=name)
+                                      for (name, _), content_hash in zip(files, content_hashes)
+                                      if content_hash in matches])
+
+    pages = []
+    documents = []
+    for (name, data), content_hash in zip(files, content_hashes):
+        file_pages = extraction.load_pages(name, data)
+        documents.append((name, content_hash, [page_hash(page) for page in file_pages]))
+        pages.extend(file_pages)
+    if not pages:
+        raise ValueError("no pages found in the uploaded files")
+    image_parts, _ = extraction.prepare_image_data_list(pages)
+    page_count = len(pages)
+    del pages
+
+    response_text, from_cache = extraction.extract_invoice(
+        get_model_client(), job['prompt'], image_parts, cache=get_extraction_cache())
+    result = {'pages': page_count, 'raw_json': response_text, 'from_cache': from_cache,
+              'documents': documents}
+    # An invalid result is still kept, so an admin can correct the JSON
+    try:
+        result['invoice_id'] = extraction.clean_json_response(response_text)['invoice_id']
+    except ValueError as e:
+        result['parse_error'] = str(e)
+    return result
+
+
+class JobQueue:
+    """Worker threads that run queued jobs from a JobStore."""
+
+    def __init__(self, store, run_job=run_extraction_job, workers=2):
+        self.store = store
+        self.run_job = run_job
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._recover()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{idx}", daemon=True)
+            for idx in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, username, files, prompt="", allow_duplicates=()):
+        """Queue ``files`` for extraction and return the new job record."""
+        job = self.store.create(username, files, prompt, allow_duplicates)
+        self._queue.put(job['id'])
+        return job
+
+    def retry(self, job_id, allow_duplicates=False):
+        """Queue a failed job again; ``allow_duplicates`` also processes the files it failed on as duplicates."""
+        job = self.store.get(job_id)
+        if job is None or job['status'] != "failed":
+            return None
+        allowed = set(job.get('allow_duplicates') or ())
+        if allow_duplicates:
+            allowed.update(job.get('duplicates') or ())
+        job = self.store.update(job_id, status="queued", error=None, started=None, finished=None,
+                                allow_duplicates=sorted(allowed), duplicates=[])
+        self._queue.put(job_id)
+        return job
+
+    def stats(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        for job in self.store.list(limit=None):
+            counts[job['status']] += 1
+        with self._lock:
+            counts['active_workers'] = self._running
+        counts['workers'] = self.workers
+        return counts
+
+    def _recover(self):
+        # Jobs interrupted by a restart go back on the queue, oldest first
+        self.store.purge()
+        for job in reversed(self.store.list(limit=None)):
+            if job['status'] in ("queued", "running"):
+                self.store.update(job['id'], status="queued", started=None)
+                self._queue.put(job['id'])
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                self._running += 1
+            try:
+                self._run(job_id)
+            except Exception as e:
+                # Whatever failed, the worker must survive or every later job stays queued
+                duplicates = e.matches if isinstance(e, DuplicateDocumentError) else []
+                try:
+                    self.store.update(job_id, status="failed", finished=time.time(),
+                                      error=f"{type(e).__name__}: {e}",
+                                      duplicates=[match['content_hash'] for match in duplicates])
+                except Exception:
+                    logger.exception("Could not mark background job %s as failed", job_id)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _run(self, job_id):
+        job = self.store.update(job_id, status="running", started=time.time())
+        if job is None:
+            return
+        result = self.run_job(job, self.store.load_inputs(job))
+        self.store.update(job_id, status="done", finished=time.time(), **result)
+        self.store.discard_inputs(job_id)
+        try:
+            log_audit(job['username'], "Extracted multi-page invoice data",
+                      f"Background job {job_id}, pages processed: {result.get('pages')}")
+        except Exception:
+            # The result is already stored; a missing audit row must not fail the job
+            logger.exception("Could not audit background job %s", job_id)
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, started (and recovered) on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                store = JobStore(os.getenv('JOBS_DIR', os.path.join('.cache', 'jobs')),
+                                 retention=float(os.getenv('JOBS_RETENTION_HOURS', '72')) * 3600)
+                _queue = JobQueue(store, workers=int(os.getenv('JOB_WORKERS', '2')))
+    return _queue
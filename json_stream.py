@@ -0,0 +1,95 @@
+"""Incremental parsing of an invoice JSON response while it is still streaming.
+
+The model writes the invoice as one JSON object. ``IncrementalInvoiceParser``
+is fed the text chunk by chunk and hands back each line item as soon as its
+closing brace arrives, plus whichever header fields have been seen so far.
+It is tolerant of the usual model slips (code fences, trailing commas,
+single quotes); the complete response is still parsed and validated once
+streaming finishes.
+"""
+import json
+import re
+
+from invoice_json import InvoiceParseError, loads_tolerant
+
+ITEMS_START = re.compile(r'["\']items["\']\s*:\s*\[')
+HEADER_FIELD = re.compile(
+    r'"(invoice_id|customer|invoice_date|total)"\s*:\s*'
+    r'("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?|null)'
+)
+
+
+class IncrementalInvoiceParser:
+    """Emits completed ``items`` entries from a partially received invoice."""
+
+    def __init__(self):
+        self.text = ""
+        self.items = []
+        self.done = False
+        self._items_pos = None   # scan position inside the items array
+        self._depth = 0
+        self._quote = None
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, chunk):
+        """Add ``chunk`` to the buffer and return the items completed by it."""
+        self.text += chunk
+        if self.done:
+            return []
+        if self._items_pos is None:
+            match = ITEMS_START.search(self.text)
+            if not match:
+                return []
+            self._items_pos = match.end()
+        return self._scan()
+
+    def header(self):
+        """Header fields seen so far (only those outside the items array)."""
+        end = len(self.text)
+        match = ITEMS_START.search(self.text)
+        if match:
+            end = match.start()
+        fields = {}
+        for name, value in HEADER_FIELD.findall(self.text[:end]):
+            fields.setdefault(name, json.loads(value))
+        return fields
+
+    def _scan(self):
+        new_items = []
+        text = self.text
+        pos = self._items_pos
+        while pos < len(text):
+            char = text[pos]
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+            elif char in '"\'':
+                self._quote = char
+            elif char in '{[':
+                if self._depth == 0 and char == '{':
+                    self._item_start = pos
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0:
+                    # End of the items array
+                    self.done = True
+                    pos += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._item_start is not None:
+                    try:
+                        item, _ = loads_tolerant(text[self._item_start:pos + 1])
+                    except InvoiceParseError:
+                        item = None
+                    if isinstance(item, dict):
+                        self.items.append(item)
+                        new_items.append(item)
+                    self._item_start = None
+            pos += 1
+        self._items_pos = pos
+        return new_items
@@ -0,0 +1,308 @@
+"""Versioned, forward-only schema migrations for the invoice database.
+
+Applied versions are recorded in the SchemaMigrations table, so each
+migration runs exactly once per database. The app applies pending
+migrations once per process at startup; they can also be applied ahead of
+time from the command line:
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied and pending migrations
+"""
+import argparse
+import sys
+import threading
+
+import summaries
+from auth import legacy_hash
+from database import get_connection
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+class Migration:
+    """One schema step: SQL statements and/or a callable taking a cursor.
+
+    Full-text DDL cannot run inside a transaction, so such migrations set
+    ``transactional=False`` and run in autocommit mode.
+    """
+
+    def __init__(self, version, name, statements=(), apply=None, transactional=True):
+        self.version = version
+        self.name = name
+        self.statements = statements
+        self.apply = apply
+        self.transactional = transactional
+
+    def run(self, cursor):
+        for statement in self.statements:
+            cursor.execute(statement)
+        if self.apply:
+            self.apply(cursor)
+
+
+def _create_default_admin(cursor):
+    # Create default admin user if no users exist. password_hash is still
+    # NVARCHAR(64) at this version, so the legacy format is stored; it is
+    # upgraded to a salted hash on the first login
+    cursor.execute("SELECT COUNT(*) FROM Users")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO Users (username, password_hash, is_admin)
+            VALUES (?, ?, 1)
+        """, ("admin", legacy_hash("admin123")))
+
+
+MIGRATIONS = [
+    # Existing databases already have these tables, hence IF NOT EXISTS
+    Migration(1, "Create core tables", [
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='Users' AND xtype='U')
+        CREATE TABLE Users (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            username NVARCHAR(50) UNIQUE NOT NULL,
+            password_hash NVARCHAR(64) NOT NULL,
+            created_date DATETIME DEFAULT GETDATE(),
+            is_admin BIT DEFAULT 0
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AuditLog' AND xtype='U')
+        CREATE TABLE AuditLog (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            username NVARCHAR(50) NOT NULL,
+            action NVARCHAR(100) NOT NULL,
+            details NVARCHAR(MAX),
+            timestamp DATETIME DEFAULT GETDATE()
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='InvoiceMaster' AND xtype='U')
+        CREATE TABLE InvoiceMaster (
+            id INT IDENTITY(1,1) NOT NULL,
+            invoice_id NVARCHAR(50) PRIMARY KEY,
+            customer NVARCHAR(100),
+            invoice_date DATE,
+            total DECIMAL(10,2),
+            created_by NVARCHAR(50),
+            created_date DATETIME DEFAULT GETDATE()
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='InvoiceItems' AND xtype='U')
+        CREATE TABLE InvoiceItems (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            invoice_id NVARCHAR(50) NOT NULL,
+            description NVARCHAR(200),
+            quantity INT,
+            price DECIMAL(10,2)
+        )
+        """,
+    ], apply=_create_default_admin),
+
+    # Keyset pagination and prefix search in Invoice History
+    Migration(2, "Invoice history indexes", [
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_InvoiceMaster_created_date')
+        CREATE INDEX IX_InvoiceMaster_created_date
+        ON InvoiceMaster (created_date DESC, invoice_id DESC)
+        INCLUDE (customer, invoice_date, total, created_by)
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_InvoiceMaster_customer')
+        CREATE INDEX IX_InvoiceMaster_customer
+        ON InvoiceMaster (customer, created_date DESC)
+        """,
+        # Single-column unique key required by the full-text index
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='UX_InvoiceMaster_id')
+        CREATE UNIQUE INDEX UX_InvoiceMaster_id ON InvoiceMaster (id)
+        """,
+    ]),
+
+    # Only takes effect when the server has full-text search installed
+    Migration(3, "Customer full-text index", [
+        """
+        IF FULLTEXTSERVICEPROPERTY('IsFullTextInstalled') = 1
+           AND NOT EXISTS (SELECT * FROM sys.fulltext_catalogs WHERE name='InvoiceCatalog')
+        CREATE FULLTEXT CATALOG InvoiceCatalog
+        """,
+        """
+        IF FULLTEXTSERVICEPROPERTY('IsFullTextInstalled') = 1
+           AND NOT EXISTS (SELECT * FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('InvoiceMaster'))
+        CREATE FULLTEXT INDEX ON InvoiceMaster (customer)
+        KEY INDEX UX_InvoiceMaster_id ON InvoiceCatalog
+        WITH CHANGE_TRACKING AUTO
+        """,
+    ], transactional=False),
+
+    # Duplicate detection: one row per source file of an inserted invoice
+    Migration(4, "Document fingerprints", [
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='DocumentFingerprints' AND xtype='U')
+        CREATE TABLE DocumentFingerprints (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            file_name NVARCHAR(260),
+            invoice_id NVARCHAR(50) NOT NULL,
+            page_hashes NVARCHAR(MAX),
+            created_by NVARCHAR(50),
+            created_date DATETIME DEFAULT GETDATE()
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='UX_DocumentFingerprints_content_hash')
+        CREATE UNIQUE INDEX UX_DocumentFingerprints_content_hash
+        ON DocumentFingerprints (content_hash)
+        INCLUDE (file_name, invoice_id, created_by, created_date)
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_DocumentFingerprints_invoice_id')
+        CREATE INDEX IX_DocumentFingerprints_invoice_id ON DocumentFingerprints (invoice_id)
+        """,
+    ]),
+
+    # Salted PBKDF2 hashes are longer than the 64-character SHA-256 hex digest
+    Migration(5, "Widen password hashes", [
+        """
+        IF COL_LENGTH('Users', 'password_hash') < 510
+        ALTER TABLE Users ALTER COLUMN password_hash NVARCHAR(255) NOT NULL
+        """,
+    ]),
+
+    # Keyset pagination and user filtering in the audit log viewer
+    Migration(6, "Audit log indexes", [
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_AuditLog_timestamp')
+        CREATE INDEX IX_AuditLog_timestamp
+        ON AuditLog (timestamp DESC, id DESC)
+        INCLUDE (username, action)
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_AuditLog_username_timestamp')
+        CREATE INDEX IX_AuditLog_username_timestamp
+        ON AuditLog (username, timestamp DESC, id DESC)
+        INCLUDE (action)
+        """,
+    ]),
+
+    # Line items of a history page are loaded with one IN (...) lookup
+    Migration(7, "Invoice item lookup index", [
+        """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_InvoiceItems_invoice_id')
+        CREATE INDEX IX_InvoiceItems_invoice_id
+        ON InvoiceItems (invoice_id, id)
+        INCLUDE (description, quantity, price)
+        """,
+    ]),
+
+    # Reporting summaries, maintained by the insert path; backfilled from existing invoices
+    Migration(8, "Sales summary tables", [
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='CustomerSales' AND xtype='U')
+        CREATE TABLE CustomerSales (
+            customer NVARCHAR(100) NOT NULL PRIMARY KEY,
+            invoice_count INT NOT NULL,
+            total_sales DECIMAL(18,2) NOT NULL,
+            item_count INT NOT NULL,
+            item_quantity INT NOT NULL
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='DailySales' AND xtype='U')
+        CREATE TABLE DailySales (
+            invoice_date DATE NOT NULL PRIMARY KEY,
+            invoice_count INT NOT NULL,
+            total_sales DECIMAL(18,2) NOT NULL,
+            item_count INT NOT NULL,
+            item_quantity INT NOT NULL
+        )
+        """,
+    ], apply=summaries.rebuild),
+]
+
+
+def _ensure_migrations_table(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='SchemaMigrations' AND xtype='U')
+        CREATE TABLE SchemaMigrations (
+            version INT PRIMARY KEY,
+            name NVARCHAR(200) NOT NULL,
+            applied_date DATETIME DEFAULT GETDATE()
+        )
+    """)
+    conn.commit()
+
+
+def applied_versions(conn):
+    _ensure_migrations_table(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM SchemaMigrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(conn):
+    applied = applied_versions(conn)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version not in applied]
+
+
+def migrate(conn):
+    """Apply pending migrations in version order; returns the versions applied."""
+    applied = []
+    for migration in pending_migrations(conn):
+        cursor = conn.cursor()
+        if migration.transactional:
+            try:
+                migration.run(cursor)
+                cursor.execute("INSERT INTO SchemaMigrations (version, name) VALUES (?, ?)",
+                               (migration.version, migration.name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        else:
+            conn.autocommit = True
+            try:
+                migration.run(cursor)
+                cursor.execute("INSERT INTO SchemaMigrations (version, name) VALUES (?, ?)",
+                               (migration.version, migration.name))
+            finally:
+                conn.autocommit = False
+        applied.append(migration.version)
+    return applied
+
+
+def migrate_once():
+    """Apply pending migrations the first time this is called in the process."""
+    global _migrated
+    if _migrated:
+        return []
+    with _migrate_lock:
+        if _migrated:
+            return []
+        with get_connection() as conn:
+            applied = migrate(conn)
+        _migrated = True
+        return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply invoice database schema migrations.")
+    parser.add_argument('--status', action='store_true', help="Show migration status without applying")
+    args = parser.parse_args(argv)
+
+    with get_connection() as conn:
+        if args.status:
+            applied = applied_versions(conn)
+            for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+                state = "applied" if migration.version in applied else "pending"
+                print(f"{migration.version:>4}  {state:<8} {migration.name}")
+            return 0
+        versions = migrate(conn)
+    print(f"Applied migrations: {versions}" if versions else "Schema is up to date.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""Process-wide Gemini client with rate limiting, retries and a circuit breaker.
+
+Every Streamlit session (and the batch CLI) talks to Gemini through one
+``ModelClient``. It exposes the same ``generate_content`` call as
+``genai.GenerativeModel`` and adds:
+
+- a token bucket shared by all callers, so sessions together stay under quota
+- a per-call timeout and retries with exponential backoff and full jitter
+- a circuit breaker that fails fast while the API keeps erroring
+- coalescing of identical in-flight requests into a single API call
+- latency, token usage and error counters for the System Stats tab
+
+``FakeModel`` is an offline backend for tests and dry runs.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import startup
+
+MODEL_NAME = "gemini-2.5-flash"
+
+# Errors that will not go away by retrying the same request
+NON_RETRYABLE_ERRORS = {
+    'InvalidArgument', 'PermissionDenied', 'Unauthenticated', 'NotFound',
+    'BlockedPromptException', 'StopCandidateException', 'ValueError', 'TypeError',
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class ModelCallError(RuntimeError):
+    """A model call failed for good; the client has already retried it."""
+
+    retryable = False
+
+
+class CircuitOpenError(ModelCallError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate_per_minute`` calls with bursts of up to ``burst``."""
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls are rejected immediately. After ``reset_timeout``
+    seconds one trial call is let through (half-open); its outcome closes the
+    breaker again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError("Gemini API circuit breaker is open; try again shortly")
+                self.state = "half_open"
+            elif self.state == "half_open":
+                # A trial call is already in flight
+                raise CircuitOpenError("Gemini API circuit breaker is open; try again shortly")
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+def is_retryable(error):
+    return getattr(error, 'retryable', True) and type(error).__name__ not in NON_RETRYABLE_ERRORS
+
+
+def request_key(content):
+    """Hash of a ``generate_content`` payload (prompt strings and image parts)."""
+    if isinstance(content, (str, dict)):
+        content = [content]
+    digest = hashlib.sha256()
+    for part in content:
+        data = part['data'] if isinstance(part, dict) else str(part).encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ModelClient:
+    """Wraps a ``generate_content`` backend with the protections listed above."""
+
+    def __init__(self, model, limiter=None, timeout=120.0, retries=3, base_delay=1.0,
+                 max_delay=30.0, breaker=None):
+        self.model = model
+        self.limiter = limiter
+        self.timeout = timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'api_calls': 0, 'coalesced': 0, 'retries': 0,
+                       'failures': 0, 'timeouts': 0, 'rejected': 0, 'latency_total': 0.0,
+                       'latency_max': 0.0, 'prompt_tokens': 0, 'output_tokens': 0,
+                       'last_error': None}
+
+    def generate_content(self, content, stream=False):
+        """Same contract as ``GenerativeModel.generate_content``.
+
+        Streamed calls are not coalesced, and only opening the stream is
+        retried; errors part-way through reach the caller.
+        """
+        self._count('requests')
+        if stream:
+            return self._call_with_retry(content, stream=True)
+
+        key = request_key(content)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            response = self._call_with_retry(content)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _call_with_retry(self, content, stream=False):
+        for attempt in range(self.retries + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count('rejected')
+                raise
+            if self.limiter:
+                self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = self.model.generate_content(
+                    content, stream=stream, request_options={'timeout': self.timeout})
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # The API answered; the request itself is at fault
+                    self.breaker.record_success()
+                self._record_error(e)
+                if attempt == self.retries or not retryable:
+                    self._count('failures')
+                    raise ModelCallError(f"Gemini call failed after {attempt + 1} attempt(s): "
+                                         f"{type(e).__name__}: {e}") from e
+                self._count('retries')
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            self._record_success(response, time.perf_counter() - started, stream)
+            return response
+
+    def _record_error(self, error):
+        with self._lock:
+            if isinstance(error, TimeoutError) or type(error).__name__ == 'DeadlineExceeded':
+                self._stats['timeouts'] += 1
+            self._stats['last_error'] = f"{type(error).__name__}: {error}"
+
+    def _record_success(self, response, latency, stream):
+        usage = None if stream else getattr(response, 'usage_metadata', None)
+        with self._lock:
+            self._stats['api_calls'] += 1
+            self._stats['latency_total'] += latency
+            self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+            if usage is not None:
+                self._stats['prompt_tokens'] += getattr(usage, 'prompt_token_count', 0) or 0
+                self._stats['output_tokens'] += getattr(usage, 'candidates_token_count', 0) or 0
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Client counters; latencies are in milliseconds (streams: time to open)."""
+        with self._lock:
+            data = dict(self._stats)
+        latency_total = data.pop('latency_total')
+        data['avg_latency_ms'] = latency_total / data['api_calls'] * 1000 if data['api_calls'] else 0.0
+        data['max_latency_ms'] = data.pop('latency_max') * 1000
+        data['circuit'] = self.breaker.state
+        return data
+
+
+class _FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class _FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeModel:
+    """Offline stand-in for ``genai.GenerativeModel``.
+
+    Returns a deterministic invoice per distinct set of pages, with one line
+    item per page, after an optional simulated latency. With ``stream=True``
+    the JSON text is returned in small chunks spread over that latency. A
+    latency above the request timeout raises TimeoutError, like a real
+    deadline would.
+    """
+
+    stream_chunk_chars = 40
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, content, stream=False, request_options=None):
+        with self._lock:
+            self.calls += 1
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and self.latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"no response within {timeout}s")
+        if stream:
+            return self._stream(content)
+        if self.latency:
+            time.sleep(self.latency)
+        text = self._invoice_text(content)
+        prompt_tokens = sum(len(part) // 4 for part in content if isinstance(part, str))
+        return _FakeResponse(text, _FakeUsage(prompt_tokens, len(text) // 4))
+
+    def _stream(self, content):
+        text = self._invoice_text(content)
+        size = self.stream_chunk_chars
+        pieces = [text[start:start + size] for start in range(0, len(text), size)]
+        for piece in pieces:
+            if self.latency:
+                time.sleep(self.latency / len(pieces))
+            yield _FakeResponse(piece)
+
+    def _invoice_text(self, content):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("simulated model failure")
+
+        pages = [part['data'] for part in content if isinstance(part, dict)]
+        digest = hashlib.sha256(b"".join(pages)).hexdigest()
+        items = [
+            {"description": f"Page {idx + 1} item", "quantity": 1, "price": 10.0}
+            for idx in range(len(pages))
+        ]
+        invoice = {
+            "invoice_id": f"FAKE-{digest[:12]}",
+            "customer": "Offline Customer",
+            "invoice_date": "2024-01-01",
+            "total": sum(item["price"] for item in items),
+            "items": items,
+        }
+        return json.dumps(invoice)
+
+
+def create_backend(fake=False):
+    """``genai.GenerativeModel`` for MODEL_NAME, or a FakeModel when ``fake``."""
+    if fake:
+        return FakeModel()
+    genai = startup.lazy_import("google.generativeai")
+    genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+def get_model_client() -> ModelClient:
+    """Return the process-wide client configured from the GEMINI_* settings."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                fake = os.getenv('GEMINI_FAKE_MODEL', 'false').lower() in ('1', 'true', 'yes')
+                with startup.timed("Gemini client init"):
+                    _client = ModelClient(
+                        create_backend(fake),
+                        RateLimiter(float(os.getenv('GEMINI_RPM', '60')),
+                                    burst=int(os.getenv('GEMINI_BURST', '5'))),
+                        timeout=float(os.getenv('GEMINI_TIMEOUT', '120')),
+                        retries=int(os.getenv('GEMINI_RETRIES', '3')),
+                        breaker=CircuitBreaker(int(os.getenv('GEMINI_BREAKER_THRESHOLD', '5')),
+                                               float(os.getenv('GEMINI_BREAKER_RESET', '30'))),
+                    )
+    return _client
@@ -0,0 +1,240 @@
+"""Natural-language-to-SQL helpers: intent templates and a persistent question cache.
+
+Common questions ("how many invoices", "total sales by customer", "items in
+invoice INV-001") are answered from parameterized SQL templates without a
+model call; totals and counts read the CustomerSales and DailySales
+summaries rather than aggregating the invoice tables. Everything else goes
+to Gemini once per normalized question; the generated SQL is kept in an LRU
+cache that survives restarts.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+_cache = None
+_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_template_hits = 0
+
+SQL_PROMPT = '''
+    You are an expert in converting English queries to SQL!
+    The database has the table InvoiceMaster with columns like customer, invoice_id, invoice_date, total, created_by, created_date.
+    The database has the table InvoiceItems with columns like id, invoice_id, description, quantity, price.
+    The database has the summary table CustomerSales with one row per customer: customer, invoice_count, total_sales, item_count, item_quantity.
+    The database has the summary table DailySales with one row per invoice date: invoice_date, invoice_count, total_sales, item_count, item_quantity.
+    Prefer the summary tables for totals and counts per customer or per date (or over date ranges); they are much faster than aggregating InvoiceMaster and InvoiceItems.
+
+    Example 1: How many records are there in the table?
+    SQL: SELECT COUNT(*) FROM InvoiceMaster;
+
+    Example 2: List all customers.
+    SQL: SELECT customer FROM InvoiceMaster;
+
+    Example 3: Show me all invoices for customer John
+    SQL: SELECT * FROM InvoiceMaster WHERE customer LIKE '%John%';
+
+    Example 4: What items are in invoice INV-001?
+    SQL: SELECT * FROM InvoiceItems WHERE invoice_id = 'INV-001';
+
+    Example 5: Show total sales by customer
+    SQL: SELECT customer, total_sales FROM CustomerSales ORDER BY total_sales DESC;
+
+    Example 6: How many invoices were issued in March 2024?
+    SQL: SELECT SUM(invoice_count) FROM DailySales WHERE invoice_date >= '2024-03-01' AND invoice_date < '2024-04-01';
+
+    Only return the SQL query. Do not include markdown or explanations.
+
+    User Query: {user_query}
+    '''
+
+# Cached SQL is only valid for the prompt that produced it
+PROMPT_VERSION = hashlib.sha256(SQL_PROMPT.encode()).hexdigest()[:12]
+
+_THIS_MONTH = "invoice_date >= DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1)"
+_THIS_YEAR = "invoice_date >= DATEFROMPARTS(YEAR(GETDATE()), 1, 1)"
+
+# Start of a date or period, which is never a customer name in a "from ..." question
+_DATE_PHRASE = (r"(?:(?:this|last|next|past|previous|current) |today\b|yesterday\b|\d|"
+                r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b)")
+
+_PERIODS = {"this month": f" WHERE {_THIS_MONTH}", "this year": f" WHERE {_THIS_YEAR}"}
+
+
+def _like_contains(text):
+    """LIKE pattern matching ``text`` literally anywhere (use with ESCAPE '\\')."""
+    return "%" + re.sub(r"([\\%_\[])", r"\\\1", text) + "%"
+
+
+# (pattern, builder) pairs; builders take the match and return (sql, params)
+TEMPLATES = [
+    (re.compile(r"^(?:how many|count(?: the)?|number of) (?:invoices|records)"
+                r"(?: (?:are there|do we have|in total|in the table|are in the table))*"
+                r"(?: (?P<period>this month|this year))?$", re.I),
+     lambda m: (
+         "SELECT COALESCE(SUM(invoice_count), 0) AS invoice_count FROM DailySales"
+         + _PERIODS[m.group('period').lower()]
+         if m.group('period') else
+         "SELECT COALESCE(SUM(invoice_count), 0) AS invoice_count FROM CustomerSales",
+         ())),
+    (re.compile(r"^(?:list|show)(?: me)?(?: all)?(?: the)? customers$", re.I),
+     lambda m: ("SELECT DISTINCT customer FROM InvoiceMaster ORDER BY customer", ())),
+    (re.compile(r"^(?:what (?:are|is) the |show(?: me)? (?:the )?)?total (?:sales|revenue|amount)"
+                r"(?: per| by| for each) customer$", re.I),
+     lambda m: ("SELECT customer, total_sales, invoice_count FROM CustomerSales "
+                "ORDER BY total_sales DESC", ())),
+    (re.compile(r"^(?:what (?:are|is) the |show(?: me)? (?:the )?)?(?:total )?(?:sales|revenue)"
+                r" (?P<period>this month|this year)$", re.I),
+     lambda m: ("SELECT COALESCE(SUM(total_sales), 0) AS total_sales FROM DailySales"
+                + _PERIODS[m.group('period').lower()], ())),
+    (re.compile(r"^(?:show(?: me)? (?:the )?)?(?:(?:total )?(?:sales|revenue)(?: per| by) (?:day|date)"
+                r"|daily (?:sales|revenue))$", re.I),
+     lambda m: ("SELECT invoice_date, total_sales, invoice_count FROM DailySales "
+                "ORDER BY invoice_date DESC", ())),
+    (re.compile(r"^(?:what |which |show(?: me)? |list )?(?:the )?items (?:are )?(?:in|on|for|of) invoice "
+                r"(?P<invoice_id>[\w\-/#.]+)$", re.I),
+     lambda m: ("SELECT * FROM InvoiceItems WHERE invoice_id = ?", (m.group('invoice_id'),))),
+    # "for"/"of" need an explicit "customer", and "from" must not start a date, so
+    # "invoices for this month" or "invoices from March" go to the model instead
+    (re.compile(r"^(?:show|list|find|get)(?: me)?(?: all)? invoices "
+                rf"(?:(?:from|for|of) customer |from (?!{_DATE_PHRASE}))(?P<customer>.+)$", re.I),
+     lambda m: ("SELECT * FROM InvoiceMaster WHERE customer LIKE ? ESCAPE '\\' ORDER BY invoice_date DESC",
+                (_like_contains(m.group('customer')),))),
+]
+
+
+def build_sql_prompt(user_query):
+    return SQL_PROMPT.format(user_query=user_query)
+
+
+def clean_sql_response(text):
+    """Strip markdown fences from generated SQL."""
+    sql_query = text.strip()
+    sql_query = re.sub(r'```sql\n?', '', sql_query)
+    sql_query = re.sub(r'```\n?', '', sql_query)
+    return sql_query.strip()
+
+
+def normalize_question(question):
+    """Canonical form used as the cache key: case, spacing and end punctuation ignored."""
+    question = question.strip().lower()
+    question = re.sub(r"\s+", " ", question)
+    question = re.sub(r"^(?:please )|(?: please)$", "", question)
+    return question.rstrip(" ?.!")
+
+
+def match_template(question):
+    """Return ``(sql, params)`` when a known intent matches, else None."""
+    global _template_hits
+    text = re.sub(r"\s+", " ", question.strip()).rstrip(" ?.!")
+    text = re.sub(r"^please ", "", text, flags=re.I)
+    for pattern, build in TEMPLATES:
+        match = pattern.match(text)
+        if match:
+            with _stats_lock:
+                _template_hits += 1
+            return build(match)
+    return None
+
+
+class QuestionCache:
+    """LRU map of normalized question -> generated SQL, persisted as JSON."""
+
+    def __init__(self, path=None, max_entries=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _key(self, question):
+        return f"{PROMPT_VERSION}:{normalize_question(question)}"
+
+    def get(self, question):
+        key = self._key(question)
+        with self._lock:
+            sql_query = self._entries.get(key)
+            if sql_query is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sql_query
+
+    def put(self, question, sql_query):
+        with self._lock:
+            self._entries[self._key(question)] = sql_query
+            self._entries.move_to_end(self._key(question))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            snapshot = list(self._entries.items())
+        self._save(snapshot)
+
+    def invalidate(self, question):
+        """Forget a question, e.g. when its cached SQL failed to execute."""
+        with self._lock:
+            removed = self._entries.pop(self._key(question), None) is not None
+            snapshot = list(self._entries.items())
+        if removed:
+            self._save(snapshot)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Stored oldest first, so insertion order restores the LRU order
+        for key, sql_query in entries[-self.max_entries:]:
+            self._entries[key] = sql_query
+
+    def _save(self, snapshot):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # persistence is best effort; the in-memory cache still works
+
+
+def get_question_cache() -> QuestionCache:
+    """Return the process-wide question cache configured from NL2SQL_CACHE_* settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QuestionCache(
+                    os.getenv('NL2SQL_CACHE_PATH', os.path.join('.cache', 'nl2sql.json')),
+                    max_entries=int(os.getenv('NL2SQL_CACHE_SIZE', '500')),
+                )
+    return _cache
+
+
+def stats():
+    """Template and cache hit counters for the UI."""
+    cache = get_question_cache()
+    with _stats_lock:
+        template_hits = _template_hits
+    total = template_hits + cache.hits + cache.misses
+    return {
+        'template_hits': template_hits,
+        'cache_hits': cache.hits,
+        'model_calls': cache.misses,
+        'cached_questions': len(cache),
+        'hit_rate': (template_hits + cache.hits) / total if total else 0.0,
+    }
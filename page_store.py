@@ -0,0 +1,314 @@
+"""Compressed storage for rendered pages, so sessions never hold decoded images.
+
+A 300 DPI page decodes to tens of megabytes, and every session used to keep
+its whole upload as PIL images in ``st.session_state``. Pages are now stored
+once per process as zlib-compressed raw pixels (invoice pages are mostly
+blank paper and compress very well) and decoded only while a step needs them;
+sessions hold page keys through a ``PageList``.
+
+Memory is bounded twice: per session and for the whole process. Past either
+budget the least recently used pages are spilled to files on disk, still
+compressed, and read back on demand. Pages belong to the sessions that
+reference them. A page is deleted once no session references it, and
+sessions that have been idle for ``idle_timeout`` seconds are released.
+"""
+import hashlib
+import itertools
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from PIL import Image
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class _Page:
+    __slots__ = ('mode', 'size', 'data', 'path', 'stored_bytes', 'sessions', 'spilling')
+
+    def __init__(self, mode, size, data):
+        self.mode = mode
+        self.size = size
+        self.data = data
+        self.path = None
+        self.stored_bytes = len(data)
+        self.sessions = set()
+        self.spilling = False
+
+    @property
+    def decoded_bytes(self):
+        return self.size[0] * self.size[1] * Image.getmodebands(self.mode)
+
+
+class PageList(Sequence):
+    """The pages of a session's upload, decoded one at a time when indexed or iterated."""
+
+    def __init__(self, store, keys):
+        self.store = store
+        self.keys = list(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PageList(self.store, self.keys[index])
+        return self.store.image(self.keys[index])
+
+
+class PageStore:
+    """Compressed page bytes in memory, spilled to disk beyond the memory budgets."""
+
+    def __init__(self, directory, max_memory=256 * 1024 * 1024, session_max_memory=64 * 1024 * 1024,
+                 idle_timeout=1800, compress_level=1, reclaim_interval=60):
+        self.directory = directory
+        self.max_memory = max_memory
+        self.session_max_memory = session_max_memory
+        self.idle_timeout = idle_timeout
+        self.compress_level = compress_level
+        self.reclaim_interval = reclaim_interval
+        self._pages = OrderedDict()   # key -> _Page, least recently used first
+        self._sessions = {}           # session id -> {'keys': set, 'last_seen': monotonic}
+        self._memory = 0
+        self._disk = 0
+        self._spilling = 0            # in-memory bytes currently being written out
+        self._spill_ids = itertools.count()
+        self._last_reclaim = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'decodes': 0, 'disk_reads': 0, 'spills': 0,
+                       'deleted': 0, 'reclaimed_sessions': 0}
+        os.makedirs(directory, exist_ok=True)
+        # Spill files from an earlier process are unreachable now
+        with os.scandir(directory) as it:
+            for item in it:
+                if item.name.endswith('.page'):
+                    self._remove_file(item.path)
+
+    def put(self, key, img, session_id):
+        """Compress ``img`` under ``key`` and reference it from ``session_id``.
+
+        Keys are shared through the upload cache, so a page stored again under
+        the same key keeps the sessions that already reference it.
+        """
+        data = zlib.compress(img.tobytes(), self.compress_level)
+        page = _Page(img.mode, img.size, data)
+        with self._lock:
+            previous = self._pages.get(key)
+            if previous is not None:
+                page.sessions.update(previous.sessions)
+                self._delete_locked(key)
+            page.sessions.add(session_id)
+            self._pages[key] = page
+            self._memory += page.stored_bytes
+            self._session_locked(session_id)['keys'].add(key)
+            self._stats['stored'] += 1
+            spills = self._plan_spills_locked(session_id)
+        self._spill(spills)
+        return key
+
+    def retain(self, session_id, keys):
+        """Reference ``keys`` from ``session_id``; False if any page is gone."""
+        with self._lock:
+            if any(key not in self._pages for key in keys):
+                return False
+            session = self._session_locked(session_id)
+            for key in keys:
+                self._pages[key].sessions.add(session_id)
+                session['keys'].add(key)
+            return True
+
+    def attach(self, session_id, keys):
+        """Make ``keys`` the session's pages, dropping its references to any others."""
+        keys = set(keys)
+        with self._lock:
+            session = self._session_locked(session_id)
+            for key in session['keys'] - keys:
+                self._unref_locked(session_id, key)
+            session['keys'] = {key for key in keys if key in self._pages}
+            for key in session['keys']:
+                self._pages[key].sessions.add(session_id)
+            spills = self._plan_spills_locked(session_id)
+        self._spill(spills)
+
+    def release(self, session_id):
+        """Drop every page reference held by ``session_id``."""
+        with self._lock:
+            self._release_locked(session_id)
+
+    def touch(self, session_id):
+        """Mark the session active; releases idle sessions every ``reclaim_interval`` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self._session_locked(session_id)
+            if now - self._last_reclaim < self.reclaim_interval:
+                return
+            self._last_reclaim = now
+            idle = [sid for sid, session in self._sessions.items()
+                    if now - session['last_seen'] > self.idle_timeout]
+            for sid in idle:
+                self._release_locked(sid)
+            self._stats['reclaimed_sessions'] += len(idle)
+
+    def image(self, key):
+        """Decode the page stored under ``key``."""
+        while True:
+            with self._lock:
+                page = self._pages[key]
+                self._pages.move_to_end(key)
+                data, path = page.data, page.path
+                self._stats['decodes'] += 1
+                if data is None:
+                    self._stats['disk_reads'] += 1
+            if data is not None:
+                break
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                break
+            except FileNotFoundError:
+                # Deleted or stored again since the lookup; look the key up again
+                with self._lock:
+                    if self._pages.get(key) is page and page.path == path:
+                        raise
+        return Image.frombytes(page.mode, page.size, zlib.decompress(data))
+
+    def session_usage(self, session_id):
+        with self._lock:
+            return self._usage_locked(session_id)
+
+    def sessions(self):
+        """Usage of every live session, largest in-memory footprint first."""
+        now = time.monotonic()
+        with self._lock:
+            usage = [dict(self._usage_locked(sid), session=sid, idle_seconds=now - session['last_seen'])
+                     for sid, session in self._sessions.items()]
+        return sorted(usage, key=lambda row: row['memory_bytes'], reverse=True)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update(pages=len(self._pages), sessions=len(self._sessions),
+                        memory_bytes=self._memory, max_memory=self.max_memory,
+                        disk_bytes=self._disk,
+                        decoded_bytes=sum(page.decoded_bytes for page in self._pages.values()))
+        return data
+
+    # Internals; callers hold self._lock
+    def _session_locked(self, session_id):
+        session = self._sessions.setdefault(session_id, {'keys': set(), 'last_seen': 0.0})
+        session['last_seen'] = time.monotonic()
+        return session
+
+    def _usage_locked(self, session_id):
+        session = self._sessions.get(session_id)
+        pages = [self._pages[key] for key in (session['keys'] if session else ()) if key in self._pages]
+        return {
+            'pages': len(pages),
+            'memory_bytes': sum(page.stored_bytes for page in pages if page.data is not None),
+            'disk_bytes': sum(page.stored_bytes for page in pages if page.data is None),
+            'decoded_bytes': sum(page.decoded_bytes for page in pages),
+        }
+
+    def _release_locked(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session:
+            for key in session['keys']:
+                self._unref_locked(session_id, key)
+
+    def _unref_locked(self, session_id, key):
+        page = self._pages.get(key)
+        if page is None:
+            return
+        page.sessions.discard(session_id)
+        if not page.sessions:
+            self._delete_locked(key)
+
+    def _delete_locked(self, key):
+        page = self._pages.pop(key)
+        if page.spilling:
+            page.spilling = False
+            self._spilling -= page.stored_bytes
+        if page.data is None:
+            self._disk -= page.stored_bytes
+            self._remove_file(page.path)
+        else:
+            self._memory -= page.stored_bytes
+        self._stats['deleted'] += 1
+
+    def _plan_spills_locked(self, session_id):
+        """Pick the least recently used pages to spill until both budgets hold.
+
+        Returns ``(key, page, path)`` for ``_spill`` to write once the lock is
+        released; the pages stay readable from memory until then.
+        """
+        session_keys = self._sessions[session_id]['keys']
+        session_memory = sum(self._pages[key].stored_bytes for key in session_keys
+                             if self._pages[key].data is not None and not self._pages[key].spilling)
+        memory = self._memory - self._spilling
+        spills = []
+        for key, page in self._pages.items():
+            if session_memory <= self.session_max_memory and memory <= self.max_memory:
+                break
+            if page.data is None or page.spilling:
+                continue
+            in_session = key in session_keys
+            if memory > self.max_memory or in_session:
+                page.spilling = True
+                self._spilling += page.stored_bytes
+                memory -= page.stored_bytes
+                if in_session:
+                    session_memory -= page.stored_bytes
+                name = f"{hashlib.sha1(key.encode()).hexdigest()}-{next(self._spill_ids)}.page"
+                spills.append((key, page, os.path.join(self.directory, name)))
+        return spills
+
+    def _spill(self, spills):
+        """Write planned spills to disk without holding the lock."""
+        for key, page, path in spills:
+            written = False
+            try:
+                with open(path, 'wb') as f:
+                    f.write(page.data)
+                written = True
+            finally:
+                with self._lock:
+                    if page.spilling:  # else already settled by _delete_locked
+                        page.spilling = False
+                        self._spilling -= page.stored_bytes
+                    # The page may have been deleted or replaced while it was written
+                    current = written and self._pages.get(key) is page
+                    if current:
+                        page.data = None
+                        page.path = path
+                        self._memory -= page.stored_bytes
+                        self._disk += page.stored_bytes
+                        self._stats['spills'] += 1
+                if written and not current:
+                    self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_page_store() -> PageStore:
+    """Return the process-wide page store configured from the PAGE_STORE_* settings."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PageStore(
+                    os.getenv('PAGE_STORE_DIR', os.path.join('.cache', 'pages')),
+                    max_memory=int(float(os.getenv('PAGE_STORE_MAX_MB', '256')) * 1024 * 1024),
+                    session_max_memory=int(float(os.getenv('PAGE_STORE_SESSION_MAX_MB', '64')) * 1024 * 1024),
+                    idle_timeout=float(os.getenv('PAGE_STORE_IDLE_MINUTES', '30')) * 60,
+                    compress_level=int(os.getenv('PAGE_STORE_COMPRESS_LEVEL', '1')),
+                )
+    return _store
@@ -0,0 +1,128 @@
+"""Lazy PDF rasterization, fanned out over a process pool for long documents.
+
+fitz documents cannot be shared between threads, so large PDFs are split into
+page ranges that worker processes open and render independently. Pages are
+yielded in order as soon as their range is done, and are built directly from
+the raw pixmap samples instead of round-tripping through PNG.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import fitz  # PyMuPDF for PDF processing
+from PIL import Image
+
+DEFAULT_DPI = int(os.getenv('PDF_RENDER_DPI', '300'))
+# Very large pages (drawings, posters) are rendered at a lower DPI so their
+# long edge never exceeds this many pixels
+MAX_LONG_EDGE = int(os.getenv('PDF_RENDER_MAX_LONG_EDGE', '4000'))
+# Documents shorter than this are rendered in-process; spawning is not worth it
+PARALLEL_MIN_PAGES = int(os.getenv('PDF_RENDER_PARALLEL_MIN_PAGES', '8'))
+PAGES_PER_TASK = int(os.getenv('PDF_RENDER_PAGES_PER_TASK', '2'))
+WORKERS = int(os.getenv('PDF_RENDER_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Forking a process that runs Streamlit's threads can deadlock the children
+                _executor = ProcessPoolExecutor(max_workers=WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def page_zoom(page_rect, dpi, max_long_edge):
+    """Scale factor for rendering ``page_rect`` at ``dpi``, capped by ``max_long_edge`` pixels."""
+    zoom = dpi / 72
+    long_edge = max(page_rect.width, page_rect.height)
+    if max_long_edge and long_edge * zoom > max_long_edge:
+        zoom = max_long_edge / long_edge
+    return zoom
+
+
+def _render_page(page, dpi, max_long_edge):
+    zoom = page_zoom(page.rect, dpi, max_long_edge)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return pix.width, pix.height, pix.samples
+
+
+def _render_pages(pdf_path, page_numbers, dpi, max_long_edge):
+    """Worker entry point: render a range of pages from a PDF on disk."""
+    document = fitz.open(pdf_path)
+    try:
+        return [_render_page(document.load_page(n), dpi, max_long_edge) for n in page_numbers]
+    finally:
+        document.close()
+
+
+def _to_image(width, height, samples) -> Image.Image:
+    return Image.frombytes("RGB", (width, height), samples)
+
+
+def iter_pdf_pages(pdf_bytes, dpi=None, max_long_edge=None, workers=None) -> Iterator[Image.Image]:
+    """Yield each page of a PDF as an RGB PIL image, in page order."""
+    dpi = dpi or DEFAULT_DPI
+    max_long_edge = MAX_LONG_EDGE if max_long_edge is None else max_long_edge
+    workers = workers or WORKERS
+
+    document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_count = len(document)
+    if page_count < PARALLEL_MIN_PAGES or workers <= 1:
+        try:
+            for page_num in range(page_count):
+                yield _to_image(*_render_page(document.load_page(page_num), dpi, max_long_edge))
+        finally:
+            document.close()
+        return
+    document.close()
+
+    # Workers open the document from a temp file rather than receiving the
+    # whole PDF pickled once per task
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(pdf_bytes)
+
+    executor = _get_executor()
+    ranges = deque(
+        range(start, min(start + PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PAGES_PER_TASK)
+    )
+    in_flight = deque()
+    try:
+        # Keep a bounded window of ranges in flight so finished pages do not
+        # pile up in memory ahead of the consumer
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                in_flight.append(executor.submit(_render_pages, pdf_path, ranges.popleft(), dpi, max_long_edge))
+            try:
+                rendered = in_flight.popleft().result()
+            except Exception:
+                if getattr(executor, '_broken', False):
+                    _reset_executor()
+                raise
+            for page in rendered:
+                yield _to_image(*page)
+    finally:
+        for future in in_flight:
+            future.cancel()
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass
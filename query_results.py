@@ -0,0 +1,186 @@
+"""Bounded, cached execution of ad-hoc SELECT queries.
+
+Generated SQL such as ``SELECT * FROM InvoiceItems`` would otherwise pull an
+entire table into memory. Queries get a ``TOP (n)`` row limit injected when it
+is safe to do so, results are streamed with ``fetchmany`` and stop at the
+limit regardless, and columns are assembled directly into a DataFrame. Recent
+results are kept for a short TTL and dropped as soon as the tables they read
+are written to.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+PAGE_SIZE = int(os.getenv('QUERY_PAGE_SIZE', '500'))
+FETCH_CHUNK = int(os.getenv('QUERY_FETCH_CHUNK', '1000'))
+RESULT_CACHE_TTL = float(os.getenv('QUERY_RESULT_CACHE_TTL', '60'))
+RESULT_CACHE_SIZE = int(os.getenv('QUERY_RESULT_CACHE_SIZE', '64'))
+
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+(?:\[?\w+\]?\.)*\[?(\w+)\]?', re.I)
+_SELECT_HEAD = re.compile(r'^\s*SELECT\s+(DISTINCT\s+)?', re.I)
+_NO_LIMIT = re.compile(r'\b(?:TOP|OFFSET|FETCH|UNION|INTERSECT|EXCEPT|INTO)\b', re.I)
+# String literals and line comments, which must not be rewritten
+_VERBATIM = re.compile(r"('(?:[^']|'')*'|--[^\n]*\n?)")
+
+
+def normalize_sql(sql_query):
+    """Collapse whitespace and drop a trailing semicolon (cache key form only).
+
+    String literals and ``--`` comments (with the line break that ends them)
+    are kept verbatim, so queries that differ inside them get different keys.
+    """
+    parts = _VERBATIM.split(sql_query)
+    for idx in range(0, len(parts), 2):
+        parts[idx] = re.sub(r'\s+', ' ', parts[idx])
+    return "".join(parts).strip().rstrip(';').strip()
+
+
+def is_select(sql_query):
+    return re.match(r'^\s*(?:SELECT|WITH)\b', sql_query, re.I) is not None
+
+
+def referenced_tables(sql_query):
+    """Lower-cased names of the tables a query reads from."""
+    return {name.lower() for name in _TABLE_REF.findall(sql_query)}
+
+
+def inject_row_limit(sql_query, limit):
+    """Add ``TOP (limit)`` to a plain SELECT; leave anything more complex untouched.
+
+    The rest of the statement is kept exactly as written.
+    """
+    head = _SELECT_HEAD.match(sql_query)
+    if not head or _NO_LIMIT.search(sql_query):
+        return sql_query
+    return f"{head.group(0)}TOP ({int(limit)}) {sql_query[head.end():]}"
+
+
+def fetch_dataframe(cursor, max_rows=None, chunk_size=FETCH_CHUNK):
+    """Stream the cursor's rows into a DataFrame column by column.
+
+    Reads at most ``max_rows + 1`` rows; returns ``(df, has_more)``.
+    """
+    import pandas as pd  # deferred: only pages that run queries pay for pandas
+    columns = [desc[0] for desc in cursor.description]
+    data = [[] for _ in columns]
+    fetched = 0
+    has_more = False
+    while True:
+        size = chunk_size if max_rows is None else min(chunk_size, max_rows + 1 - fetched)
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        # Transpose each chunk straight into per-column lists
+        for column_values, chunk_values in zip(data, zip(*rows)):
+            column_values.extend(chunk_values)
+        fetched += len(rows)
+        if max_rows is not None and fetched > max_rows:
+            has_more = True
+            break
+
+    if has_more:
+        for column_values in data:
+            del column_values[max_rows:]
+    # Build positionally so duplicate column names (e.g. SELECT * over a join) survive
+    df = pd.DataFrame({idx: values for idx, values in enumerate(data)})
+    df.columns = columns
+    return df, has_more
+
+
+class ResultCache:
+    """Short-lived LRU cache of query results, invalidated per table on writes."""
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (stored_at, tables, result)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(sql_query, params=(), max_rows=None):
+        return (normalize_sql(sql_query), tuple(params or ()), max_rows)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, tables, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), frozenset(tables), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_tables(self, tables):
+        """Drop every cached result that read from any of ``tables``."""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] & tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'invalidations': self.invalidations,
+            }
+
+
+# Shared by all sessions in the process
+result_cache = ResultCache()
+
+
+def invalidate_tables(tables):
+    return result_cache.invalidate_tables(tables)
+
+
+def run_query(conn, sql_query, params=(), max_rows=PAGE_SIZE, use_cache=True):
+    """Execute ``sql_query`` and return ``(df, has_more, from_cache)``.
+
+    Only SELECT statements are limited and cached; anything else runs as-is.
+    """
+    select = is_select(sql_query)
+    key = ResultCache.make_key(sql_query, params, max_rows)
+    if select and use_cache:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    statement = inject_row_limit(sql_query, max_rows + 1) if select and max_rows else sql_query
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(statement, params)
+    else:
+        cursor.execute(statement)
+    if cursor.description is None:
+        return None, False, False
+
+    df, has_more = fetch_dataframe(cursor, max_rows if select else None)
+    cursor.close()
+    if select and use_cache:
+        result_cache.put(key, referenced_tables(sql_query), (df, has_more))
+    return df, has_more, False
@@ -0,0 +1,75 @@
+"""Startup profiling: how long heavy imports and one-time init steps take.
+
+The app records the cost of each lazy import and init step the first time it
+happens in a process (shown on the System Stats tab). Run this module to
+measure cold import times of the heavy dependencies in fresh interpreters:
+
+    python startup.py
+"""
+import importlib
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+HEAVY_MODULES = ["streamlit", "pandas", "fitz", "PIL.Image", "google.generativeai", "pyodbc"]
+
+_timings = OrderedDict()
+_lock = threading.Lock()
+
+
+def record(name, seconds):
+    with _lock:
+        _timings.setdefault(name, seconds)
+
+
+@contextmanager
+def timed(name):
+    """Record how long the wrapped block took (first occurrence per process)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def lazy_import(module_name):
+    """Import ``module_name`` on first use and record the import cost."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with timed(f"import {module_name}"):
+        return importlib.import_module(module_name)
+
+
+def timings():
+    """Recorded startup costs in milliseconds, in the order they happened."""
+    with _lock:
+        return OrderedDict((name, seconds * 1000) for name, seconds in _timings.items())
+
+
+def measure_cold_import(module_name):
+    """Import time of ``module_name`` in a fresh interpreter, in milliseconds (None if missing)."""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module_name}; "
+        "print((time.perf_counter() - t) * 1000)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip())
+
+
+def main():
+    print(f"{'module':<24}{'cold import (ms)':>18}")
+    for module_name in HEAVY_MODULES:
+        elapsed = measure_cold_import(module_name)
+        shown = "not installed" if elapsed is None else f"{elapsed:.0f}"
+        print(f"{module_name:<24}{shown:>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Pre-aggregated reporting tables kept up to date by the invoice insert path.
+
+CustomerSales holds, per customer, the number of invoices, their summed
+totals, and the count and summed quantity of their line items. DailySales
+holds the same per invoice date. Questions such as "total sales by customer"
+or "how many invoices this month" read a few summary rows instead of
+scanning InvoiceMaster and InvoiceItems.
+
+``apply`` runs in the caller's transaction, next to the invoice insert, and
+adds (or, for replaced invoices, subtracts) each invoice's contribution, so
+the summaries never disagree with committed invoices. Invoices without a
+customer are counted under an empty name. Invoices without a date have no
+DailySales row, just as they match no date range in InvoiceMaster.
+``rebuild`` recomputes both tables from scratch; migration 8 uses it to
+backfill existing data.
+"""
+SUMMARY_TABLES = ("CustomerSales", "DailySales")
+
+# (table, key column) of each summary
+_SUMMARIES = (("CustomerSales", "customer"), ("DailySales", "invoice_date"))
+
+
+def invoice_totals(invoices):
+    """``(customer, invoice_date, total, item_count, item_quantity)`` per extracted invoice."""
+    return [
+        (data['customer'], data['invoice_date'], data['total'], len(data['items']),
+         sum(item['quantity'] or 0 for item in data['items']))
+        for data in invoices
+    ]
+
+
+def stored_totals(cursor, invoice_ids):
+    """The same tuples for invoices already in the database, e.g. before they are replaced."""
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    if not invoice_ids:
+        return []
+    placeholders = ", ".join("?" for _ in invoice_ids)
+    cursor.execute(f"""
+        SELECT im.customer, im.invoice_date, im.total, COUNT(it.id), COALESCE(SUM(it.quantity), 0)
+        FROM InvoiceMaster im
+        LEFT JOIN InvoiceItems it ON it.invoice_id = im.invoice_id
+        WHERE im.invoice_id IN ({placeholders})
+        GROUP BY im.invoice_id, im.customer, im.invoice_date, im.total
+    """, tuple(invoice_ids))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def _fold(key):
+    # SQL Server compares customer names case-insensitively, ignoring trailing spaces
+    return key.rstrip().casefold() if isinstance(key, str) else key
+
+
+def _deltas(added, removed):
+    """Per summary table, ``{folded key: [key, invoice_count, total_sales, item_count, item_quantity]}``."""
+    deltas = ({}, {})
+    for sign, totals in ((1, added), (-1, removed)):
+        for customer, invoice_date, total, item_count, item_quantity in totals:
+            contribution = (sign, sign * float(total or 0), sign * item_count, sign * int(item_quantity or 0))
+            keys = (customer or "", str(invoice_date)[:10] if invoice_date else None)
+            for table_deltas, key in zip(deltas, keys):
+                if key is None:
+                    continue
+                row = table_deltas.setdefault(_fold(key), [key, 0, 0.0, 0, 0])
+                for idx, value in enumerate(contribution, start=1):
+                    row[idx] += value
+    return deltas
+
+
+def apply(cursor, added, removed=()):
+    """Add the ``added`` invoice totals to the summaries and subtract the ``removed`` ones.
+
+    Both are lists of tuples from ``invoice_totals``/``stored_totals``. Runs
+    in the caller's transaction; the caller commits. The keys are read with
+    update and range locks held until commit. Two transactions adding the
+    same new customer or date therefore take turns, and the second one
+    updates the row the first inserted instead of failing on the primary key.
+    """
+    for (table, key_column), table_deltas in zip(_SUMMARIES, _deltas(added, removed)):
+        rows = [row for row in table_deltas.values() if any(row[1:])]
+        if not rows:
+            continue
+        keys = [row[0] for row in rows]
+        placeholders = ", ".join("?" for _ in keys)
+        cursor.execute(f"SELECT {key_column} FROM {table} WITH (UPDLOCK, HOLDLOCK) "
+                       f"WHERE {key_column} IN ({placeholders})", tuple(keys))
+        existing = {_fold(str(row[0])[:10] if key_column == "invoice_date" else row[0])
+                    for row in cursor.fetchall()}
+        updates = [(count, round(total, 2), items, quantity, key)
+                   for key, count, total, items, quantity in rows if _fold(key) in existing]
+        inserts = [(key, count, round(total, 2), items, quantity)
+                   for key, count, total, items, quantity in rows if _fold(key) not in existing]
+        if updates:
+            cursor.executemany(f"""
+                UPDATE {table}
+                SET invoice_count = invoice_count + ?, total_sales = total_sales + ?,
+                    item_count = item_count + ?, item_quantity = item_quantity + ?
+                WHERE {key_column} = ?
+            """, updates)
+        if inserts:
+            cursor.executemany(f"""
+                INSERT INTO {table} ({key_column}, invoice_count, total_sales, item_count, item_quantity)
+                VALUES (?, ?, ?, ?, ?)
+            """, inserts)
+        if removed:
+            # Keys whose last invoice was replaced by one elsewhere
+            cursor.execute(f"DELETE FROM {table} WHERE {key_column} IN ({placeholders}) AND invoice_count <= 0",
+                           tuple(keys))
+
+
+def rebuild(cursor):
+    """Recompute both summary tables from InvoiceMaster and InvoiceItems; the caller commits."""
+    item_totals = """
+        LEFT JOIN (
+            SELECT invoice_id, COUNT(*) AS item_count, SUM(quantity) AS item_quantity
+            FROM InvoiceItems
+            GROUP BY invoice_id
+        ) it ON it.invoice_id = im.invoice_id
+    """
+    aggregates = ("COUNT(*), COALESCE(SUM(im.total), 0), COALESCE(SUM(it.item_count), 0), "
+                  "COALESCE(SUM(it.item_quantity), 0)")
+    cursor.execute("DELETE FROM CustomerSales")
+    cursor.execute(f"""
+        INSERT INTO CustomerSales (customer, invoice_count, total_sales, item_count, item_quantity)
+        SELECT COALESCE(im.customer, ''), {aggregates}
+        FROM InvoiceMaster im
+        {item_totals}
+        GROUP BY COALESCE(im.customer, '')
+    """)
+    cursor.execute("DELETE FROM DailySales")
+    cursor.execute(f"""
+        INSERT INTO DailySales (invoice_date, invoice_count, total_sales, item_count, item_quantity)
+        SELECT im.invoice_date, {aggregates}
+        FROM InvoiceMaster im
+        {item_totals}
+        WHERE im.invoice_date IS NOT NULL
+        GROUP BY im.invoice_date
+    """)
@@ -0,0 +1,118 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+from audit import AuditWriter
+
+
+class Database:
+    """SQLite AuditLog that can be switched off to simulate an outage."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.up = True
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE AuditLog (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, "
+                     "action TEXT, details TEXT, timestamp TEXT)")
+        conn.close()
+
+    @contextmanager
+    def connect(self):
+        if not self.up:
+            raise ConnectionError("database unavailable")
+        conn = sqlite3.connect(self.path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def actions(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return [row[0] for row in conn.execute("SELECT action FROM AuditLog ORDER BY id")]
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Database(tmp_path / "audit.db")
+
+
+def make_writer(db, spill_path, **kwargs):
+    kwargs.setdefault('flush_interval', 0.01)
+    return AuditWriter(db.connect, spill_path=str(spill_path) if spill_path else None, **kwargs)
+
+
+def test_rows_are_written_in_batches(db, tmp_path):
+    writer = make_writer(db, tmp_path / "spill.jsonl", batch_size=10, flush_interval=5)
+    for n in range(25):
+        writer.log("alice", f"action {n}")
+    writer.close()
+    assert db.actions() == [f"action {n}" for n in range(25)]
+    assert writer.stats()['batches'] == 3
+
+
+def test_outage_spills_and_replays_in_order(db, tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    writer = make_writer(db, spill)
+    db.up = False
+    writer.log("alice", "while down")
+    assert writer.flush()
+    assert spill.exists()
+    db.up = True
+    writer.log("alice", "back up")
+    writer.close()
+    assert db.actions() == ["back up", "while down"]
+    assert not spill.exists()
+    assert writer.stats()['replayed'] == 1
+
+
+def test_unwritable_spill_file_does_not_stop_the_writer(db, tmp_path):
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    writer = make_writer(db, not_a_directory / "spill.jsonl")
+    db.up = False
+    writer.log("alice", "lost")
+    assert writer.flush()
+    db.up = True
+    writer.log("alice", "kept")
+    writer.close()
+    assert db.actions() == ["kept"]
+    assert "audit rows dropped" in writer.stats()['last_error']
+
+
+def test_corrupt_spill_lines_are_set_aside(db, tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    spill.write_text(json.dumps(["bob", "spilled", "", "2024-01-01T10:00:00"]) + "\n"
+                     "not json\n"
+                     + json.dumps(["bob", "bad date", "", "yesterday"]) + "\n", encoding='utf-8')
+    writer = make_writer(db, spill)
+    writer.log("alice", "live")
+    writer.close()
+    assert db.actions() == ["live", "spilled"]
+    assert len((tmp_path / "spill.jsonl.bad").read_text(encoding='utf-8').splitlines()) == 2
+
+
+def test_unreadable_replay_file_is_kept_for_later(db, tmp_path, monkeypatch):
+    spill = tmp_path / "spill.jsonl"
+    spill.write_text(json.dumps(["bob", "spilled", "", "2024-01-01T10:00:00"]) + "\n", encoding='utf-8')
+    writer = make_writer(db, spill)
+    real_open = open
+
+    def failing_open(path, *args, **kwargs):
+        if str(path).endswith(".replay"):
+            raise PermissionError("locked by another process")
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr('builtins.open', failing_open)
+    writer.log("alice", "first")
+    assert writer.flush()
+    assert (tmp_path / "spill.jsonl.replay").exists()
+    monkeypatch.setattr('builtins.open', real_open)
+    writer.log("alice", "second")
+    writer.close()
+    assert db.actions() == ["first", "second", "spilled"]
+    assert not (tmp_path / "spill.jsonl.replay").exists()
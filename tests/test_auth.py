@@ -0,0 +1,75 @@
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+from auth import UserDirectory, hash_password, legacy_hash, needs_rehash, verify_password
+from benchmarks.sqlite_schema import SQLITE_SCHEMA
+
+ITERATIONS = 1000
+
+
+@pytest.fixture
+def connect(tmp_path):
+    path = str(tmp_path / "users.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(SQLITE_SCHEMA)
+    conn.close()
+
+    @contextmanager
+    def connect():
+        conn = sqlite3.connect(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    return connect
+
+
+def stored_hash(connect, username):
+    with connect() as conn:
+        return conn.execute("SELECT password_hash FROM Users WHERE username = ?", (username,)).fetchone()[0]
+
+
+def test_hash_round_trip():
+    stored = hash_password("secret", ITERATIONS)
+    assert verify_password("secret", stored)
+    assert not verify_password("wrong", stored)
+    assert not verify_password("secret", "")
+    assert not needs_rehash(stored, ITERATIONS)
+    assert needs_rehash(stored, ITERATIONS * 2)
+
+
+def test_login_returns_stored_username_whatever_the_case(connect):
+    directory = UserDirectory(connect, iterations=ITERATIONS)
+    directory.add_user("Alice", "secret")
+    assert directory.verify("alice", "secret") == ("Alice", 0)
+    assert directory.verify("ALICE", "secret") == ("Alice", 0)
+    assert directory.verify("alice", "wrong") is None
+    assert directory.verify("nobody", "secret") is None
+
+
+def test_user_added_elsewhere_is_found_under_its_stored_name(connect):
+    directory = UserDirectory(connect, iterations=ITERATIONS)
+    assert directory.users() == []
+    with connect() as conn:
+        conn.execute("INSERT INTO Users (username, password_hash) VALUES (?, ?)",
+                     ("Bob", hash_password("pw", ITERATIONS)))
+        conn.commit()
+    assert directory.verify("BOB", "pw") == ("Bob", 0)
+    assert [user[0] for user in directory.users()] == ["Bob"]
+    assert directory.stats()['cached_users'] == 1
+
+
+def test_legacy_and_weak_hashes_are_upgraded(connect):
+    with connect() as conn:
+        conn.executemany("INSERT INTO Users (username, password_hash) VALUES (?, ?)",
+                         [("old", legacy_hash("pw")), ("weak", hash_password("pw", ITERATIONS // 2))])
+        conn.commit()
+    directory = UserDirectory(connect, iterations=ITERATIONS)
+    assert directory.verify("OLD", "pw") == ("old", 0)
+    assert directory.verify("weak", "pw") == ("weak", 0)
+    for username in ("old", "weak"):
+        assert stored_hash(connect, username).startswith(f"pbkdf2_sha256${ITERATIONS}$")
+    assert directory.stats()['rehashed'] == 2
+    assert directory.verify("old", "pw") == ("old", 0)
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolClosed, PoolTimeout
+
+
+class FakeCursor:
+    def execute(self, sql):
+        pass
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+        self.rollbacks = 0
+
+    def cursor(self):
+        if not self.healthy:
+            raise RuntimeError("connection lost")
+        return FakeCursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    return ConnectionPool(connect, **kwargs), opened
+
+
+def test_reuses_released_connection():
+    pool, opened = make_pool(size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(opened) == 1
+    assert first.rollbacks == 2  # rolled back on each return
+    stats = pool.stats()
+    assert stats['checkouts'] == 2
+    assert stats['misses'] == 1
+    assert stats['idle'] == 1 and stats['in_use'] == 0
+
+
+def test_timeout_records_wait():
+    pool, _ = make_pool(size=1)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire(timeout=0.05)
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['waits'] == 1
+    assert stats['wait_time_max'] >= 0.05
+    pool.release(held)
+
+
+def test_waiter_gets_released_connection():
+    pool, opened = make_pool(size=1)
+    held = pool.acquire()
+    threading.Timer(0.05, pool.release, args=(held,)).start()
+    assert pool.acquire(timeout=2) is held
+    assert len(opened) == 1
+    assert pool.stats()['waits'] == 1
+
+
+def test_unhealthy_idle_connection_is_replaced():
+    pool, opened = make_pool(size=1, health_check_interval=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.healthy = False
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert conn.closed
+    assert pool.stats()['health_check_failures'] == 1
+    assert len(opened) == 2
+
+
+def test_error_inside_block_discards_broken_connection():
+    pool, _ = make_pool(size=1)
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.rollback = None  # rollback now fails
+            raise ValueError("query failed")
+    assert conn.closed
+    assert pool.stats()['open'] == 0
+
+
+def test_idle_connections_expire():
+    pool, _ = make_pool(size=2, max_idle=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.evict_idle() == 1
+    assert conn.closed
+    assert pool.stats()['evicted_idle'] == 1
+
+
+def test_closed_pool_refuses_checkout():
+    pool, _ = make_pool()
+    pool.close()
+    with pytest.raises(PoolClosed):
+        pool.acquire()
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+
+import pytest
+
+import extraction
+from extraction import ExtractionCancelled, merge_chunk_results, stream_gemini_response
+from model_client import FakeModel
+
+PAGES = [{'mime_type': 'image/png', 'data': b"page 1"}, {'mime_type': 'image/png', 'data': b"page 2"}]
+
+
+def item(description, quantity=1, price=1.0):
+    return {'description': description, 'quantity': quantity, 'price': price}
+
+
+def test_merge_takes_header_from_first_window_and_total_from_last():
+    merged = merge_chunk_results([
+        {'invoice_id': "INV-1", 'customer': None, 'invoice_date': "2024-01-01", 'total': None,
+         'items': [item("a")]},
+        {'invoice_id': None, 'customer': "Acme", 'invoice_date': None, 'total': 12.0, 'items': [item("b")]},
+        {'invoice_id': "INV-2", 'customer': "", 'invoice_date': None, 'total': "", 'items': []},
+    ])
+    assert merged == {'invoice_id': "INV-1", 'customer': "Acme", 'invoice_date': "2024-01-01",
+                      'total': 12.0, 'items': [item("a"), item("b")]}
+
+
+def test_merge_drops_rows_repeated_across_a_page_break_only():
+    first = [item("a"), item("b"), item("Split  Row", 2, 3.0)]
+    second = [item("split row", "2", "3.0"), item("c"), item("a")]
+    merged = merge_chunk_results([{'items': first}, {'items': second}])
+    assert [i['description'] for i in merged['items']] == ["a", "b", "Split  Row", "c", "a"]
+
+
+class StalledStream:
+    """A stream that sends one chunk and then goes silent until released."""
+
+    def __init__(self, first):
+        self.first = first
+        self.release = threading.Event()
+        self.closed = False
+
+    def __iter__(self):
+        yield type("Chunk", (), {'text': self.first})()
+        self.release.wait(5)
+
+    def close(self):
+        self.closed = True
+
+
+class StalledModel:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def generate_content(self, content, stream=False):
+        return self.stream
+
+
+def test_stream_returns_full_response_and_items():
+    received = []
+    text, from_cache = stream_gemini_response(FakeModel(), "prompt", PAGES,
+                                              on_item=lambda item, header: received.append(item))
+    assert not from_cache
+    assert json.loads(text)['items'] == received
+    assert len(received) == 2
+
+
+def test_cancel_stops_a_stalled_stream():
+    stream = StalledStream('{"invoice_id": "INV-1", "items": [')
+    cancel = threading.Event()
+    waits = []
+    threading.Timer(0.2, cancel.set).start()
+    cancelled_before = extraction.streaming_stats()['cancelled']
+    started = time.monotonic()
+    with pytest.raises(ExtractionCancelled):
+        stream_gemini_response(StalledModel(stream), "prompt", PAGES, cancel=cancel, on_wait=waits.append)
+    assert time.monotonic() - started < 2
+    assert waits
+    assert extraction.streaming_stats()['cancelled'] == cancelled_before + 1
+    stream.release.set()
+    deadline = time.monotonic() + 2
+    while not stream.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stream.closed
+
+
+class ScriptedModel:
+    """Answers each request with the next of ``responses`` (the last one repeats)."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def generate_content(self, content, stream=False, request_options=None):
+        text = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        chunk = type("Chunk", (), {'text': text})()
+        return iter([chunk]) if stream else chunk
+
+
+VALID = json.dumps({'invoice_id': "INV-1", 'customer': "Acme", 'invoice_date': "2024-01-01",
+                    'total': 1.0, 'items': [item("a")]})
+
+
+def test_stream_requests_an_unparseable_response_again():
+    model = ScriptedModel('{"invoice_id": "INV-1", "items": [', VALID)
+    retries = []
+    text, _ = stream_gemini_response(model, "prompt", PAGES, on_retry=retries.append)
+    assert text == VALID
+    assert model.calls == 2
+    assert retries == [1]
+
+
+def test_stream_returns_last_response_when_retries_run_out():
+    model = ScriptedModel("not json")
+    text, _ = stream_gemini_response(model, "prompt", PAGES, parse_retries=1)
+    assert text == "not json"
+    assert model.calls == 2
+
+
+def test_single_request_retries_use_the_parse_limit():
+    model = ScriptedModel("not json")
+    text, _ = extraction.extract_invoice(model, "prompt", PAGES, chunk_pages=0, retries=0, parse_retries=2)
+    assert text == "not json"
+    assert model.calls == 3
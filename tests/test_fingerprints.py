@@ -0,0 +1,69 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from benchmarks.sqlite_schema import SQLITE_SCHEMA, connect
+from fingerprints import FingerprintIndex, hamming, page_hash
+
+
+def page(seed):
+    """A page of dark blocks laid out differently for each seed."""
+    rng = random.Random(seed)
+    img = Image.new('L', (850, 1100), 255)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        left, top = rng.randrange(0, 700), rng.randrange(0, 950)
+        draw.rectangle((left, top, left + rng.randrange(60, 300), top + rng.randrange(40, 200)),
+                       fill=rng.randrange(0, 160))
+    return img
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "app.db")
+    conn = connect(path)
+    conn.executescript(SQLITE_SCHEMA)
+    conn.close()
+    return FingerprintIndex(connect=lambda: connect(path))
+
+
+def store(index, invoice_id, documents):
+    with index._connect() as conn:
+        index.record(conn.cursor(), invoice_id, documents, "tester")
+
+
+def test_rescan_hashes_close_and_other_pages_far():
+    original = page(1)
+    rescan = original.filter(ImageFilter.GaussianBlur(1)).resize((1275, 1650))
+    assert hamming(page_hash(original), page_hash(rescan)) <= 6
+    assert hamming(page_hash(original), page_hash(page(2))) > 6
+
+
+def test_find_exact_returns_recorded_files(index):
+    store(index, "INV-1", [("a.pdf", "a" * 64, [1, 2])])
+    matches = index.find_exact(["a" * 64, "b" * 64, "a" * 64])
+    assert list(matches) == ["a" * 64]
+    assert matches["a" * 64]['invoice_id'] == "INV-1"
+    assert index.stats()['exact_hits'] == 1
+
+
+def test_record_repoints_a_known_file(index):
+    store(index, "INV-1", [("a.pdf", "a" * 64, [1])])
+    store(index, "INV-2", [("a-again.pdf", "a" * 64, [1])])
+    match = index.find_exact(["a" * 64])["a" * 64]
+    assert (match['file_name'], match['invoice_id']) == ("a-again.pdf", "INV-2")
+
+
+def test_find_similar_needs_enough_matching_pages(index):
+    hashes = [page_hash(page(seed)) for seed in range(4)]
+    store(index, "INV-1", [("a.pdf", "a" * 64, hashes)])
+    store(index, "INV-2", [("b.pdf", "b" * 64, hashes[:1])])
+    assert index.find_similar(hashes[:2] + [page_hash(page(9))]) == [("INV-1", 2)]
+    assert index.find_similar([page_hash(page(8)), page_hash(page(9))]) == []
+
+
+def test_add_updates_the_loaded_index(index):
+    assert index.find_similar([page_hash(page(1))]) == []
+    index.add("INV-3", [("c.pdf", "c" * 64, [page_hash(page(1))])])
+    assert index.find_similar([page_hash(page(1))]) == [("INV-3", 1)]
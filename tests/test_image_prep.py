@@ -0,0 +1,28 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from image_prep import prepare_page
+
+
+def scan(size=(1700, 2200)):
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    for top in range(200, size[1] - 200, 60):
+        draw.text((150, top), "Widget, 3 x 12.50", fill='black')
+    return img
+
+
+def test_png_bytes_is_the_old_lossless_upload():
+    img = scan()
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    part, stats = prepare_page(img, measure_png=True)
+    assert stats['png_bytes'] == len(buffer.getvalue())
+    assert stats['bytes_after'] == len(part['data'])
+    assert stats['decoded_bytes'] == 1700 * 2200 * 3
+
+
+def test_png_measurement_can_be_skipped():
+    _, stats = prepare_page(scan((400, 500)), measure_png=False)
+    assert stats['png_bytes'] is None
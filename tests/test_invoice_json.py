@@ -0,0 +1,96 @@
+import pytest
+
+import invoice_json
+from invoice_json import InvoiceParseError, InvoiceValidationError
+
+
+def test_parses_fenced_json_with_prose():
+    text = 'Here you go:\n```json\n{"invoice_id": "INV-1", "total": 12, "items": []}\n```\nThanks'
+    invoice = invoice_json.parse_invoice(text)
+    assert invoice['invoice_id'] == "INV-1"
+    assert invoice['total'] == 12.0
+
+
+def test_repairs_single_quotes_trailing_commas_and_literals():
+    text = "{'invoice_id': 'INV-2', 'customer': None, 'items': [{'description': 'it\\'s', 'quantity': 1,},],}"
+    invoice = invoice_json.parse_invoice(text)
+    assert invoice['customer'] is None
+    assert invoice['items'] == [{'description': "it's", 'quantity': 1, 'price': None}]
+
+
+def test_braces_inside_strings_do_not_end_the_object():
+    text = 'note {stray {"invoice_id": "INV-3", "customer": "A } B", "items": []} trailing'
+    assert invoice_json.parse_invoice(text)['customer'] == "A } B"
+
+
+def test_coerces_values_to_database_types():
+    invoice = invoice_json.parse_invoice(
+        '{"invoice_id": 42, "invoice_date": "25/03/2024", "total": "$1,234.50",'
+        ' "items": [{"description": " Bolt ", "quantity": "2", "price": "3.5"}]}')
+    assert invoice['invoice_id'] == "42"
+    assert invoice['invoice_date'] == "2024-03-25"
+    assert invoice['total'] == 1234.5
+    assert invoice['items'] == [{'description': "Bolt", 'quantity': 2, 'price': 3.5}]
+
+
+def parsed_date(value):
+    return invoice_json.parse_invoice(f'{{"invoice_id": "D", "invoice_date": "{value}"}}')['invoice_date']
+
+
+def test_numeric_dates_valid_only_one_way_are_accepted():
+    assert parsed_date("03/25/2024") == "2024-03-25"
+    assert parsed_date("07-07-2024") == "2024-07-07"
+    assert parsed_date("05.03.2024") == "2024-03-05"
+
+
+def test_ambiguous_numeric_date_is_rejected():
+    with pytest.raises(InvoiceValidationError) as excinfo:
+        parsed_date("05/03/2024")
+    assert "ambiguous" in excinfo.value.errors[0]
+
+
+def test_configured_date_order_resolves_ambiguity(monkeypatch):
+    monkeypatch.setattr(invoice_json, 'DATE_ORDER', 'mdy')
+    assert parsed_date("05/04/2024") == "2024-05-04"
+    with pytest.raises(InvoiceValidationError):
+        parsed_date("25/04/2024")
+
+
+def test_memoized_failure_raises_a_new_exception_each_time():
+    text = "no invoice here"
+    errors = []
+    for _ in range(2):
+        with pytest.raises(InvoiceParseError) as excinfo:
+            invoice_json.parse_invoice(text)
+        errors.append(excinfo.value)
+    assert errors[0] is not errors[1]
+    assert str(errors[0]) == str(errors[1])
+
+
+def test_invoice_id_is_required_unless_partial():
+    text = '{"items": [{"description": "x", "quantity": 1, "price": 1}]}'
+    with pytest.raises(InvoiceValidationError) as excinfo:
+        invoice_json.parse_invoice(text)
+    assert excinfo.value.errors == ["invoice_id: missing"]
+    assert invoice_json.parse_invoice(text, partial=True)['invoice_id'] is None
+
+
+def test_reports_every_validation_error():
+    with pytest.raises(InvoiceValidationError) as excinfo:
+        invoice_json.parse_invoice('{"invoice_id": "I", "invoice_date": "someday", '
+                                   '"items": [{"quantity": 1.5}, "oops"]}')
+    assert len(excinfo.value.errors) == 3
+
+
+def test_response_without_json_fails():
+    with pytest.raises(InvoiceParseError):
+        invoice_json.parse_invoice("Sorry, I could not read this invoice.")
+
+
+def test_memoized_results_are_copies():
+    text = '{"invoice_id": "INV-4", "items": []}'
+    first = invoice_json.parse_invoice(text)
+    first['items'].append({'description': "edited"})
+    hits = invoice_json.stats()['memo_hits']
+    assert invoice_json.parse_invoice(text)['items'] == []
+    assert invoice_json.stats()['memo_hits'] == hits + 1
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import jobs
+from fingerprints import DuplicateDocumentError
+from jobs import JobQueue, JobStore
+
+MATCH = {'content_hash': "abc", 'file_name': "a.png", 'invoice_id': "INV-1",
+         'created_by': "bob", 'created_date': None}
+
+
+@pytest.fixture(autouse=True)
+def audit_rows(monkeypatch):
+    rows = []
+    monkeypatch.setattr(jobs, 'log_audit', lambda *args: rows.append(args))
+    return rows
+
+
+def wait_for(store, job_id, statuses=("done", "failed"), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {store.get(job_id)['status']}")
+
+
+def wait_idle(job_queue, timeout=5.0):
+    # A job is marked done before its inputs are removed and it is audited
+    deadline = time.monotonic() + timeout
+    while job_queue.stats()['active_workers'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job_queue.stats()['active_workers'] == 0
+
+
+def test_job_runs_and_stores_result(tmp_path, audit_rows):
+    store = JobStore(str(tmp_path))
+    job_queue = JobQueue(store, run_job=lambda job, files: {'pages': len(files), 'raw_json': "{}"}, workers=1)
+    job = wait_for(store, job_queue.submit("alice", [("a.png", b"1"), ("b.png", b"2")])['id'])
+    assert job['status'] == "done" and job['pages'] == 2
+    wait_idle(job_queue)
+    assert not (tmp_path / job['id'] / 'inputs').exists()
+    assert audit_rows and audit_rows[0][0] == "alice"
+
+
+def test_failures_do_not_stop_the_worker(tmp_path, monkeypatch):
+    def run_job(job, files):
+        if files[0][1] == b"boom":
+            raise RuntimeError("model down")
+        if files[0][1] == b"unstorable":
+            return {'raw_json': object()}  # job.json cannot be written
+        return {'pages': 1}
+
+    def broken_audit(*args):
+        raise OSError("audit spill unavailable")
+
+    monkeypatch.setattr(jobs, 'log_audit', broken_audit)
+    store = JobStore(str(tmp_path))
+    job_queue = JobQueue(store, run_job=run_job, workers=1)
+    failed = job_queue.submit("alice", [("a.png", b"boom")])
+    unstorable = job_queue.submit("alice", [("b.png", b"unstorable")])
+    audited = job_queue.submit("alice", [("c.png", b"fine")])
+    assert wait_for(store, failed['id'])['error'] == "RuntimeError: model down"
+    assert wait_for(store, unstorable['id'])['status'] == "failed"
+    assert wait_for(store, audited['id'])['status'] == "done"
+    wait_idle(job_queue)
+
+
+def test_duplicate_can_be_processed_anyway(tmp_path):
+    def run_job(job, files):
+        if "abc" not in job['allow_duplicates']:
+            raise DuplicateDocumentError([MATCH])
+        return {'pages': 1}
+
+    store = JobStore(str(tmp_path))
+    job_queue = JobQueue(store, run_job=run_job, workers=1)
+    job = wait_for(store, job_queue.submit("alice", [("a.png", b"1")])['id'])
+    assert job['status'] == "failed" and job['duplicates'] == ["abc"]
+    job_queue.retry(job['id'], allow_duplicates=True)
+    assert wait_for(store, job['id'])['status'] == "done"
+
+
+def test_extraction_job_checks_duplicates_unless_allowed(monkeypatch):
+    class Index:
+        def find_exact(self, content_hashes):
+            return {content_hash: dict(MATCH, content_hash=content_hash) for content_hash in content_hashes}
+
+    monkeypatch.setattr(jobs, 'get_fingerprint_index', Index)
+    monkeypatch.setattr(jobs.extraction, 'load_pages', lambda name, data: [])
+    files = [("a.png", b"1")]
+    with pytest.raises(DuplicateDocumentError):
+        jobs.run_extraction_job({'allow_duplicates': []}, files)
+    allowed = [jobs.upload_digest(b"1")]
+    with pytest.raises(ValueError, match="no pages"):
+        jobs.run_extraction_job({'allow_duplicates': allowed}, files)
+
+
+def test_interrupted_jobs_are_queued_again(tmp_path):
+    store = JobStore(str(tmp_path))
+    job = store.create("alice", [("a.png", b"1")])
+    store.update(job['id'], status="running")
+    JobQueue(store, run_job=lambda job, files: {'pages': 1}, workers=1)
+    assert wait_for(store, job['id'])['status'] == "done"
@@ -0,0 +1,46 @@
+import json
+
+from json_stream import IncrementalInvoiceParser
+
+INVOICE = {
+    "invoice_id": "INV-7", "customer": "Acme {West}", "invoice_date": "2024-06-15", "total": 30.5,
+    "items": [
+        {"description": "Bolt \"M8\"", "quantity": 2, "price": 1.25},
+        {"description": "Nested {brace}", "quantity": 1, "price": 28.0},
+    ],
+}
+
+
+def feed_in_pieces(text, size):
+    parser = IncrementalInvoiceParser()
+    received = []
+    for start in range(0, len(text), size):
+        received.extend(parser.feed(text[start:start + size]))
+    return parser, received
+
+
+def test_items_arrive_whatever_the_chunk_size():
+    text = json.dumps(INVOICE)
+    for size in (1, 7, len(text)):
+        parser, received = feed_in_pieces(text, size)
+        assert received == INVOICE['items']
+        assert parser.done and parser.text == text
+
+
+def test_item_is_emitted_as_soon_as_it_closes():
+    parser = IncrementalInvoiceParser()
+    assert parser.feed('{"invoice_id": "INV-7", "items": [{"description": "a", "quantity": 1}, {"desc') \
+        == [{"description": "a", "quantity": 1}]
+    assert parser.header() == {"invoice_id": "INV-7"}
+    assert parser.feed('ription": "b"}]}') == [{"description": "b"}]
+
+
+def test_header_ignores_fields_inside_items():
+    parser, _ = feed_in_pieces('{"customer": "Acme", "items": [{"total": 5, "customer": "Other"}], "total": 9}', 4)
+    assert parser.header() == {"customer": "Acme"}
+
+
+def test_tolerates_fences_single_quotes_and_trailing_commas():
+    text = "```json\n{'invoice_id': 'INV-8', 'items': [{'description': 'it\\'s', 'quantity': 1,},]}\n```"
+    _, received = feed_in_pieces(text, 5)
+    assert received == [{"description": "it's", "quantity": 1}]
@@ -0,0 +1,102 @@
+import json
+import threading
+
+import pytest
+
+from model_client import CircuitBreaker, CircuitOpenError, FakeModel, ModelCallError, ModelClient
+
+
+class FlakyModel:
+    """Raises ``errors`` in turn, then answers like FakeModel."""
+
+    def __init__(self, *errors, latency=0.0):
+        self.errors = list(errors)
+        self.latency = latency
+        self.calls = 0
+        self._fake = FakeModel(latency=latency)
+
+    def generate_content(self, content, stream=False, request_options=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self._fake.generate_content(content, stream=stream, request_options=request_options)
+
+
+def make_client(model, **kwargs):
+    kwargs.setdefault('base_delay', 0.001)
+    return ModelClient(model, **kwargs)
+
+
+def test_fake_model_returns_invoice_per_page():
+    response = make_client(FakeModel()).generate_content(
+        ["prompt", {'mime_type': 'image/png', 'data': b"page 1"}, {'mime_type': 'image/png', 'data': b"page 2"}])
+    invoice = json.loads(response.text)
+    assert invoice['invoice_id'].startswith("FAKE-")
+    assert len(invoice['items']) == 2
+
+
+def test_retries_transient_errors():
+    model = FlakyModel(ConnectionError("reset"), TimeoutError("slow"))
+    client = make_client(model, retries=2)
+    assert client.generate_content(["prompt"]).text
+    stats = client.stats()
+    assert model.calls == 3
+    assert stats['retries'] == 2
+    assert stats['timeouts'] == 1
+    assert stats['failures'] == 0
+
+
+def test_gives_up_after_retries():
+    model = FlakyModel(*[ConnectionError("reset")] * 3)
+    client = make_client(model, retries=1)
+    with pytest.raises(ModelCallError):
+        client.generate_content(["prompt"])
+    assert model.calls == 2
+    assert client.stats()['failures'] == 1
+
+
+def test_does_not_retry_bad_requests():
+    model = FlakyModel(ValueError("bad prompt"))
+    client = make_client(model, retries=3)
+    with pytest.raises(ModelCallError):
+        client.generate_content(["prompt"])
+    assert model.calls == 1
+    assert client.breaker.state == "closed"
+
+
+def test_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    model = FlakyModel(ConnectionError("down"), ConnectionError("down"))
+    client = make_client(model, retries=1, breaker=breaker)
+    with pytest.raises(ModelCallError):
+        client.generate_content(["prompt"])
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        client.generate_content(["prompt"])
+    assert model.calls == 2
+    assert client.stats()['rejected'] == 1
+
+    threading.Event().wait(0.06)
+    assert client.generate_content(["prompt"]).text
+    assert breaker.state == "closed"
+
+
+def test_identical_concurrent_requests_share_one_call():
+    model = FakeModel(latency=0.1)
+    client = make_client(model)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate_content(["same"])))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model.calls == 1
+    assert len({id(response) for response in results}) == 1
+    assert client.stats()['coalesced'] == 3
+
+
+def test_stream_yields_whole_response():
+    client = make_client(FakeModel())
+    chunks = client.generate_content(["prompt"], stream=True)
+    assert json.loads("".join(chunk.text for chunk in chunks))['customer'] == "Offline Customer"
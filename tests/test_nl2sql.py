@@ -0,0 +1,43 @@
+import pytest
+
+import nl2sql
+from benchmarks.sqlite_schema import SQLITE_SCHEMA, connect
+
+
+@pytest.mark.parametrize("question, table", [
+    ("How many invoices are there?", "CustomerSales"),
+    ("count invoices this month", "DailySales"),
+    ("Please show total sales by customer", "CustomerSales"),
+    ("daily revenue", "DailySales"),
+])
+def test_counts_and_totals_read_the_summaries(question, table):
+    sql, params = nl2sql.match_template(question)
+    assert f"FROM {table}" in sql
+    assert params == ()
+
+
+def test_items_of_an_invoice_are_parameterized():
+    assert nl2sql.match_template("what items are in invoice INV-001?") == (
+        "SELECT * FROM InvoiceItems WHERE invoice_id = ?", ("INV-001",))
+
+
+@pytest.mark.parametrize("question", [
+    "show invoices from March",
+    "show invoices from last month",
+    "list invoices from 2024",
+    "show invoices for this month",
+])
+def test_date_phrases_go_to_the_model(question):
+    assert nl2sql.match_template(question) is None
+
+
+def test_customer_search_matches_wildcards_literally():
+    conn = connect()
+    conn.executescript(SQLITE_SCHEMA)
+    conn.executemany("INSERT INTO InvoiceMaster (invoice_id, customer) VALUES (?, ?)",
+                     [("INV-1", "100% Cotton_Co"), ("INV-2", "1000 Cotton Co"), ("INV-3", "[Acme] Ltd")])
+    for customer, expected in (("100% Cotton_Co", ["INV-1"]), ("[Acme]", ["INV-3"])):
+        sql, params = nl2sql.match_template(f"show invoices from customer {customer}")
+        assert "ESCAPE" in sql
+        assert [row[1] for row in conn.execute(sql, params)] == expected
+    conn.close()
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+from PIL import Image
+
+from page_store import PageList, PageStore
+
+
+def page(shade, size=(64, 48)):
+    return Image.new('L', size, shade)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PageStore(str(tmp_path), max_memory=10 ** 9, session_max_memory=10 ** 9)
+
+
+def test_round_trip(store):
+    key = store.put("upload:0", page(120), "s1")
+    img = store.image(key)
+    assert img.size == (64, 48) and img.getpixel((3, 3)) == 120
+    assert list(PageList(store, [key]))[0].mode == 'L'
+
+
+def test_page_is_deleted_with_its_last_session(store):
+    store.put("upload:0", page(1), "s1")
+    assert store.retain("s2", ["upload:0"])
+    store.release("s1")
+    assert store.image("upload:0")
+    store.release("s2")
+    with pytest.raises(KeyError):
+        store.image("upload:0")
+
+
+def test_storing_a_shared_key_again_keeps_other_sessions(store):
+    store.put("upload:0", page(1), "s1")
+    store.retain("s2", ["upload:0"])
+    store.put("upload:0", page(2), "s1")
+    store.release("s1")
+    assert store.image("upload:0").getpixel((0, 0)) == 2
+    assert store.session_usage("s2")['pages'] == 1
+
+
+def test_session_budget_spills_to_disk_and_reads_back(tmp_path):
+    size = (256, 256)
+    noisy = [Image.effect_noise(size, 60).convert('L') for _ in range(3)]
+    store = PageStore(str(tmp_path), session_max_memory=len(noisy[0].tobytes()) * 2)
+    keys = [store.put(f"upload:{idx}", img, "s1") for idx, img in enumerate(noisy)]
+    stats = store.stats()
+    assert stats['spills'] >= 1 and stats['disk_bytes'] > 0
+    assert list(tmp_path.glob("*.page"))
+    assert [store.image(key).tobytes() for key in keys] == [img.tobytes() for img in noisy]
+    store.release("s1")
+    assert not list(tmp_path.glob("*.page"))
+    assert store.stats()['memory_bytes'] == 0 and store.stats()['disk_bytes'] == 0
+
+
+def test_attach_drops_pages_no_longer_used(store):
+    store.put("upload:0", page(1), "s1")
+    store.put("upload:1", page(2), "s1")
+    store.attach("s1", ["upload:1"])
+    assert store.stats()['pages'] == 1
+
+
+def test_idle_sessions_are_reclaimed(tmp_path):
+    store = PageStore(str(tmp_path), idle_timeout=0, reclaim_interval=0)
+    store.put("upload:0", page(1), "idle")
+    threading.Event().wait(0.01)
+    store.touch("active")
+    assert store.stats()['pages'] == 0
+    assert store.stats()['reclaimed_sessions'] == 1
+
+
+def test_concurrent_readers_and_spills(tmp_path):
+    store = PageStore(str(tmp_path), max_memory=1, session_max_memory=1)
+    for idx in range(4):
+        store.put(f"upload:{idx}", page(idx), "s1")
+    errors = []
+
+    def read():
+        try:
+            for _ in range(50):
+                for idx in range(4):
+                    assert store.image(f"upload:{idx}").getpixel((0, 0)) == idx
+        except Exception as e:  # reported below
+            errors.append(e)
+
+    def rewrite():
+        for _ in range(20):
+            for idx in range(4):
+                store.put(f"upload:{idx}", page(idx), "s1")
+
+    threads = [threading.Thread(target=read) for _ in range(3)] + [threading.Thread(target=rewrite)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,52 @@
+from query_results import ResultCache, inject_row_limit, normalize_sql, referenced_tables
+
+
+def test_limit_is_added_to_plain_select():
+    assert inject_row_limit("SELECT * FROM InvoiceItems", 501) == "SELECT TOP (501) * FROM InvoiceItems"
+    assert inject_row_limit("select distinct customer from InvoiceMaster", 10) == \
+        "select distinct TOP (10) customer from InvoiceMaster"
+
+
+def test_limit_keeps_comments_and_literals_intact():
+    sql = "SELECT *  -- every column\nFROM InvoiceMaster\nWHERE customer = 'A  B'"
+    assert inject_row_limit(sql, 5) == "SELECT TOP (5) *  -- every column\nFROM InvoiceMaster\nWHERE customer = 'A  B'"
+
+
+def test_statements_that_cannot_take_a_limit_are_unchanged():
+    for sql in ("SELECT TOP 5 * FROM InvoiceMaster",
+                "SELECT customer FROM InvoiceMaster UNION SELECT customer FROM CustomerSales",
+                "WITH t AS (SELECT 1 AS n) SELECT n FROM t",
+                "SELECT * FROM InvoiceMaster ORDER BY id OFFSET 10 ROWS"):
+        assert inject_row_limit(sql, 5) == sql
+
+
+def test_cache_key_ignores_layout_but_not_literals_or_comments():
+    assert normalize_sql("SELECT *\n  FROM  InvoiceMaster;") == "SELECT * FROM InvoiceMaster"
+    assert normalize_sql("SELECT * FROM t WHERE c = 'A  B'") != normalize_sql("SELECT * FROM t WHERE c = 'A B'")
+    assert normalize_sql("SELECT a -- note\nFROM t") != normalize_sql("SELECT a -- note FROM t")
+
+
+def test_referenced_tables():
+    sql = "SELECT * FROM dbo.[InvoiceMaster] im JOIN InvoiceItems it ON it.invoice_id = im.invoice_id"
+    assert referenced_tables(sql) == {"invoicemaster", "invoiceitems"}
+
+
+def test_writes_invalidate_only_results_that_read_the_table():
+    cache = ResultCache(ttl=60, max_entries=4)
+    master = ResultCache.make_key("SELECT * FROM InvoiceMaster")
+    users = ResultCache.make_key("SELECT * FROM Users")
+    cache.put(master, {"invoicemaster"}, "master rows")
+    cache.put(users, {"users"}, "user rows")
+    assert cache.invalidate_tables(["InvoiceMaster"]) == 1
+    assert cache.get(master) is None
+    assert cache.get(users) == "user rows"
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResultCache(ttl=60, max_entries=2)
+    for name in ("a", "b"):
+        cache.put(name, {name}, name)
+    cache.get("a")
+    cache.put("c", {"c"}, "c")
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
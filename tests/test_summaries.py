@@ -0,0 +1,70 @@
+import pytest
+
+import summaries
+from benchmarks.sqlite_schema import SQLITE_SCHEMA, connect
+
+
+@pytest.fixture
+def cursor():
+    conn = connect()
+    conn.executescript(SQLITE_SCHEMA)
+    yield conn.cursor()
+    conn.close()
+
+
+def invoice(customer, invoice_date, total, *quantities):
+    return {'customer': customer, 'invoice_date': invoice_date, 'total': total,
+            'items': [{'quantity': quantity} for quantity in quantities]}
+
+
+def rows(cursor, table):
+    cursor.execute(f"SELECT * FROM {table} ORDER BY 1")
+    return [tuple(round(value, 2) if isinstance(value, float) else value for value in row)
+            for row in cursor.fetchall()]
+
+
+def test_apply_inserts_then_updates(cursor):
+    summaries.apply(cursor, summaries.invoice_totals([
+        invoice("Acme", "2024-03-01", 10.0, 1, 2),
+        invoice("Bolt", "2024-03-01", 5.5),
+    ]))
+    summaries.apply(cursor, summaries.invoice_totals([invoice("Acme", "2024-03-02", 4.5, 3)]))
+    assert rows(cursor, "CustomerSales") == [("Acme", 2, 14.5, 3, 6), ("Bolt", 1, 5.5, 0, 0)]
+    assert rows(cursor, "DailySales") == [("2024-03-01", 2, 15.5, 2, 3), ("2024-03-02", 1, 4.5, 1, 3)]
+
+
+def test_apply_folds_customer_case_and_trailing_spaces(cursor):
+    # One batch, like SQL Server's case-insensitive key comparison
+    summaries.apply(cursor, summaries.invoice_totals([invoice("Acme", None, 1.0),
+                                                      invoice("ACME  ", None, 2.0)]))
+    assert rows(cursor, "CustomerSales") == [("Acme", 2, 3.0, 0, 0)]
+    assert rows(cursor, "DailySales") == []
+
+
+def test_missing_customer_counts_under_empty_name(cursor):
+    summaries.apply(cursor, summaries.invoice_totals([invoice(None, "2024-01-05", 7.0, 1)]))
+    assert rows(cursor, "CustomerSales") == [("", 1, 7.0, 1, 1)]
+
+
+def test_replacing_last_invoice_removes_its_rows(cursor):
+    old = summaries.invoice_totals([invoice("Acme", "2024-03-01", 10.0, 1)])
+    summaries.apply(cursor, old)
+    summaries.apply(cursor, summaries.invoice_totals([invoice("Bolt", "2024-03-04", 8.0, 2)]), old)
+    assert rows(cursor, "CustomerSales") == [("Bolt", 1, 8.0, 1, 2)]
+    assert rows(cursor, "DailySales") == [("2024-03-04", 1, 8.0, 1, 2)]
+
+
+def test_incremental_totals_match_rebuild(cursor):
+    invoices = [invoice(f"Customer {n % 3}", f"2024-02-0{n % 4 + 1}", n * 1.25, *range(n % 3))
+                for n in range(12)]
+    for n, data in enumerate(invoices):
+        data['invoice_id'] = f"INV-{n}"
+        cursor.execute("INSERT INTO InvoiceMaster (invoice_id, customer, invoice_date, total) "
+                       "VALUES (?, ?, ?, ?)", (data['invoice_id'], data['customer'],
+                                               data['invoice_date'], data['total']))
+        cursor.executemany("INSERT INTO InvoiceItems (invoice_id, quantity) VALUES (?, ?)",
+                           [(data['invoice_id'], item['quantity']) for item in data['items']])
+    summaries.apply(cursor, summaries.invoice_totals(invoices))
+    incremental = rows(cursor, "CustomerSales"), rows(cursor, "DailySales")
+    summaries.rebuild(cursor)
+    assert (rows(cursor, "CustomerSales"), rows(cursor, "DailySales")) == incremental
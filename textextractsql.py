@@ -1,42 +1,74 @@
 from dotenv import load_dotenv
 import streamlit as st
 import os
-import google.generativeai as genai
 from PIL import Image
 from datetime import datetime
-import json
-import pyodbc
-import re
 import base64
-import hashlib
-import time
-import fitz  # PyMuPDF for PDF processing
 import io
-from typing import List
-import pandas as pd
+import tempfile
+import threading
+import time
+import uuid
+from typing import Iterator, List
+from database import get_connection, get_pool, insert_invoice, existing_invoice_ids, upsert_invoices
+from extraction_cache import get_extraction_cache
+from upload_cache import get_upload_cache, upload_digest
+from page_store import PageList, get_page_store
+from thumbnails import make_thumbnails
+from fingerprints import get_fingerprint_index, page_hash
+from invoice_details import get_detail_cache
+import extraction
+from model_client import get_model_client
+from jobs import get_job_queue
+import invoice_json
+from invoice_json import InvoiceValidationError
+import nl2sql
+import summaries
+import query_results
+from audit import get_audit_writer
+import audit_search
+from auth import get_user_directory
+import migrations
+import startup
 
 # App UI Configuration
 st.set_page_config(page_title="🧾 Multi-Page Invoice Extractor", layout='wide')
 
+# Static assets are read (and encoded) once per process, not on every rerun
+@st.cache_resource
+def read_asset(file_name, binary=False):
+    with open(file_name, "rb" if binary else "r") as f:
+        return f.read()
+
+@st.cache_resource
+def encode_asset_base64(file_name):
+    return base64.b64encode(read_asset(file_name, binary=True)).decode()
+
 # Inject CSS from external file
 def local_css(file_name):
     try:
-        with open(file_name) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_asset(file_name)}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         st.warning("CSS file not found. Using default styling.")
 
 local_css("style.css")
 
-# Function to convert local image to base64
+# Set the app background; files under ./static are served by Streamlit by URL
 def set_background_image(image_file_path):
     try:
-        with open(image_file_path, "rb") as img_file:
-            encoded = base64.b64encode(img_file.read()).decode()
+        static_dir = os.path.abspath("static")
+        if os.path.abspath(image_file_path).startswith(static_dir + os.sep):
+            if not os.path.exists(image_file_path):
+                raise FileNotFoundError(image_file_path)
+            relative_path = os.path.relpath(image_file_path, static_dir).replace(os.sep, "/")
+            image_url = f"app/static/{relative_path}"
+        else:
+            # Outside ./static the image has to be inlined as a data URI
+            image_url = f"data:image/png;base64,{encode_asset_base64(image_file_path)}"
         css = f"""
         <style>
         .stApp {{
-            background-image: url("data:image/png;base64,{encoded}");
+            background-image: url("{image_url}");
             background-size: cover;
             background-position: center;
             background-repeat: no-repeat;
@@ -48,15 +80,17 @@ def set_background_image(image_file_path):
     except FileNotFoundError:
         st.warning("Background image not found.")
 
-# Call this with your image file path
+# Call this with your image file path; under ./static it is served by URL instead of inlined
 set_background_image("assets/bg1.webp")
 
 # Load environment variables
 load_dotenv()
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
 
-# Initialize Gemini model
-model = genai.GenerativeModel("gemini-2.5-flash")
+# Thumbnails shown per page of the upload preview grid
+PREVIEW_PAGE_SIZE = 12
+# How often the background job list refreshes itself
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '3'))
+JOB_STATUS_ICONS = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}
 
 # Initialize session state
 if 'authenticated' not in st.session_state:
@@ -68,333 +102,295 @@ if 'raw_json' not in st.session_state:
 if 'current_images' not in st.session_state:
     st.session_state.current_images = []
 
-# Hash password function
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# Connect to SQL Server
-def get_sql_server_connection():
-    conn = pyodbc.connect(
-        "Driver={ODBC Driver 17 for SQL Server};"
-        "Server=DESKTOP-LM2ET8D\SQLEXPRESS;"   # Change to your SQL Server name
-        "Database=DEMODB1;"             # Change to your database
-        "Trusted_Connection=yes;"         # Or use UID and PWD
-    )
-    return conn
+def page_session_id():
+    """Identifies this browser session to the page store"""
+    if 'page_session_id' not in st.session_state:
+        st.session_state.page_session_id = uuid.uuid4().hex
+    return st.session_state.page_session_id
+
+def release_session_pages():
+    get_page_store().release(page_session_id())
+    st.session_state.current_images = []
+    st.session_state.current_upload_keys = []
+    st.session_state.current_documents = []
 
 # PDF to images conversion
-def pdf_to_images(pdf_file) -> List[Image.Image]:
-    """Convert PDF pages to PIL Images"""
+def pdf_to_images(pdf_file) -> Iterator[Image.Image]:
+    """Lazily convert PDF pages to PIL Images (rendered in parallel for long PDFs)"""
     try:
-        # Read PDF file
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        images = []
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            # Convert page to image (300 DPI for good quality)
-            pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            images.append(img)
-        
-        pdf_document.close()
-        return images
+        # Pages are rendered at PDF_RENDER_DPI (300 by default), capped for oversized pages
+        # pdf_render pulls in PyMuPDF, so it is only imported once a PDF is uploaded
+        pdf_render = startup.lazy_import("pdf_render")
+        pdf_file.seek(0)
+        yield from pdf_render.iter_pdf_pages(pdf_file.read())
     except Exception as e:
         st.error(f"Error processing PDF: {e}")
-        return []
 
 # Process multiple images function
-def process_multiple_images(uploaded_files) -> List[Image.Image]:
-    """Process multiple uploaded files (images or PDFs)"""
-    all_images = []
+def process_multiple_images(uploaded_files) -> PageList:
+    """Process multiple uploaded files (images or PDFs), reusing pages rendered on earlier reruns.
+
+    Pages are kept compressed in the page store and decoded when indexed.
+    Files already inserted as an invoice are skipped before rendering (unless
+    the user chose to process them anyway) and listed in ``duplicate_documents``.
+    """
+    page_store = get_page_store()
+    session_id = page_session_id()
+    page_keys_all = []
+    upload_keys = []
+    documents = []
+    duplicates = []
+    upload_cache = get_upload_cache()
+    # file_id -> content digest, so unchanged uploads are not even re-hashed on rerun
+    upload_digests = st.session_state.setdefault('upload_digests', {})
+    # content digest -> fingerprint of the invoice it was inserted as (None if new)
+    known_documents = st.session_state.setdefault('known_documents', {})
+    duplicate_overrides = st.session_state.setdefault('duplicate_overrides', set())
     
+    keyed_files = []
     for uploaded_file in uploaded_files:
+        file_id = getattr(uploaded_file, 'file_id', None)
+        upload_key = upload_digests.get(file_id) if file_id else None
+        if upload_key is None:
+            upload_key = upload_digest(uploaded_file.getvalue())
+            if file_id:
+                upload_digests[file_id] = upload_key
+        keyed_files.append((uploaded_file, upload_key))
+    
+    unchecked = [key for _, key in keyed_files if key not in known_documents]
+    if unchecked:
+        try:
+            matches = get_fingerprint_index().find_exact(unchecked)
+        except Exception:
+            matches = {}  # duplicate detection is advisory; never block an upload on it
+        for key in unchecked:
+            known_documents[key] = matches.get(key)
+    
+    for uploaded_file, upload_key in keyed_files:
         file_type = uploaded_file.type
+        match = known_documents.get(upload_key)
+        if match and upload_key not in duplicate_overrides:
+            duplicates.append(dict(match, upload_name=uploaded_file.name))
+            continue
         
-        if file_type == "application/pdf":
-            # Process PDF
-            pdf_images = pdf_to_images(uploaded_file)
-            all_images.extend(pdf_images)
-        elif file_type in ["image/jpeg", "image/jpg", "image/png"]:
-            # Process image
-            image = Image.open(uploaded_file)
-            all_images.append(image)
-        else:
-            st.warning(f"Unsupported file type: {file_type}")
+        entry = upload_cache.get(upload_key)
+        # Pages may have been reclaimed from the store while the upload stayed cached
+        if entry is None or not page_store.retain(session_id, entry.pages.keys):
+            if file_type == "application/pdf":
+                # Process PDF
+                rendered = pdf_to_images(uploaded_file)
+            elif file_type in ["image/jpeg", "image/jpg", "image/png"]:
+                image = Image.open(io.BytesIO(uploaded_file.getvalue()))
+                image.load()
+                rendered = [image]
+            else:
+                st.warning(f"Unsupported file type: {file_type}")
+                continue
+            # Each page is hashed and compressed into the page store as it is rendered,
+            # so at most one decoded page per file is held at a time
+            page_keys, page_hashes = [], []
+            for idx, page in enumerate(rendered):
+                page_keys.append(page_store.put(f"{upload_key}:{idx}", page, session_id))
+                page_hashes.append(page_hash(page))
+            if not page_keys:
+                continue
+            if entry is None:
+                entry = upload_cache.put(upload_key, PageList(page_store, page_keys))
+            else:
+                entry.pages = PageList(page_store, page_keys)
+            entry.page_hashes = page_hashes
+        
+        page_keys_all.extend(entry.pages.keys)
+        upload_keys.append(upload_key)
+        documents.append((uploaded_file.name, upload_key, entry.page_hashes))
     
-    return all_images
+    # The session now references exactly these pages; others it held are released
+    page_store.attach(session_id, page_keys_all)
+    st.session_state.current_upload_keys = upload_keys
+    st.session_state.current_documents = documents
+    st.session_state.duplicate_documents = duplicates
+    return PageList(page_store, page_keys_all)
 
 # Database setup functions
 def setup_database():
-    """Create necessary tables if they don't exist"""
+    """Apply pending schema migrations (once per process, not on every rerun)"""
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        
-        # Create Users table
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='Users' AND xtype='U')
-            CREATE TABLE Users (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                username NVARCHAR(50) UNIQUE NOT NULL,
-                password_hash NVARCHAR(64) NOT NULL,
-                created_date DATETIME DEFAULT GETDATE(),
-                is_admin BIT DEFAULT 0
-            )
-        """)
-        
-        # Create AuditLog table
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AuditLog' AND xtype='U')
-            CREATE TABLE AuditLog (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                username NVARCHAR(50) NOT NULL,
-                action NVARCHAR(100) NOT NULL,
-                details NVARCHAR(MAX),
-                timestamp DATETIME DEFAULT GETDATE()
-            )
-        """)
-        
-        # Create InvoiceMaster table if it doesn't exist
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='InvoiceMaster' AND xtype='U')
-            CREATE TABLE InvoiceMaster (
-                id INT IDENTITY(1,1) NOT NULL,
-                invoice_id NVARCHAR(50) PRIMARY KEY,
-                customer NVARCHAR(100),
-                invoice_date DATE,
-                total DECIMAL(10,2),
-                created_by NVARCHAR(50),
-                created_date DATETIME DEFAULT GETDATE()
-            )
-        """)
-        
-        # Create InvoiceItems table if it doesn't exist
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='InvoiceItems' AND xtype='U')
-            CREATE TABLE InvoiceItems (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                invoice_id NVARCHAR(50) NOT NULL,
-                description NVARCHAR(200),
-                quantity INT,
-                price DECIMAL(10,2)
-            )
-        """)
-        
-        # Create default admin user if no users exist
-        cursor.execute("SELECT COUNT(*) FROM Users")
-        user_count = cursor.fetchone()[0]
-        if user_count == 0:
-            admin_password_hash = hash_password("admin123")
-            cursor.execute("""
-                INSERT INTO Users (username, password_hash, is_admin)
-                VALUES (?, ?, 1)
-            """, "admin", admin_password_hash)
-        
-        conn.commit()
-        conn.close()
+        with startup.timed("Schema migrations"):
+            migrations.migrate_once()
     except Exception as e:
         st.error(f"Database setup error: {e}")
 
 # Authentication functions
 def verify_user(username, password):
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        password_hash = hash_password(password)
-        
-        cursor.execute("""
-            SELECT username, is_admin FROM Users 
-            WHERE username = ? AND password_hash = ?
-        """, username, password_hash)
-        
-        result = cursor.fetchone()
-        conn.close()
-        return result
+        return get_user_directory().verify(username, password)
     except Exception as e:
         st.error(f"Authentication error: {e}")
         return None
 
 def add_user(username, password, is_admin=False):
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        password_hash = hash_password(password)
-        
-        cursor.execute("""
-            INSERT INTO Users (username, password_hash, is_admin)
-            VALUES (?, ?, ?)
-        """, username, password_hash, is_admin)
-        
-        conn.commit()
-        conn.close()
+        get_user_directory().add_user(username, password, is_admin)
         return True
     except Exception as e:
         st.error(f"Error adding user: {e}")
         return False
 
 def log_audit(username, action, details=""):
+    # Queued for the background audit writer; the insert happens off the request path
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO AuditLog (username, action, details)
-            VALUES (?, ?, ?)
-        """, username, action, details)
-        
-        conn.commit()
-        conn.close()
+        get_audit_writer().log(username, action, details)
     except Exception as e:
         st.error(f"Audit logging error: {e}")
 
-def get_audit_logs(limit=50):
+def get_audit_logs(filters, after=None):
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT TOP (?) username, action, details, timestamp 
-            FROM AuditLog 
-            ORDER BY timestamp DESC
-        """, limit)
-        
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with get_connection() as conn:
+            return audit_search.fetch_page(conn.cursor(), filters, after)
     except Exception as e:
         st.error(f"Error fetching audit logs: {e}")
         return []
 
 # Invoice history functions
-def search_invoices(search_term="", search_type="all"):
-    try:
-        conn = get_sql_server_connection()
+HISTORY_PAGE_SIZE = 25
+HISTORY_CACHE_TTL = 30  # seconds a fetched history page is reused within a session
+SEARCH_MODES = {"prefix": "Starts with", "contains": "Contains", "fulltext": "Full-text (customer)"}
+FULLTEXT_CHECK_TTL = 600  # seconds before the full-text index is looked for again
+
+# Migration 3 only builds the customer full-text index where full-text search is installed
+@st.cache_resource(ttl=FULLTEXT_CHECK_TTL)
+def _customer_fulltext_index():
+    with get_connection() as conn:
         cursor = conn.cursor()
-        
-        if search_type == "invoice_id":
-            query = """
-                SELECT im.invoice_id, im.customer, im.invoice_date, im.total, im.created_by, im.created_date
-                FROM InvoiceMaster im
-                WHERE im.invoice_id LIKE ?
-                ORDER BY im.created_date DESC
-            """
-            cursor.execute(query, f"%{search_term}%")
-        elif search_type == "customer":
-            query = """
-                SELECT im.invoice_id, im.customer, im.invoice_date, im.total, im.created_by, im.created_date
-                FROM InvoiceMaster im
-                WHERE im.customer LIKE ?
-                ORDER BY im.created_date DESC
-            """
-            cursor.execute(query, f"%{search_term}%")
-        else:  # all
-            query = """
-                SELECT im.invoice_id, im.customer, im.invoice_date, im.total, im.created_by, im.created_date
+        cursor.execute("""
+            SELECT CASE WHEN FULLTEXTSERVICEPROPERTY('IsFullTextInstalled') = 1
+                         AND EXISTS (SELECT * FROM sys.fulltext_indexes
+                                     WHERE object_id = OBJECT_ID('InvoiceMaster'))
+                        THEN 1 ELSE 0 END
+        """)
+        return bool(cursor.fetchone()[0])
+
+def customer_fulltext_available():
+    """True when CONTAINS can run against InvoiceMaster.customer"""
+    try:
+        return _customer_fulltext_index()
+    except Exception:
+        return False  # not cached, so the check is retried on the next search
+
+def _invoice_search_filter(search_term, search_type, search_mode):
+    """Return the WHERE clause fragment and parameters for an invoice search"""
+    if not search_term or search_type == "all":
+        return "", []
+    column = "im.invoice_id" if search_type == "invoice_id" else "im.customer"
+    if search_mode == "fulltext" and search_type == "customer":
+        if customer_fulltext_available():
+            # Prefix term on the full-text index, e.g. "acme*"
+            escaped = search_term.replace('"', '""')
+            return "CONTAINS(im.customer, ?)", [f'"{escaped}*"']
+        # Without the full-text index, fall back to a substring match
+        search_mode = "contains"
+    if search_mode == "contains":
+        return f"{column} LIKE ?", [f"%{search_term}%"]
+    # Prefix search can seek on the PK / customer index
+    return f"{column} LIKE ?", [f"{search_term}%"]
+
+def search_invoices(search_term="", search_type="all", search_mode="prefix", after=None, page_size=HISTORY_PAGE_SIZE):
+    """Return one page of invoices, newest first.
+
+    ``after`` is the ``(created_date, invoice_id)`` of the last row of the
+    previous page (keyset pagination), so every page is an index seek.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            conditions, params = [], []
+            search_filter, search_params = _invoice_search_filter(search_term, search_type, search_mode)
+            if search_filter:
+                conditions.append(search_filter)
+                params.extend(search_params)
+            if after:
+                # pyodbc binds datetimes as DATETIME2; cast back so the last row compares equal
+                conditions.append("(im.created_date < CAST(? AS DATETIME) OR "
+                                  "(im.created_date = CAST(? AS DATETIME) AND im.invoice_id < ?))")
+                params.extend([after[0], after[0], after[1]])
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            
+            query = f"""
+                SELECT TOP (?) im.invoice_id, im.customer, im.invoice_date, im.total, im.created_by, im.created_date
                 FROM InvoiceMaster im
-                ORDER BY im.created_date DESC
+                {where}
+                ORDER BY im.created_date DESC, im.invoice_id DESC
             """
-            cursor.execute(query)
-        
-        results = cursor.fetchall()
-        conn.close()
+            cursor.execute(query, [page_size] + params)
+            
+            results = cursor.fetchall()
         return results
     except Exception as e:
         st.error(f"Error searching invoices: {e}")
         return []
 
-def get_invoice_details(invoice_id):
+def count_invoices(search_term="", search_type="all", search_mode="prefix"):
+    """Total number of invoices matching a search (run once per search, not per page)"""
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        
-        # Get master data
-        cursor.execute("""
-            SELECT invoice_id, customer, invoice_date, total, created_by, created_date
-            FROM InvoiceMaster
-            WHERE invoice_id = ?
-        """, invoice_id)
-        master_data = cursor.fetchone()
-        
-        # Get items data
-        cursor.execute("""
-            SELECT description, quantity, price
-            FROM InvoiceItems
-            WHERE invoice_id = ?
-        """, invoice_id)
-        items_data = cursor.fetchall()
-        
-        conn.close()
-        return master_data, items_data
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            search_filter, params = _invoice_search_filter(search_term, search_type, search_mode)
+            where = f"WHERE {search_filter}" if search_filter else ""
+            cursor.execute(f"SELECT COUNT(*) FROM InvoiceMaster im {where}", params)
+            return cursor.fetchone()[0]
+    except Exception as e:
+        st.error(f"Error counting invoices: {e}")
+        return None
+
+def get_invoice_items(invoice_ids):
+    """Line items of every invoice on a history page, in one query for whatever is not cached"""
+    try:
+        return get_detail_cache().get_items(invoice_ids)
     except Exception as e:
         st.error(f"Error fetching invoice details: {e}")
-        return None, None
+        return {}
 
 # Natural Language Query Functions
 def convert_query_to_sql(user_query):
-    """Convert natural language query to SQL using Gemini"""
-    prompt = f'''
-    You are an expert in converting English queries to SQL! 
-    The database has the table InvoiceMaster with columns like customer, invoice_id, invoice_date, total, created_by, created_date.
-    The database has the table InvoiceItems with columns like id, invoice_id, description, quantity, price.
-    
-    Example 1: How many records are there in the table?
-    SQL: SELECT COUNT(*) FROM InvoiceMaster;
-    
-    Example 2: List all customers.
-    SQL: SELECT customer FROM InvoiceMaster;
-    
-    Example 3: Show me all invoices for customer John
-    SQL: SELECT * FROM InvoiceMaster WHERE customer LIKE '%John%';
-    
-    Example 4: What items are in invoice INV-001?
-    SQL: SELECT * FROM InvoiceItems WHERE invoice_id = 'INV-001';
-    
-    Example 5: Show total sales by customer
-    SQL: SELECT customer, SUM(total) as total_sales FROM InvoiceMaster GROUP BY customer;
-    
-    Only return the SQL query. Do not include markdown or explanations.
+    """Convert natural language query to SQL: intent template, then cache, then Gemini.
+
+    Returns ``(sql_query, params, source)`` where source is "template", "cache" or "model".
+    """
+    # Common intents are filled into parameterized SQL without calling the model
+    template = nl2sql.match_template(user_query)
+    if template:
+        sql_query, params = template
+        return sql_query, params, "template"
     
-    User Query: {user_query}
-    '''
+    question_cache = nl2sql.get_question_cache()
+    cached_sql = question_cache.get(user_query)
+    if cached_sql:
+        return cached_sql, (), "cache"
     
     try:
-        response = model.generate_content(prompt)
-        sql_query = response.text.strip()
+        response = get_model_client().generate_content(nl2sql.build_sql_prompt(user_query))
         # Clean up the response - remove any markdown formatting
-        sql_query = re.sub(r'```sql\n?', '', sql_query)
-        sql_query = re.sub(r'```\n?', '', sql_query)
-        return sql_query
+        sql_query = nl2sql.clean_sql_response(response.text)
+        question_cache.put(user_query, sql_query)
+        return sql_query, (), "model"
     except Exception as e:
         st.error(f"Error converting query to SQL: {e}")
-        return None
+        return None, (), None
 
-def execute_sql_query(sql_query):
-    """Execute SQL query and return results"""
+def execute_sql_query(sql_query, params=(), max_rows=query_results.PAGE_SIZE):
+    """Execute SQL query and return ``(df, error, has_more)``, reading at most ``max_rows`` rows"""
     try:
-        conn = get_sql_server_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(sql_query)
+        with get_connection() as conn:
+            results_df, has_more, _ = query_results.run_query(conn, sql_query, params, max_rows)
         
-        # Get column names
-        columns = [desc[0] for desc in cursor.description]
-        
-        # Get results
-        results = cursor.fetchall()
-        
-        conn.close()
-        
-        # Convert to DataFrame for better display
-        if results:
-            df = pd.DataFrame.from_records(results, columns=columns)
-            return df, None
+        if results_df is not None and not results_df.empty:
+            return results_df, None, has_more
         else:
-            return None, "No results found."
+            return None, "No results found.", False
             
     except Exception as e:
-        return None, f"Error executing query: {e}"
+        return None, f"Error executing query: {e}", False
 
 # Natural Language Query Interface
 def show_query_interface():
@@ -424,26 +420,58 @@ def show_query_interface():
     
     if query_button and user_query:
         with st.spinner("Converting your query to SQL..."):
-            sql_query = convert_query_to_sql(user_query)
-            
+            sql_query, params, source = convert_query_to_sql(user_query)
+        
         if sql_query:
-            st.subheader("Generated SQL Query:")
-            st.code(sql_query, language="sql")
+            # Keep the query across reruns so "Load more" can page through it
+            st.session_state.nl_query = {
+                'question': user_query, 'sql': sql_query, 'params': params,
+                'source': source, 'logged': False,
+            }
+            st.session_state.nl_row_limit = query_results.PAGE_SIZE
+    
+    current_query = st.session_state.get('nl_query')
+    if current_query:
+        sql_query, params, source = current_query['sql'], current_query['params'], current_query['source']
+        st.subheader("Generated SQL Query:")
+        st.code(sql_query, language="sql")
+        if params:
+            st.caption(f"Parameters: {list(params)}")
+        if source == "template":
+            st.caption("⚡ Matched a built-in query template (no API call)")
+        elif source == "cache":
+            st.caption("⚡ Served from the query cache (no API call)")
+        
+        # Execute the query
+        with st.spinner("Executing query..."):
+            results_df, error, has_more = execute_sql_query(sql_query, params, st.session_state.nl_row_limit)
+        
+        if error:
+            # Don't keep serving SQL that does not run
+            if source in ("cache", "model") and error != "No results found.":
+                nl2sql.get_question_cache().invalidate(current_query['question'])
+            st.error(f"❌ {error}")
+        elif results_df is not None:
+            st.subheader("Query Results:")
+            st.dataframe(results_df, use_container_width=True)
             
-            # Execute the query
-            with st.spinner("Executing query..."):
-                results_df, error = execute_sql_query(sql_query)
+            if has_more:
+                st.caption(f"Showing the first {len(results_df)} rows.")
+                if st.button("⬇️ Load more"):
+                    st.session_state.nl_row_limit += query_results.PAGE_SIZE
+                    st.rerun()
             
-            if error:
-                st.error(f"❌ {error}")
-            elif results_df is not None:
-                st.subheader("Query Results:")
-                st.dataframe(results_df, use_container_width=True)
-                
-                # Log the query
-                log_audit(st.session_state.username, "Natural language query executed", f"Query: {user_query}")
-            else:
-                st.info("No results found for your query.")
+            # Log the query
+            if not current_query['logged']:
+                log_audit(st.session_state.username, "Natural language query executed", f"Query: {current_query['question']}")
+                current_query['logged'] = True
+        else:
+            st.info("No results found for your query.")
+    
+    query_stats = nl2sql.stats()
+    st.caption(f"Answered without an API call: {query_stats['hit_rate']:.0%} "
+               f"({query_stats['template_hits']} template, {query_stats['cache_hits']} cache, "
+               f"{query_stats['model_calls']} model)")
 
 # Setup database on app start
 setup_database()
@@ -468,7 +496,7 @@ def show_login_page():
                         st.session_state.authenticated = True
                         st.session_state.username = user_result[0]
                         st.session_state.is_admin = user_result[1]
-                        log_audit(username, "User logged in")
+                        log_audit(user_result[0], "User logged in")
                         st.success("Login successful!")
                         st.rerun()
                     else:
@@ -477,6 +505,102 @@ def show_login_page():
                 else:
                     st.warning("Please enter both username and password!")
 
+# Audit log viewer
+AUDIT_CACHE_TTL = 30  # seconds the newest audit page is reused within a session
+
+def prepare_audit_export(filters, file_format):
+    """Stream the filtered audit log into a temporary file offered for download"""
+    previous = st.session_state.pop('audit_export', None)
+    if previous and os.path.exists(previous['path']):
+        os.remove(previous['path'])
+    fd, path = tempfile.mkstemp(suffix=f".{file_format}")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            rows = audit_search.export(filters, file_format, f)
+    except Exception as e:
+        os.remove(path)
+        st.error(f"Export failed: {e}")
+        return
+    st.session_state.audit_export = {'filters': filters, 'format': file_format, 'path': path, 'rows': rows}
+    log_audit(st.session_state.username, "Exported audit log", f"{rows} rows as {file_format}")
+
+def show_audit_logs():
+    # Filters are a form, so nothing is queried until they are applied
+    with st.form("audit_filters"):
+        col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
+        with col1:
+            try:
+                usernames = [user[0] for user in get_user_directory().users()]
+            except Exception:
+                usernames = []
+            username = st.selectbox("User", ["All users"] + usernames)
+        with col2:
+            action = st.text_input("Action starts with")
+        with col3:
+            date_range = st.date_input("Date range", value=())
+        with col4:
+            apply_filters = st.form_submit_button("Apply", use_container_width=True)
+    
+    since = date_range[0] if len(date_range) > 0 else None
+    until = date_range[1] if len(date_range) > 1 else None
+    filters = audit_search.make_filters(None if username == "All users" else username, action, since, until)
+    if apply_filters or 'audit_filters' not in st.session_state:
+        st.session_state.audit_filters = filters
+        st.session_state.audit_cursors = [None]
+        st.session_state.audit_pages = {}
+    filters = st.session_state.audit_filters
+    cursors = st.session_state.audit_cursors
+    pages = st.session_state.audit_pages
+    
+    # Pages already visited are kept; only the newest page can gain rows, so only it expires
+    cached_page = pages.get(cursors[-1])
+    if cached_page and (cursors[-1] is not None or time.time() - cached_page[0] < AUDIT_CACHE_TTL):
+        logs = cached_page[1]
+    else:
+        logs = get_audit_logs(filters, after=cursors[-1])
+        pages[cursors[-1]] = (time.time(), logs)
+    
+    if logs:
+        first = (len(cursors) - 1) * audit_search.AUDIT_PAGE_SIZE + 1
+        st.caption(f"Showing entries {first}-{first + len(logs) - 1}, newest first")
+        prev_col, next_col, refresh_col, _ = st.columns([1, 1, 1, 3])
+        with prev_col:
+            if st.button("◀ Newer", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with next_col:
+            if st.button("Older ▶", disabled=len(logs) < audit_search.AUDIT_PAGE_SIZE):
+                last = logs[-1]
+                cursors.append((last[1], last[0]))
+                st.rerun()
+        with refresh_col:
+            if st.button("🔄 Refresh"):
+                pages.clear()
+                st.rerun()
+        pd = startup.lazy_import("pandas")
+        st.dataframe(pd.DataFrame([tuple(log) for log in logs],
+                                  columns=["ID", "Timestamp", "User", "Action", "Details"]),
+                     use_container_width=True, hide_index=True)
+    else:
+        st.info("No audit logs found.")
+    
+    col1, col2, _ = st.columns([1, 1, 2])
+    with col1:
+        export_label = st.selectbox("Export format", list(audit_search.EXPORT_FORMATS))
+    with col2:
+        st.write("")
+        if st.button("Prepare export", use_container_width=True):
+            with st.spinner("Exporting audit log..."):
+                prepare_audit_export(filters, audit_search.EXPORT_FORMATS[export_label])
+    export = st.session_state.get('audit_export')
+    if export and export['filters'] == filters and os.path.exists(export['path']):
+        with open(export['path'], 'rb') as f:
+            st.download_button(
+                f"⬇️ Download {export['rows']} rows ({export['format'].upper()})", f,
+                file_name=f"audit_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export['format']}",
+                mime="text/csv" if export['format'] == "csv" else "application/octet-stream",
+            )
+
 # User management page
 def show_user_management():
     st.title("👥 User Management")
@@ -486,7 +610,7 @@ def show_user_management():
         return
     
     st.markdown('<div class="custom-tab-container">', unsafe_allow_html=True)
-    tab1, tab2, tab3 = st.tabs(["Add User", "User List", "Audit Logs"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Add User", "User List", "Audit Logs", "System Stats"])
     st.markdown('</div>', unsafe_allow_html=True)
     
     with tab1:
@@ -508,11 +632,7 @@ def show_user_management():
     with tab2:
         st.subheader("Existing Users")
         try:
-            conn = get_sql_server_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT username, created_date, is_admin FROM Users ORDER BY created_date DESC")
-            users = cursor.fetchall()
-            conn.close()
+            users = get_user_directory().users()
             
             if users:
                 for user in users:
@@ -533,43 +653,211 @@ def show_user_management():
     
     with tab3:
         st.subheader("Audit Logs")
-        logs = get_audit_logs()
-        if logs:
-            for log in logs:
-                with st.expander(f"{log[1]} by {log[0]} - {log[3].strftime('%Y-%m-%d %H:%M:%S')}"):
-                    st.write(f"**Action:** {log[1]}")
-                    st.write(f"**User:** {log[0]}")
-                    st.write(f"**Details:** {log[2]}")
-                    st.write(f"**Timestamp:** {log[3]}")
+        show_audit_logs()
+    
+    with tab4:
+        st.subheader("Database Connection Pool")
+        pool_stats = get_pool().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Open / Size", f"{pool_stats['open']} / {pool_stats['size']}")
+        col2.metric("Checkouts", pool_stats['checkouts'])
+        col3.metric("Misses", pool_stats['misses'])
+        col4.metric("Avg Wait (ms)", f"{pool_stats['avg_wait_ms']:.1f}")
+        with st.expander("All pool metrics"):
+            st.json(pool_stats)
+        
+        st.subheader("Logins")
+        login_stats = get_user_directory().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Successful / Failed", f"{login_stats['logins']} / {login_stats['failed']}")
+        col2.metric("Directory Hits", login_stats['cache_hits'])
+        col3.metric("Avg Verify (ms)", f"{login_stats['avg_verify_ms']:.0f}")
+        col4.metric("Hashes Upgraded", login_stats['rehashed'])
+        
+        st.subheader("Extraction Cache")
+        cache_stats = get_extraction_cache().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Hits", cache_stats['hits'])
+        col2.metric("Misses", cache_stats['misses'])
+        col3.metric("Hit Ratio", f"{cache_stats['hit_ratio']:.0%}")
+        col4.metric("Evictions", cache_stats['evictions'])
+        
+        st.subheader("Gemini Client")
+        client_stats = get_model_client().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("API Calls", client_stats['api_calls'])
+        col2.metric("Avg Latency (ms)", f"{client_stats['avg_latency_ms']:.0f}")
+        col3.metric("Retries / Failures", f"{client_stats['retries']} / {client_stats['failures']}")
+        col4.metric("Circuit", client_stats['circuit'].replace('_', '-'))
+        with st.expander("All client metrics"):
+            st.json(client_stats)
+        
+        st.subheader("Response Parsing")
+        parse_stats = invoice_json.stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Parses", parse_stats['parses'])
+        col2.metric("Memo Hits", parse_stats['memo_hits'])
+        col3.metric("Repaired", parse_stats['repaired'])
+        col4.metric("Failures", parse_stats['failures'])
+        
+        st.subheader("Streaming Extraction")
+        stream_stats = extraction.streaming_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Completed", stream_stats['completed'])
+        col2.metric("Cancelled", stream_stats['cancelled'])
+        col3.metric("Avg First Item (ms)", "–" if stream_stats['avg_first_item_ms'] is None
+                    else f"{stream_stats['avg_first_item_ms']:.0f}")
+        col4.metric("Avg Latency (ms)", "–" if stream_stats['avg_latency_ms'] is None
+                    else f"{stream_stats['avg_latency_ms']:.0f}")
+        
+        st.subheader("Query Translation")
+        query_stats = nl2sql.stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Template Hits", query_stats['template_hits'])
+        col2.metric("Cache Hits", query_stats['cache_hits'])
+        col3.metric("Model Calls", query_stats['model_calls'])
+        col4.metric("Hit Rate", f"{query_stats['hit_rate']:.0%}")
+        
+        st.subheader("Invoice Detail Cache")
+        detail_stats = get_detail_cache().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Cached Invoices", detail_stats['entries'])
+        col2.metric("Hit Ratio", f"{detail_stats['hit_ratio']:.0%}")
+        col3.metric("Item Queries", detail_stats['queries'])
+        col4.metric("Invalidations", detail_stats['invalidations'])
+        
+        st.subheader("Query Result Cache")
+        result_stats = query_results.result_cache.stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Hits", result_stats['hits'])
+        col2.metric("Misses", result_stats['misses'])
+        col3.metric("Entries", result_stats['entries'])
+        col4.metric("Invalidations", result_stats['invalidations'])
+        
+        st.subheader("Audit Writer")
+        audit_stats = get_audit_writer().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Pending", audit_stats['pending'])
+        col2.metric("Written", audit_stats['written'])
+        col3.metric("Spilled to Disk", audit_stats['spilled'])
+        col4.metric("Replayed", audit_stats['replayed'])
+        if audit_stats['last_error']:
+            st.caption(f"Last audit write error: {audit_stats['last_error']}")
+        
+        st.subheader("Page Store")
+        page_stats = get_page_store().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Memory", f"{page_stats['memory_bytes'] / 1e6:.0f} / {page_stats['max_memory'] / 1e6:.0f} MB")
+        col2.metric("Spilled to Disk", f"{page_stats['disk_bytes'] / 1e6:.0f} MB")
+        col3.metric("Sessions / Pages", f"{page_stats['sessions']} / {page_stats['pages']}")
+        col4.metric("Idle Sessions Reclaimed", page_stats['reclaimed_sessions'])
+        session_usage = get_page_store().sessions()
+        if session_usage:
+            pd = startup.lazy_import("pandas")
+            with st.expander("Memory per session"):
+                st.dataframe(pd.DataFrame([
+                    {
+                        'Session': row['session'][:8],
+                        'Pages': row['pages'],
+                        'Memory (MB)': round(row['memory_bytes'] / 1e6, 1),
+                        'Disk (MB)': round(row['disk_bytes'] / 1e6, 1),
+                        'Decoded (MB)': round(row['decoded_bytes'] / 1e6, 1),
+                        'Idle (s)': int(row['idle_seconds']),
+                    }
+                    for row in session_usage
+                ]), use_container_width=True)
+        
+        st.subheader("Upload Cache")
+        upload_stats = get_upload_cache().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Cached Uploads", upload_stats['entries'])
+        col2.metric("Memory", f"{upload_stats['bytes'] / 1e6:.0f} / {upload_stats['max_bytes'] / 1e6:.0f} MB")
+        col3.metric("Hits", upload_stats['hits'])
+        col4.metric("Evictions", upload_stats['evictions'])
+        
+        st.subheader("Background Jobs")
+        job_stats = get_job_queue().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Queued", job_stats['queued'])
+        col2.metric("Running", f"{job_stats['active_workers']} / {job_stats['workers']}")
+        col3.metric("Done", job_stats['done'])
+        col4.metric("Failed", job_stats['failed'])
+        
+        st.subheader("Duplicate Detection")
+        fingerprint_stats = get_fingerprint_index().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Exact Lookups", fingerprint_stats['exact_lookups'])
+        col2.metric("Re-uploads Caught", fingerprint_stats['exact_hits'])
+        col3.metric("Rescans Flagged", fingerprint_stats['similar_hits'])
+        col4.metric("Indexed Pages", fingerprint_stats['indexed_pages'])
+        
+        st.subheader("Startup Profile")
+        startup_timings = startup.timings()
+        if startup_timings:
+            for step, elapsed_ms in startup_timings.items():
+                st.write(f"• {step}: {elapsed_ms:.0f} ms")
         else:
-            st.info("No audit logs found.")
+            st.info("No lazy imports or init steps recorded yet.")
 
 # Invoice history page
 def show_invoice_history():
     st.title("📊 Invoice History")
     
-    # Search section
-    col1, col2, col3 = st.columns([2, 1, 1])
-    
-    with col1:
-        search_term = st.text_input("🔍 Search invoices", placeholder="Enter invoice ID or customer name...")
-    
-    with col2:
-        search_type = st.selectbox("Search by", ["all", "invoice_id", "customer"])
+    # Search section - a form, so typing does not query the database until submitted
+    with st.form("invoice_search"):
+        col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+        
+        with col1:
+            search_term = st.text_input("🔍 Search invoices", placeholder="Enter invoice ID or customer name...")
+        
+        with col2:
+            search_type = st.selectbox("Search by", ["all", "invoice_id", "customer"])
+        
+        with col3:
+            search_modes = [mode for mode in SEARCH_MODES if mode != "fulltext" or customer_fulltext_available()]
+            search_mode = st.selectbox("Match", search_modes, format_func=SEARCH_MODES.get)
+        
+        with col4:
+            search_button = st.form_submit_button("Search", use_container_width=True)
     
-    with col3:
-        search_button = st.button("Search", use_container_width=True)
+    search = (search_term.strip(), search_type, search_mode)
+    if search_button or 'history_search' not in st.session_state:
+        # New search: restart paging and recount
+        st.session_state.history_search = search
+        st.session_state.history_cursors = [None]
+        st.session_state.history_count = count_invoices(*search)
+        st.session_state.history_pages = {}
+    search = st.session_state.history_search
+    cursors = st.session_state.history_cursors
     
-    # Get search results
-    if search_button or search_term:
-        invoices = search_invoices(search_term, search_type)
+    # Reuse the current page across unrelated reruns
+    page_key = (search, cursors[-1])
+    cached_page = st.session_state.history_pages.get(page_key)
+    if cached_page and time.time() - cached_page[0] < HISTORY_CACHE_TTL:
+        invoices = cached_page[1]
     else:
-        invoices = search_invoices()  # Get all invoices
+        invoices = search_invoices(*search, after=cursors[-1])
+        st.session_state.history_pages = {page_key: (time.time(), invoices)}
     
     # Display results
     if invoices:
-        st.markdown(f"**Found {len(invoices)} invoice(s)**")
+        total = st.session_state.history_count
+        first = (len(cursors) - 1) * HISTORY_PAGE_SIZE + 1
+        st.markdown(f"**Found {total if total is not None else '?'} invoice(s)** — showing {first}-{first + len(invoices) - 1}")
+        
+        prev_col, next_col, _ = st.columns([1, 1, 4])
+        with prev_col:
+            if st.button("◀ Previous", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with next_col:
+            if st.button("Next ▶", disabled=len(invoices) < HISTORY_PAGE_SIZE):
+                last = invoices[-1]
+                cursors.append((last[5], last[0]))
+                st.rerun()
         
+        # Items for the whole page are prefetched, so opening an invoice needs no rerun
+        page_items = get_invoice_items([invoice[0] for invoice in invoices])
         for invoice in invoices:
             with st.expander(f"📄 {invoice[0]} - {invoice[1]} (${invoice[3]:.2f})"):
                 col1, col2 = st.columns(2)
@@ -584,16 +872,58 @@ def show_invoice_history():
                     st.write(f"**Created By:** {invoice[4]}")
                     st.write(f"**Created Date:** {invoice[5].strftime('%Y-%m-%d %H:%M:%S')}")
                 
-                # Show invoice details
-                if st.button(f"View Details", key=f"details_{invoice[0]}"):
-                    master_data, items_data = get_invoice_details(invoice[0])
-                    if master_data and items_data:
-                        st.subheader("Invoice Items:")
-                        for item in items_data:
-                            st.write(f"• {item[0]} - Qty: {item[1]}, Price: ${item[2]:.2f}")
+                items_data = page_items.get(invoice[0])
+                if items_data:
+                    st.markdown("**Invoice Items:**\n\n" + "\n".join(
+                        f"- {item[0]} - Qty: {item[1]}, Price: \\${item[2]:.2f}" for item in items_data))
     else:
         st.info("No invoices found.")
 
+def show_background_jobs():
+    """This user's recent background extractions, with results ready to review"""
+    job_queue = get_job_queue()
+    jobs = job_queue.store.list(st.session_state.username, limit=10)
+    if not jobs:
+        return
+    st.subheader("🗂️ Background Jobs")
+    if not hasattr(st, "fragment"):
+        st.button("🔄 Refresh jobs")
+    now = time.time()
+    for job in jobs:
+        elapsed = (job['finished'] or now) - (job['started'] or job['created'])
+        pages = f", {job['pages']} pages" if job['pages'] else ""
+        col1, col2 = st.columns([4, 1])
+        col1.write(f"{JOB_STATUS_ICONS[job['status']]} {', '.join(job['files'])}{pages} "
+                   f"— {job['status']} ({elapsed:.0f}s)")
+        if job['status'] == "done":
+            if job['parse_error']:
+                col1.caption(f"⚠️ Result needs fixing: {job['parse_error']}")
+            if col2.button("📂 Open", key=f"open_job_{job['id']}"):
+                st.session_state.raw_json = job['raw_json']
+                release_session_pages()
+                st.session_state.current_documents = [tuple(document) for document in job['documents']]
+                st.rerun()
+        elif job['status'] == "failed":
+            col1.caption(f"❌ {job['error']}")
+            if job.get('duplicates'):
+                if col2.button("🔁 Process anyway", key=f"retry_job_{job['id']}"):
+                    job_queue.retry(job['id'], allow_duplicates=True)
+            elif col2.button("🔁 Retry", key=f"retry_job_{job['id']}"):
+                job_queue.retry(job['id'])
+
+# Poll job status without rerunning the whole page (Streamlit >= 1.37)
+if hasattr(st, "fragment"):
+    show_background_jobs = st.fragment(run_every=JOB_POLL_SECONDS)(show_background_jobs)
+
+def cancel_extraction():
+    # Runs at the start of the rerun, after Streamlit has interrupted the extraction,
+    # so the stream never sees the event set; count the cancellation here instead
+    cancel = st.session_state.pop('extraction_cancel', None)
+    if cancel is not None:
+        cancel.set()
+        extraction.record_cancelled()
+    st.session_state.extraction_stopped = True
+
 # Main invoice extraction page
 def show_invoice_page():
     # Header with logout button
@@ -641,14 +971,51 @@ def show_invoice_page():
             all_images = process_multiple_images(uploaded_files)
             st.session_state.current_images = all_images
             
+            duplicates = st.session_state.get('duplicate_documents', [])
+            for match in duplicates:
+                inserted_on = f" on {match['created_date']:%Y-%m-%d}" if match['created_date'] else ""
+                st.warning(f"⚠️ {match['upload_name']} was already inserted as invoice "
+                           f"{match['invoice_id']} by {match['created_by']}{inserted_on}, so it was not processed again.")
+            if duplicates and st.button("🔁 Process anyway"):
+                st.session_state.duplicate_overrides.update(match['content_hash'] for match in duplicates)
+                st.rerun()
+            
+            if all_images:
+                # Rescans of an inserted invoice have different bytes but near-identical pages
+                similar_checks = st.session_state.setdefault('similar_checks', {})
+                check_key = tuple(st.session_state.current_upload_keys)
+                if check_key not in similar_checks:
+                    page_hashes = [value for _, _, hashes in st.session_state.current_documents for value in hashes]
+                    try:
+                        similar_checks[check_key] = get_fingerprint_index().find_similar(page_hashes)
+                    except Exception:
+                        similar_checks[check_key] = []
+                for invoice_id, matching_pages in similar_checks[check_key][:3]:
+                    st.warning(f"🔁 This looks like a rescan of invoice {invoice_id} "
+                               f"({matching_pages} of {len(all_images)} pages nearly identical).")
+            
             if all_images:
                 st.write(f"📊 Total pages/images: {len(all_images)}")
+                usage = get_page_store().session_usage(page_session_id())
+                st.caption(f"💾 Session pages: {usage['memory_bytes'] / 1e6:.1f} MB in memory, "
+                           f"{usage['disk_bytes'] / 1e6:.1f} MB on disk "
+                           f"({usage['decoded_bytes'] / 1e6:.0f} MB if decoded)")
                 
-                # Show thumbnails of all pages
-                cols = st.columns(min(3, len(all_images)))
-                for idx, img in enumerate(all_images):
+                # Show small thumbnails, generated once per page, a page of the grid at a time
+                thumbnails = get_upload_cache().thumbnails(st.session_state.current_upload_keys, make_thumbnails)
+                if thumbnails is None:
+                    thumbnails = make_thumbnails(all_images)
+                preview_pages = (len(thumbnails) + PREVIEW_PAGE_SIZE - 1) // PREVIEW_PAGE_SIZE
+                preview_page = 1
+                if preview_pages > 1:
+                    preview_page = st.number_input("Preview page", min_value=1, max_value=preview_pages, value=1)
+                first = (preview_page - 1) * PREVIEW_PAGE_SIZE
+                visible = thumbnails[first:first + PREVIEW_PAGE_SIZE]
+                
+                cols = st.columns(min(3, len(visible)))
+                for idx, thumb in enumerate(visible):
                     with cols[idx % 3]:
-                        st.image(img, caption=f"Page {idx + 1}", use_column_width=True)
+                        st.image(thumb, caption=f"Page {first + idx + 1}", use_column_width=True)
 
     with left_col:
         user_prompt = st.text_area(
@@ -660,102 +1027,132 @@ def show_invoice_page():
         
         # Add button and store its state
         extract_button = st.button("🔍 Extract Invoice Data")
+        # Runs on a worker thread; the result shows up under Background Jobs
+        queue_button = st.button("📥 Extract in Background")
+        if queue_button:
+            if uploaded_files:
+                job = get_job_queue().submit(
+                    st.session_state.username,
+                    [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files],
+                    user_prompt,
+                    # Duplicates the user chose to process anyway above
+                    allow_duplicates=st.session_state.get('duplicate_overrides', ()),
+                )
+                st.success(f"📥 Queued {len(uploaded_files)} file(s) as job {job['id']}. "
+                           "You can keep working; the result appears below when it is ready.")
+            else:
+                st.warning("Please upload invoice files first!")
+        show_background_jobs()
 
     # System prompt for multi-page processing
-    system_prompt = """
-    You are a professional invoice extractor designed to handle multi-page invoices.
-    Read ALL the uploaded images carefully and consolidate the information from ALL pages into 
-    **ONE** comprehensive invoice structure in **strict JSON format**.
-
-    Important instructions:
-    1. Combine information from all pages into a single invoice
-    2. Aggregate all line items from all pages
-    3. Use the total amount from the final page or summary page
-    4. Return **ONLY** the extracted structured information in **strict JSON format**, no extra text or explanation
-
-    Your response must look like this (with sample values):
-
-    {
-      "invoice_id": "INV-001",
-      "customer": "John Doe",
-      "invoice_date": "2024-06-15",
-      "total": 250.75,
-      "items": [
-        {
-          "description": "Product A",
-          "quantity": 2,
-          "price": 100.00
-        },
-        {
-          "description": "Service Fee",
-          "quantity": 1,
-          "price": 50.75
-        }
-      ]
-    }
-
-    Notes:
-    - Return only valid, strict JSON
-    - Use double quotes for all keys and string values
-    - No trailing commas
-    - No extra formatting or Markdown
-    - All values must be filled or null (avoid empty strings)
-    - Consolidate ALL items from ALL pages
-    """
+    system_prompt = extraction.SYSTEM_PROMPT
 
     # Function to prepare multiple images for Gemini
     def prepare_image_data_list(images: List[Image.Image]):
-        image_parts = []
-        for img in images:
-            # Convert PIL Image to bytes
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            image_parts.append({
-                'mime_type': 'image/png',
-                'data': img_byte_arr
-            })
+        # Unchanged uploads reuse the payloads encoded on an earlier extraction
+        cached = get_upload_cache().payloads(st.session_state.get('current_upload_keys', []),
+                                             extraction.prepare_image_data_list)
+        if cached:
+            image_parts, payload_stats = cached
+        else:
+            image_parts, payload_stats = extraction.prepare_image_data_list(images)
+        st.session_state.payload_stats = payload_stats
         return image_parts
 
     # Function to get Gemini response for multiple images
     def get_gemini_response_multi(prompt_input, image_data_list, system_prompt):
-        # Create the content list with all images
-        content = [prompt_input, system_prompt] + image_data_list
-        response = model.generate_content(content)
-        return response.text
+        # Identical pages + prompts + model are answered from the extraction cache;
+        # long documents are extracted in concurrent page windows and merged
+        response_text, from_cache = extraction.extract_invoice(
+            get_model_client(), prompt_input, image_data_list, system_prompt, cache=get_extraction_cache()
+        )
+        st.session_state.extraction_from_cache = from_cache
+        return response_text
+
+    # Streams a single-request extraction, showing line items as they arrive
+    def stream_gemini_response(prompt_input, image_data_list, system_prompt, items_placeholder):
+        pd = startup.lazy_import("pandas")
+        cancel = threading.Event()
+        st.session_state.extraction_cancel = cancel
+        waiting = st.empty()
+
+        received = []
+
+        def show_wait(seconds):
+            # Touching the page while the stream is silent lets Streamlit interrupt it for Stop
+            waiting.caption(f"⏳ Waiting for Gemini… {seconds:.0f}s")
+
+        def show_item(item, header):
+            waiting.empty()
+            received.append(item)
+            with items_placeholder.container():
+                if header:
+                    st.caption(" · ".join(f"{key}: {value}" for key, value in header.items()))
+                st.dataframe(pd.DataFrame(received), use_container_width=True)
+
+        def show_retry(attempt):
+            # Items from a response that did not parse are replaced by the next attempt's
+            received.clear()
+            items_placeholder.empty()
+            waiting.caption(f"🔁 Gemini's response could not be read, asking again (attempt {attempt + 1})…")
+
+        response_text, from_cache = extraction.stream_gemini_response(
+            get_model_client(), prompt_input, image_data_list, system_prompt,
+            cache=get_extraction_cache(), on_item=show_item, cancel=cancel, on_wait=show_wait,
+            on_retry=show_retry
+        )
+        waiting.empty()
+        st.session_state.pop('extraction_cancel', None)
+        st.session_state.extraction_from_cache = from_cache
+        return response_text
 
     def clean_json_response(response):
+        # Memoized by response hash, so reruns do not re-parse unchanged JSON
         try:
-            # Remove everything before the first '{' and after the last '}'
-            cleaned = re.search(r'{.*}', response, re.DOTALL).group()
-            return json.loads(cleaned)
+            return extraction.clean_json_response(response)
+        except InvoiceValidationError as e:
+            st.error(f"❌ Extracted JSON doesn't match the invoice format: {e}")
+            return None
         except Exception as e:
             st.error(f"❌ Couldn't extract valid JSON from response: {e}")
             return None
 
     # Function to insert invoice data into SQL Server
-    def insert_invoice_data_to_sql_server(data):
+    def insert_invoice_data_to_sql_server(data, replace=False):
+        documents = st.session_state.get('current_documents', [])
         try:
-            conn = get_sql_server_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
-                INSERT INTO InvoiceMaster (invoice_id, customer, invoice_date, total, created_by)
-                VALUES (?, ?, ?, ?, ?)
-            """, data['invoice_id'], data['customer'], data['invoice_date'], data['total'], st.session_state.username)
-
-            for item in data['items']:
-                cursor.execute("""
-                    INSERT INTO InvoiceItems (invoice_id, description, quantity, price)
-                    VALUES (?, ?, ?, ?)
-                """, data['invoice_id'], item['description'], item['quantity'], item['price'])
-
-            conn.commit()
-            conn.close()
+            # Master row, items and source fingerprints commit together; any failure rolls all back
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                if not replace and existing_invoice_ids(cursor, [data['invoice_id']]):
+                    st.session_state.confirm_replace = data['invoice_id']
+                    st.warning(f"⚠️ Invoice {data['invoice_id']} already exists. "
+                               "Choose Replace existing to overwrite it with this data.")
+                    return False
+                if replace:
+                    upsert_invoices(cursor, [data], st.session_state.username)
+                else:
+                    insert_invoice(cursor, data, st.session_state.username)
+                if documents:
+                    get_fingerprint_index().record(cursor, data['invoice_id'], documents, st.session_state.username)
+                conn.commit()
+            if documents:
+                get_fingerprint_index().add(data['invoice_id'], documents)
+                # The uploader keeps these files across the rerun; flag them as inserted right away
+                known_documents = st.session_state.setdefault('known_documents', {})
+                duplicate_overrides = st.session_state.setdefault('duplicate_overrides', set())
+                for file_name, content_hash, _ in documents:
+                    known_documents[content_hash] = {
+                        'content_hash': content_hash, 'file_name': file_name, 'invoice_id': data['invoice_id'],
+                        'created_by': st.session_state.username, 'created_date': datetime.now(),
+                    }
+                    duplicate_overrides.discard(content_hash)
+            query_results.invalidate_tables(["InvoiceMaster", "InvoiceItems", *summaries.SUMMARY_TABLES])
+            get_detail_cache().invalidate([data['invoice_id']])
             
             # Log the action
-            log_audit(st.session_state.username, f"Inserted  invoice data", f"Invoice ID: {data['invoice_id']}")
+            action = "Replaced invoice data" if replace else "Inserted  invoice data"
+            log_audit(st.session_state.username, action, f"Invoice ID: {data['invoice_id']}")
             
             st.markdown('<div class="custom-success">✅ Invoice data inserted successfully into SQL Server!</div>', unsafe_allow_html=True)
             return True
@@ -767,18 +1164,65 @@ def show_invoice_page():
     if extract_button:
         if st.session_state.current_images:
             try:
-                with st.spinner("🔄 Processing all pages..."):
-                    image_data_list = prepare_image_data_list(st.session_state.current_images)
-                    response = get_gemini_response_multi(user_prompt, image_data_list, system_prompt)
-                    st.session_state.raw_json = response
+                image_data_list = prepare_image_data_list(st.session_state.current_images)
+                if extraction.CHUNK_PAGES and len(image_data_list) > extraction.CHUNK_PAGES:
+                    with st.spinner("🔄 Processing all pages..."):
+                        response = get_gemini_response_multi(user_prompt, image_data_list, system_prompt)
+                else:
+                    # Clicking Stop reruns the script, which abandons the stream
+                    st.button("⏹️ Stop extraction", on_click=cancel_extraction)
+                    items_placeholder = st.empty()
+                    with st.spinner("🔄 Receiving line items..."):
+                        response = stream_gemini_response(user_prompt, image_data_list,
+                                                          system_prompt, items_placeholder)
+                    items_placeholder.empty()
+                    timing = extraction.streaming_stats()
+                    if not st.session_state.get('extraction_from_cache') and timing['last_latency_ms']:
+                        first_item = timing['last_first_item_ms']
+                        st.caption(f"⏱️ First line item after {first_item / 1000:.1f}s, "
+                                   f"complete after {timing['last_latency_ms'] / 1000:.1f}s"
+                                   if first_item is not None else
+                                   f"⏱️ Complete after {timing['last_latency_ms'] / 1000:.1f}s")
+                st.session_state.raw_json = response
+                
+                payload_stats = st.session_state.get('payload_stats', [])
+                if payload_stats:
+                    pd = startup.lazy_import("pandas")
+                    bytes_after = sum(p['bytes_after'] for p in payload_stats)
+                    # PNG sizes are only measured when IMAGE_MEASURE_PNG is on
+                    measured = all(p.get('png_bytes') is not None for p in payload_stats)
+                    title = f"📦 Upload payload: {bytes_after / 1e6:.2f} MB sent"
+                    if measured:
+                        png_bytes = sum(p['png_bytes'] for p in payload_stats)
+                        title = f"📦 Upload payload: {png_bytes / 1e6:.1f} MB as PNG → {bytes_after / 1e6:.2f} MB sent"
+                    with st.expander(title):
+                        st.dataframe(pd.DataFrame([
+                            {
+                                'Page': idx + 1,
+                                'Original': f"{p['original_size'][0]}x{p['original_size'][1]}",
+                                'Sent': f"{p['sent_size'][0]}x{p['sent_size'][1]} {p['mode']} {p['format']}",
+                                **({'PNG Bytes': p['png_bytes']} if measured else {}),
+                                'Sent Bytes': p['bytes_after'],
+                            }
+                            for idx, p in enumerate(payload_stats)
+                        ]), use_container_width=True)
+                
+                if st.session_state.get('extraction_from_cache'):
+                    cache_stats = get_extraction_cache().stats()
+                    st.info(f"⚡ Loaded from extraction cache, no API call made "
+                            f"({cache_stats['hits']} hits / {cache_stats['misses']} misses)")
                 
                 # Log extraction attempt
                 log_audit(st.session_state.username, f"Extracted multi-page invoice data", f"Pages processed: {len(st.session_state.current_images)}")
                 
+            except extraction.ExtractionCancelled:
+                st.warning("Extraction stopped.")
             except Exception as e:
                 st.error(f"Error during extraction: {e}")
         else:
             st.warning("Please upload invoice files first!")
+    elif st.session_state.pop('extraction_stopped', False):
+        st.warning("Extraction stopped.")
 
     # Show editable JSON if available (only for admins)
     if st.session_state.raw_json:
@@ -818,9 +1262,17 @@ def show_invoice_page():
                     with col2:
                         if st.button("🗑️ Clear Data"):
                             st.session_state.raw_json = ""
-                            st.session_state.current_images = []
+                            release_session_pages()
                             st.rerun()
                     
+                    def finish_insert():
+                        st.session_state.raw_json = ""
+                        release_session_pages()
+                        st.session_state.show_confirmation = False
+                        st.session_state.confirm_replace = None
+                        time.sleep(2)
+                        st.rerun()
+                    
                     # Confirmation dialog
                     if st.session_state.get('show_confirmation', False):
                         st.markdown('<div class="custom-success">⚠️ Are you sure you want to insert this data into the database?</div>', unsafe_allow_html=True)
@@ -830,19 +1282,20 @@ def show_invoice_page():
                         with col1:
                             if st.button("✅ Yes, Insert", type="primary"):
                                 if insert_invoice_data_to_sql_server(data):
-                                    st.session_state.raw_json = ""
-                                    st.session_state.current_images = []
-                                    st.session_state.show_confirmation = False
-                                    time.sleep(2)
-                                    st.rerun()
+                                    finish_insert()
                         
                         with col2:
                             if st.button("❌ Cancel"):
                                 st.session_state.show_confirmation = False
+                                st.session_state.confirm_replace = None
                                 st.rerun()
                         
                         with col3:
-                            st.empty()  # Spacer
+                            # Offered once the insert found an invoice with the same ID
+                            if st.session_state.get('confirm_replace') == data['invoice_id']:
+                                if st.button("♻️ Replace existing"):
+                                    if insert_invoice_data_to_sql_server(data, replace=True):
+                                        finish_insert()
                             
             except Exception as e:
                 st.error(f"❌ Invalid JSON: {e}")
@@ -852,6 +1305,8 @@ def main():
     if not st.session_state.authenticated:
         show_login_page()
     else:
+        # Keeps this session's pages alive and reclaims those of idle sessions
+        get_page_store().touch(page_session_id())
         show_invoice_page()
 
 if __name__ == "__main__":
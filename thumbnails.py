@@ -0,0 +1,39 @@
+"""Small preview images for the upload grid.
+
+The preview only needs a few hundred pixels per page, so thumbnails are
+generated once per page, in parallel, as compact JPEG/WebP bytes. The
+high-resolution pages used for extraction are left untouched.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+THUMBNAIL_EDGE = int(os.getenv('THUMBNAIL_EDGE', '360'))
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'JPEG').upper()
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '70'))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '4'))
+
+
+def make_thumbnail(img: Image.Image, max_edge=THUMBNAIL_EDGE, image_format=THUMBNAIL_FORMAT,
+                   quality=THUMBNAIL_QUALITY) -> bytes:
+    """Encode a downscaled copy of ``img`` whose long edge is at most ``max_edge``."""
+    thumb = img.convert('RGB') if img.mode not in ('RGB', 'L') else img.copy()
+    # thumbnail() resizes in place, hence the copy above
+    thumb.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if image_format == 'WEBP':
+        thumb.save(buffer, format='WEBP', quality=quality)
+    else:
+        thumb.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def make_thumbnails(images, workers=THUMBNAIL_WORKERS):
+    """Thumbnails for ``images`` in order; PIL releases the GIL while resizing and encoding."""
+    if len(images) <= 1 or workers <= 1:
+        return [make_thumbnail(img) for img in images]
+    with ThreadPoolExecutor(max_workers=min(workers, len(images))) as executor:
+        # Index inside the workers, so lazily decoded pages are decoded one per thread
+        return list(executor.map(lambda idx: make_thumbnail(images[idx]), range(len(images))))
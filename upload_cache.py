@@ -0,0 +1,144 @@
+"""Process-wide cache of processed uploads, so reruns do not re-rasterize them.
+
+Streamlit re-runs the whole script on every widget interaction, and the
+uploaded files are handed back each time. Entries are keyed by a digest of
+the file bytes and hold the rendered pages (as a ``page_store.PageList``,
+so the pixels themselves live in the page store) plus, once needed, the
+encoded Gemini payloads and preview thumbnails. Memory held by those is
+bounded; least recently used uploads are evicted first.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def upload_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class UploadEntry:
+    """Everything derived from one uploaded file."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.payloads = None
+        self.payload_stats = None
+        self.thumbnails = None
+        self.page_hashes = None
+
+    @property
+    def nbytes(self):
+        # Page pixels are accounted for by the page store
+        total = 0
+        if self.payloads:
+            total += sum(len(part['data']) for part in self.payloads)
+        if self.thumbnails:
+            total += sum(len(thumb) for thumb in self.thumbnails)
+        return total
+
+
+class UploadCache:
+    """LRU map of upload digest -> UploadEntry, bounded by ``max_bytes``."""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, pages):
+        entry = UploadEntry(pages)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict_locked()
+        return entry
+
+    def _entries_for(self, keys):
+        with self._lock:
+            entries = [self._entries.get(key) for key in keys]
+        if not entries or any(entry is None for entry in entries):
+            return None
+        return entries
+
+    def payloads(self, keys, prepare):
+        """Encoded payloads for ``keys`` in order, preparing any that are missing.
+
+        ``prepare(pages)`` must return ``(parts, stats)``. Returns None if any
+        upload has been evicted, in which case the caller prepares from scratch.
+        """
+        entries = self._entries_for(keys)
+        if entries is None:
+            return None
+        parts, stats = [], []
+        for entry in entries:
+            if entry.payloads is None:
+                entry.payloads, entry.payload_stats = prepare(entry.pages)
+            parts.extend(entry.payloads)
+            stats.extend(entry.payload_stats)
+        with self._lock:
+            self._evict_locked()
+        return parts, stats
+
+    def thumbnails(self, keys, make):
+        """Preview thumbnails for ``keys`` in order, generating any that are missing.
+
+        ``make(pages)`` must return one thumbnail per page. Returns None if any
+        upload has been evicted.
+        """
+        entries = self._entries_for(keys)
+        if entries is None:
+            return None
+        thumbs = []
+        for entry in entries:
+            if entry.thumbnails is None:
+                entry.thumbnails = make(entry.pages)
+            thumbs.extend(entry.thumbnails)
+        with self._lock:
+            self._evict_locked()
+        return thumbs
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry.nbytes for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _evict_locked(self):
+        total = sum(entry.nbytes for entry in self._entries.values())
+        # Always keep the most recent entry, even if it alone exceeds the budget
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+            self.evictions += 1
+
+
+def get_upload_cache() -> UploadCache:
+    """Return the process-wide upload cache sized from UPLOAD_CACHE_MAX_MB."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UploadCache(int(float(os.getenv('UPLOAD_CACHE_MAX_MB', '512')) * 1024 * 1024))
+    return _cache